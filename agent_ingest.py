@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Ingestion des rapports envoyés par les agents des Mac (`POST /ingest`).
+
+Alternative à la collecte SSH : chaque Mac exécute `smartelia_agent.sh` (launchd)
+et envoie ses informations, dans le même schéma que `network_scanner.scan_ip`,
+éventuellement par lots (rapports en attente après une coupure) et compressées (gzip).
+
+- Idempotence : un rapport est identifié par (hostname, timestamp de l'agent) ;
+  seul un rapport plus récent que le dernier accepté pour la machine est retenu
+  (renvoi d'un lot déjà reçu, rapport plus ancien : ignorés).
+- Les rapports acceptés sont ajoutés à `ingest/pending.jsonl` (fsync) avant la
+  réponse : un agent peut vider sa file dès qu'il a reçu 200.
+- Toutes les FLUSH_SECONDS secondes, les rapports en attente sont publiés comme
+  un scan (snapshot, journal d'observations), daté à la réception : les dates
+  restent croissantes même si l'horloge d'un Mac dérive. Rollups et pré-rendu,
+  plus coûteux, sont faits hors verrou au plus une fois par ROLLUP_SECONDS
+  (voir publish_aggregates).
+  Ces publications sont partielles : elles ne comptent pas comme des scans du
+  parc dans la présence des rollups (voir history_store.py).
+
+Les scanners de site (`site_shipper.py`) envoient au même point d'entrée des
+lots {"site", "seq", "reports"} : chaque machine est étiquetée avec son site et
+un lot dont la séquence a déjà été reçue pour ce site est ignoré en entier.
+
+Les accès à `ingest/` sont protégés par un verrou fcntl (plusieurs workers uvicorn).
+"""
+import contextlib
+import fcntl
+import json
+import os
+import re
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from dashboard_renderer import atomic_write
+
+INGEST_DIR = os.getenv("INGEST_DIR", "ingest")
+# Jeton partagé attendu dans l'en-tête X-Ingest-Token (vide = pas de contrôle)
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+FLUSH_SECONDS = int(os.getenv("INGEST_FLUSH_SECONDS", "10"))
+# Alertes email évaluées au plus une fois par intervalle pour les données des agents
+ALERT_SECONDS = int(os.getenv("INGEST_ALERT_SECONDS", "600"))
+# Historique agrégé et pré-rendu mis à jour au plus une fois par intervalle pour ces données
+ROLLUP_SECONDS = int(os.getenv("INGEST_ROLLUP_SECONDS", "60"))
+MAX_BODY_BYTES = 5 * 1024 * 1024
+MAX_DECOMPRESSED_BYTES = 50 * 1024 * 1024
+
+DATE_FORMAT = "%Y%m%d_%H%M%S"
+STATE_FILE = "state.json"
+PENDING_FILE = "pending.jsonl"
+LOCK_FILE = "ingest.lock"
+SITE_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class PayloadError(ValueError):
+    """Charge utile illisible (JSON invalide, compression, taille)"""
+
+
+def _path(name, directory=None):
+    return os.path.join(directory or INGEST_DIR, name)
+
+
+@contextlib.contextmanager
+def _locked(directory=None):
+    path = _path(LOCK_FILE, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _load_state(directory=None):
+    try:
+        with open(_path(STATE_FILE, directory), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'hosts': {}, 'last_date': None, 'last_flush': 0}
+
+
+def _save_state(state, directory=None):
+    atomic_write(_path(STATE_FILE, directory), json.dumps(state, separators=(',', ':')).encode("utf-8"))
+
+
+def decode_payload(body, content_encoding=None):
+    """
+    Décode le corps d'une requête /ingest.
+
+    Formats acceptés : {"reports": [{"timestamp": ..., "machine": {...}}, ...]}
+    (avec "site" et "seq" pour un scanner de site) ou un rapport seul
+    {"timestamp": ..., "machine": {...}} ; gzip si Content-Encoding: gzip
+    (ou corps commençant par l'en-tête gzip).
+
+    Returns:
+        tuple: (rapports, site ou None, séquence ou None)
+    """
+    if len(body) > MAX_BODY_BYTES:
+        raise PayloadError(f"Charge utile trop volumineuse (> {MAX_BODY_BYTES} octets)")
+    if (content_encoding or "").lower() == "gzip" or body[:2] == b"\x1f\x8b":
+        try:
+            decompressor = zlib.decompressobj(wbits=31)
+            body = decompressor.decompress(body, MAX_DECOMPRESSED_BYTES)
+        except zlib.error as e:
+            raise PayloadError(f"Compression gzip invalide : {e}")
+        if decompressor.unconsumed_tail:
+            raise PayloadError("Charge utile décompressée trop volumineuse")
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise PayloadError(f"JSON invalide : {e}")
+    site = seq = None
+    if isinstance(payload, dict) and 'reports' in payload:
+        site, seq = payload.get('site'), payload.get('seq')
+        payload = payload['reports']
+    elif isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list):
+        raise PayloadError("Format attendu : {\"reports\": [...]}")
+    if site is not None and (not isinstance(site, str) or not SITE_PATTERN.match(site)):
+        raise PayloadError("Nom de site invalide")
+    if seq is not None and (site is None or isinstance(seq, bool) or not isinstance(seq, int) or seq < 1):
+        raise PayloadError("Séquence invalide (entier positif, avec un site)")
+    return payload, site, seq
+
+
+def validate_report(report):
+    """Retourne (hostname, timestamp, machine) ou None si le rapport est invalide"""
+    if not isinstance(report, dict):
+        return None
+    machine = report.get('machine')
+    timestamp = report.get('timestamp')
+    if not isinstance(machine, dict) or not isinstance(timestamp, str):
+        return None
+    hostname = machine.get('hostname')
+    if not isinstance(hostname, str) or not hostname or hostname == "Unknown":
+        return None
+    try:
+        datetime.strptime(timestamp, DATE_FORMAT)
+    except ValueError:
+        return None
+    return hostname, timestamp, machine
+
+
+def accept(reports, directory=None, site=None, seq=None, dedupe=True):
+    """
+    Enregistre les rapports nouveaux (dédupliqués par hostname et timestamp).
+
+    Avec `site`, les machines sont étiquetées avec leur site de provenance ;
+    avec `seq`, un lot déjà reçu (séquence <= dernière séquence du site) est ignoré.
+    `dedupe=False` pour les rescans de l'API (refresh_jobs.py) : datés par l'horloge
+    du serveur, ils ne sont ni comparés aux timestamps des agents, ni retenus pour
+    dédoublonner les rapports suivants.
+
+    Returns:
+        dict: nombre de rapports acceptés, en double et invalides
+    """
+    valid = []
+    rejected = 0
+    for report in reports:
+        checked = validate_report(report)
+        if checked is None:
+            rejected += 1
+        else:
+            valid.append(checked)
+    valid.sort(key=lambda r: r[1])
+
+    accepted = []
+    with _locked(directory):
+        state = _load_state(directory)
+        hosts = state['hosts']
+        if site is not None:
+            info = state.setdefault('sites', {}).setdefault(site, {'last_seq': 0, 'missed': 0})
+            if seq is not None:
+                if seq <= info['last_seq']:
+                    return {'accepted': 0, 'duplicates': len(valid), 'rejected': rejected, 'last_seq': info['last_seq']}
+                # Lots perdus côté site (file d'envoi pleine)
+                info['missed'] += max(0, seq - info['last_seq'] - 1)
+                info['last_seq'] = seq
+            info['last_seen'] = datetime.now().strftime(DATE_FORMAT)
+            for _, _, machine in valid:
+                machine['site'] = site
+        for hostname, timestamp, machine in valid:
+            if dedupe:
+                if timestamp <= hosts.get(hostname, ''):
+                    continue
+                hosts[hostname] = timestamp
+            accepted.append({'hostname': hostname, 'timestamp': timestamp, 'machine': machine})
+        if accepted:
+            with open(_path(PENDING_FILE, directory), "a", encoding="utf-8") as f:
+                for entry in accepted:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        if accepted or site is not None:
+            _save_state(state, directory)
+    return {'accepted': len(accepted), 'duplicates': len(valid) - len(accepted), 'rejected': rejected}
+
+
+def complete_machine(machine):
+    """Complète un rapport d'agent comme scan_ip (identifiant de modèle, taille, année)"""
+    import network_scanner
+    machine = dict(machine)
+    model_info = machine.get('model_info') or "Unknown"
+    if not machine.get('model_identifier') or machine.get('model_identifier') == "Unknown":
+        machine['model_identifier'] = network_scanner.extract_model_identifier(model_info)
+    if not machine.get('taille') or not machine.get('annee'):
+        machine['taille'], machine['annee'] = network_scanner.macbook_pro_models.get(
+            machine['model_identifier'], ("Unknown", "Unknown"))
+    for key in ('ip', 'mac', 'model_info', 'macos_version', 'disk_free', 'ram_info', 'current_user'):
+        if not machine.get(key):
+            machine[key] = "Unknown"
+    machine.setdefault('battery_status', {})
+    machine.setdefault('battery_details', {})
+    return machine
+
+
+def flush(publish=None, force=False, directory=None):
+    """
+    Publie les rapports en attente comme un scan (au plus une fois par FLUSH_SECONDS).
+
+    Returns:
+        int: nombre de machines publiées
+    """
+    pending_path = _path(PENDING_FILE, directory)
+    if not os.path.exists(pending_path):
+        return 0
+    with _locked(directory):
+        state = _load_state(directory)
+        if not force and time.time() - state.get('last_flush', 0) < FLUSH_SECONDS:
+            return 0
+        latest = {}
+        try:
+            with open(pending_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    latest[entry['hostname']] = entry['machine']
+        except FileNotFoundError:
+            return 0
+        if latest:
+            # Date du scan : réception, strictement postérieure au lot précédent
+            date = datetime.now()
+            if state.get('last_date'):
+                date = max(date, datetime.strptime(state['last_date'], DATE_FORMAT) + timedelta(seconds=1))
+            date = date.strftime(DATE_FORMAT)
+            (publish or publish_reports)([complete_machine(m) for m in latest.values()], date)
+            state['last_date'] = date
+            state['aggregate_pending'] = True
+        os.remove(pending_path)
+        state['last_flush'] = time.time()
+        _save_state(state, directory)
+    return len(latest)
+
+
+def publish_reports(machines, date):
+    """Même traitement qu'un scan partiel (alertes évaluées à part, voir alert_due)"""
+    import network_scanner
+    # Seul le CSV du dernier lot est conservé (comme pour un scan complet)
+    network_scanner.cleanup_old_csv()
+    network_scanner.process_results(machines, date, notify=False, partial=True, aggregate=False)
+
+
+def publish_aggregates(directory=None):
+    """
+    Rollups et pré-rendu des rapports publiés par flush, hors du verrou d'ingestion.
+
+    Au plus une fois par ROLLUP_SECONDS, tous workers confondus : le rechargement
+    complet des rollups ne bloque plus `accept` à chaque publication.
+
+    Returns:
+        bool: vrai si la mise à jour a été faite
+    """
+    with _locked(directory):
+        state = _load_state(directory)
+        if not state.get('aggregate_pending') or time.time() - state.get('last_aggregate', 0) < ROLLUP_SECONDS:
+            return False
+        state['aggregate_pending'] = False
+        state['last_aggregate'] = time.time()
+        _save_state(state, directory)
+    import network_scanner
+    network_scanner.update_aggregates()
+    return True
+
+
+def site_status(directory=None):
+    """Sites distants connus : dernière séquence reçue, lots perdus, dernier contact"""
+    with _locked(directory):
+        return _load_state(directory).get('sites', {})
+
+
+def alert_due(directory=None):
+    """Vrai (et réarmé) si les alertes n'ont pas été évaluées depuis ALERT_SECONDS, tous workers confondus"""
+    with _locked(directory):
+        state = _load_state(directory)
+        if time.time() - state.get('last_alert', 0) < ALERT_SECONDS:
+            return False
+        state['last_alert'] = time.time()
+        _save_state(state, directory)
+    return True
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Registre des collecteurs SSH : une information = un collecteur nommé.
+
+Chaque collecteur déclare sa commande distante, son analyseur (sortie -> champs
+du MachineRecord), son délai maximal et son niveau :
+- `core` : identification de la machine (hostname, modèle, version de macOS,
+  utilisateur), toujours exécutés ;
+- `standard` : disque et batterie ;
+- `extended` : commandes coûteuses sur le Mac (`top -l 1`) ;
+- `on_demand` : jamais exécutés par le scan, seulement à la demande par l'API
+  (applications ouvertes, voir live_apps.py).
+Un collecteur `static` (modèle, santé de la batterie) est mis en cache côté Mac
+par la sonde et rafraîchi une fois par jour.
+
+Configuration : `COLLECTOR_TIER` (niveau maximal exécuté, `extended` par défaut)
+et `COLLECTORS_DISABLED` (noms séparés par des virgules). Les champs d'un
+collecteur désactivé valent "Unknown".
+
+Durée, échecs et dépassements de délai de chaque collecteur sont comptés par jour
+dans `collector_stats.json` (fusion sous verrou fcntl, comme ssh_failures.py)
+et exposés par `GET /collectors` : les collecteurs les plus coûteux se
+repèrent sur des mesures du parc.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from dashboard_renderer import atomic_write
+
+TIERS = ('core', 'standard', 'extended')
+COLLECTOR_TIER = os.getenv("COLLECTOR_TIER", "extended")
+COLLECTORS_DISABLED = {name.strip() for name in os.getenv("COLLECTORS_DISABLED", "").split(",") if name.strip()}
+STATS_FILE = os.getenv("COLLECTOR_STATS_FILE", "collector_stats.json")
+STATS_DAYS = 7
+# Bornes (ms) de l'histogramme des durées ; la dernière case compte les durées au-delà
+LATENCY_BOUNDS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def parse_battery_status(battery_status_raw):
+    """Analyse la sortie de `pmset -g batt`"""
+    percent = None
+    power_plugged = None
+    time_left = None
+    drawing_from = None
+    percent_match = re.search(r'(\d+)%', battery_status_raw)
+    if percent_match:
+        percent = int(percent_match.group(1))
+    power_plugged = 'AC Power' in battery_status_raw or 'chargé' in battery_status_raw or 'charging' in battery_status_raw
+    time_left_match = re.search(r'(\d+:\d+) remaining', battery_status_raw)
+    if time_left_match:
+        time_left = time_left_match.group(1)
+    else:
+        time_left = None
+    drawing_from_match = re.search(r"Now drawing from '([^']+)'", battery_status_raw)
+    if drawing_from_match:
+        drawing_from = drawing_from_match.group(1)
+    return {
+        'percent': percent,
+        'power_plugged': power_plugged,
+        'time_left': time_left,
+        'drawing_from': drawing_from
+    }
+
+
+def parse_battery_details(output):
+    """Analyse les lignes Cycle Count / Condition / Maximum Capacity de `system_profiler SPPowerDataType`"""
+    cycle_count = None
+    max_capacity = None
+    condition = None
+    for line in output.splitlines():
+        if 'Cycle Count' in line:
+            try:
+                cycle_count = int(line.split(':')[-1].strip())
+            except ValueError:
+                pass
+        if 'Condition' in line:
+            condition = line.split(':')[-1].strip()
+        if 'Maximum Capacity' in line and max_capacity is None:
+            digits = re.sub(r'[^0-9]', '', line.split(':')[-1])
+            max_capacity = int(digits) if digits else None
+    return {
+        'cycle_count': cycle_count,
+        'max_capacity': max_capacity,
+        'condition': condition
+    }
+
+
+def _text(field, unknown_if_empty=True):
+    def parse(output):
+        value = output.strip()
+        return {field: value if value or not unknown_if_empty else "Unknown"}
+    return parse
+
+
+class Collector:
+    """Information collectée par une commande distante"""
+
+    __slots__ = ('name', 'command', 'parse', 'timeout', 'tier', 'static', 'fields')
+
+    def __init__(self, name, command, parse, fields, timeout=10, tier='standard', static=False):
+        self.name = name
+        self.command = command
+        self.parse = parse
+        self.fields = fields
+        self.timeout = timeout
+        self.tier = tier
+        self.static = static
+
+    @property
+    def enabled(self):
+        if self.tier == 'core':
+            return True
+        if self.tier == 'on_demand':
+            return False
+        return (self.name not in COLLECTORS_DISABLED
+                and TIERS.index(self.tier) <= TIERS.index(COLLECTOR_TIER if COLLECTOR_TIER in TIERS else 'extended'))
+
+    @property
+    def cache_key(self):
+        """Nom du cache côté Mac : change avec la commande (une nouvelle commande invalide le cache)"""
+        return f"{self.name}-{hashlib.sha1(self.command.encode('utf-8')).hexdigest()[:8]}"
+
+
+REGISTRY = {}
+
+
+def register(collector):
+    REGISTRY[collector.name] = collector
+    return collector
+
+
+register(Collector('hostname', 'hostname', _text('hostname'), ('hostname',), timeout=5, tier='core'))
+register(Collector('model', 'system_profiler SPHardwareDataType | grep "Model Name\\|Model Identifier"',
+                   lambda out: {'model_info': out.replace('\n', ' ').strip() or "Unknown"},
+                   ('model_info',), timeout=20, tier='core', static=True))
+register(Collector('macos_version', 'sw_vers -productVersion', _text('macos_version'), ('macos_version',),
+                   timeout=5, tier='core'))
+register(Collector('current_user', 'stat -f%Su /dev/console', _text('current_user'), ('current_user',),
+                   timeout=5, tier='core'))
+register(Collector('disk', "df -h / | awk 'NR==2 {print $4}'", _text('disk_free', False), ('disk_free',), timeout=5))
+register(Collector('battery', 'pmset -g batt', lambda out: {'battery_status': parse_battery_status(out.strip())},
+                   ('battery_status',), timeout=5))
+register(Collector('battery_health', 'system_profiler SPPowerDataType | grep -E "Cycle Count|Condition|Maximum Capacity"',
+                   lambda out: {'battery_details': parse_battery_details(out)},
+                   ('battery_details',), timeout=20, static=True))
+register(Collector('ram', 'top -l 1 | grep PhysMem | awk \'{print $2" used, "$6" free"}\'', _text('ram_info', False),
+                   ('ram_info',), timeout=10, tier='extended'))
+register(Collector('open_apps', 'osascript -e \'tell application "System Events" to get name of every process where background only is false\'',
+                   _text('open_apps', False), ('open_apps',), timeout=10, tier='on_demand'))
+
+# Valeurs des champs dont le collecteur est désactivé ou n'a rien renvoyé
+DEFAULTS = {
+    'hostname': "Unknown",
+    'model_info': "Unknown",
+    'macos_version': "Unknown",
+    'disk_free': "Unknown",
+    'ram_info': "Unknown",
+    'battery_status': {},
+    'battery_details': {},
+    'current_user': "Unknown"
+}
+
+
+def enabled_collectors():
+    return [c for c in REGISTRY.values() if c.enabled]
+
+
+def build_result(outputs):
+    """
+    Assemble le résultat SSH à partir des sorties des collecteurs.
+
+    Args:
+        outputs: {nom: (sortie, code retour, durée ms, délai dépassé, depuis le cache)}
+    """
+    result = dict(DEFAULTS)
+    for name, (output, rc, ms, timed_out, cached) in outputs.items():
+        collector = REGISTRY.get(name)
+        if collector is None:
+            continue
+        stats.record(name, ms, rc == 0 and not timed_out, timed_out, cached)
+        if timed_out:
+            continue
+        try:
+            result.update(collector.parse(output))
+        except Exception as e:
+            print(f"Erreur d'analyse du collecteur {name}: {e}")
+    return result
+
+
+def macos_check(outputs):
+    """
+    Verdict du collecteur macos_version sur le système distant.
+
+    Returns:
+        str: 'macos' ; 'not_macos' si la commande s'est exécutée et montre un autre
+        système (code retour non nul, sortie qui n'est pas une version) ; 'timeout'
+        ou 'error' (échecs transitoires : délai dépassé, canal fermé) ;
+        None si le collecteur est désactivé
+    """
+    entry = outputs.get('macos_version')
+    if entry is None:
+        return None
+    output, rc, ms, timed_out, cached = entry
+    if timed_out:
+        return 'timeout'
+    if rc is None or rc < 0:
+        return 'error'
+    if rc == 0 and re.match(r"^\d+(\.\d+)*$", output.strip()):
+        return 'macos'
+    return 'not_macos'
+
+
+def run_commands(ssh):
+    """Exécute chaque collecteur activé par une commande SSH distincte (sans sonde)"""
+    outputs = {}
+    for collector in enabled_collectors():
+        started = time.perf_counter()
+        output, rc, timed_out = "", -1, False
+        try:
+            stdin, stdout, stderr = ssh.exec_command(collector.command, timeout=collector.timeout)
+            output = stdout.read().decode(errors="replace")
+            rc = stdout.channel.recv_exit_status()
+        except TimeoutError:
+            timed_out = True
+        outputs[collector.name] = (output, rc, (time.perf_counter() - started) * 1000, timed_out, False)
+    return outputs
+
+
+class CollectorStats:
+    """Compteurs par collecteur et par jour, fusionnés dans STATS_FILE"""
+
+    def __init__(self, path=None):
+        self.path = path or STATS_FILE
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, ms, ok, timed_out=False, cached=False):
+        day = datetime.now().strftime("%Y%m%d")
+        with self._lock:
+            bucket = self._pending.setdefault(name, {}).setdefault(day, _empty_bucket())
+            _add(bucket, ms, ok, timed_out, cached)
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        oldest = (datetime.now() - timedelta(days=STATS_DAYS)).strftime("%Y%m%d")
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with open(os.path.join(directory, ".collector_stats.lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                data = self._read()
+                for name, days in pending.items():
+                    stored = data.setdefault(name, {})
+                    for day, bucket in days.items():
+                        _merge(stored.setdefault(day, _empty_bucket()), bucket)
+                for name in data:
+                    data[name] = {day: b for day, b in data[name].items() if day > oldest}
+                atomic_write(self.path, json.dumps(data, separators=(',', ':')).encode("utf-8"))
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def summary(self):
+        """Statistiques de chaque collecteur sur les STATS_DAYS derniers jours"""
+        data = self._read()
+        summary = {}
+        for name, collector in REGISTRY.items():
+            total = _empty_bucket()
+            for bucket in data.get(name, {}).values():
+                _merge(total, bucket)
+            measured = total['runs'] - total['cached']
+            summary[name] = {
+                'tier': collector.tier,
+                'enabled': collector.enabled,
+                'static': collector.static,
+                'timeout': collector.timeout,
+                'fields': list(collector.fields),
+                'runs': total['runs'],
+                'cached': total['cached'],
+                'failures': total['failures'],
+                'timeouts': total['timeouts'],
+                'failure_rate': round(total['failures'] / total['runs'], 4) if total['runs'] else None,
+                'avg_ms': round(total['ms'] / measured, 1) if measured else None,
+                'p95_ms': _percentile(total['hist'], 0.95, total['max']),
+                'max_ms': round(total['max'], 1) if measured else None,
+            }
+        return summary
+
+
+def _empty_bucket():
+    return {'runs': 0, 'failures': 0, 'timeouts': 0, 'cached': 0, 'ms': 0.0, 'max': 0.0,
+            'hist': [0] * (len(LATENCY_BOUNDS_MS) + 1)}
+
+
+def _add(bucket, ms, ok, timed_out, cached):
+    bucket['runs'] += 1
+    bucket['failures'] += 0 if ok else 1
+    bucket['timeouts'] += 1 if timed_out else 0
+    if cached:
+        # Lecture du cache côté Mac : pas une mesure du coût de la commande
+        bucket['cached'] += 1
+        return
+    bucket['ms'] += ms
+    bucket['max'] = max(bucket['max'], ms)
+    index = next((i for i, bound in enumerate(LATENCY_BOUNDS_MS) if ms <= bound), len(LATENCY_BOUNDS_MS))
+    bucket['hist'][index] += 1
+
+
+def _merge(into, bucket):
+    for key in ('runs', 'failures', 'timeouts', 'cached', 'ms'):
+        into[key] += bucket.get(key, 0)
+    into['max'] = max(into['max'], bucket.get('max', 0))
+    for i, count in enumerate(bucket.get('hist', [])[:len(into['hist'])]):
+        into['hist'][i] += count
+
+
+def _percentile(hist, q, maximum):
+    """Borne supérieure (ms) de la case de l'histogramme contenant le quantile q (au plus le maximum observé)"""
+    total = sum(hist)
+    if not total:
+        return None
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= q * total:
+            bound = LATENCY_BOUNDS_MS[i] if i < len(LATENCY_BOUNDS_MS) else maximum
+            return round(min(bound, maximum), 1)
+    return None
+
+
+stats = CollectorStats()
+
+
+def save_stats():
+    try:
+        stats.save()
+    except Exception as e:
+        print(f"Erreur lors de l'enregistrement des statistiques des collecteurs: {e}")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Pré-rendu statique du tableau de bord SMARTELIA (mode "render-on-write").
+
+Au lieu de rendre la page `/` via Jinja pour chaque visiteur, on la génère une
+seule fois à la fin de chaque scan (HTML + variante gzip) et on l'écrit de façon
+atomique dans `static/`. Les lignes du tableau sont ensuite chargées par le
+navigateur via `/machines` ; la page ne contient que la structure (colonnes).
+Un petit manifeste JSON pointe vers la version courante et porte son ETag ;
+l'API se contente de servir le fichier correspondant.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from jinja2 import Environment, FileSystemLoader
+
+# Activation du mode pré-rendu (DASHBOARD_PRERENDER=0 pour revenir au rendu Jinja à chaque requête)
+PRERENDER_ENABLED = os.getenv("DASHBOARD_PRERENDER", "1") != "0"
+STATIC_DIR = os.getenv("DASHBOARD_STATIC_DIR", "static")
+TEMPLATES_DIR = "templates"
+TEMPLATE_NAME = "machines_table.html"
+MANIFEST_NAME = "dashboard.json"
+
+# Colonnes affichées dans le tableau (partagées avec le rendu Jinja de l'API)
+DASHBOARD_COLUMNS = [
+    'ip', 'mac', 'hostname', 'model_info', 'macos_version', 'model_identifier',
+    'taille', 'annee', 'disk_free', 'ram_info',
+    'battery_status', 'battery_details', 'current_user', 'date_recuperation',
+    'charger_100_since', 'charger_100_duration', 'site'
+]
+
+# Cache du manifeste côté API : (mtime_ns, contenu)
+_manifest_cache = (None, None)
+
+
+def atomic_write(path, payload):
+    """Écrit `payload` (bytes) dans `path` via un fichier temporaire puis os.replace"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def render_dashboard_html():
+    """Rend le template du tableau de bord"""
+    # autoescape=True : même comportement que Jinja2Templates côté FastAPI
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True)
+    template = env.get_template(TEMPLATE_NAME)
+    return template.render(columns=DASHBOARD_COLUMNS)
+
+
+def write_dashboard():
+    """
+    Génère le tableau de bord et publie atomiquement la nouvelle version.
+
+    Les fichiers HTML/gzip sont nommés d'après le hash du contenu ; le manifeste
+    est remplacé en dernier, ce qui rend la bascule de version atomique pour l'API.
+
+    Returns:
+        dict: Le manifeste publié
+    """
+    html = render_dashboard_html().encode('utf-8')
+    digest = hashlib.sha256(html).hexdigest()[:16]
+    html_name = f"dashboard-{digest}.html"
+    gz_name = f"{html_name}.gz"
+
+    html_path = os.path.join(STATIC_DIR, html_name)
+    gz_path = os.path.join(STATIC_DIR, gz_name)
+    if not os.path.exists(html_path):
+        atomic_write(html_path, html)
+    if not os.path.exists(gz_path):
+        # mtime=0 : sortie gzip déterministe pour un même contenu
+        atomic_write(gz_path, gzip.compress(html, compresslevel=9, mtime=0))
+
+    # La version précédente est conservée : une requête en cours peut encore la servir
+    keep = {html_name, gz_name}
+    previous = _read_manifest(os.path.join(STATIC_DIR, MANIFEST_NAME))
+    if previous:
+        keep.update({previous.get('html'), previous.get('gzip')})
+
+    manifest = {
+        'etag': f'"{digest}"',
+        'html': html_name,
+        'gzip': gz_name,
+        'generated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    atomic_write(
+        os.path.join(STATIC_DIR, MANIFEST_NAME),
+        json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+    )
+    _remove_stale_versions(keep)
+    return manifest
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_stale_versions(keep):
+    """Supprime les anciennes versions du tableau de bord"""
+    for path in glob.glob(os.path.join(STATIC_DIR, "dashboard-*.html*")):
+        if os.path.basename(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def render_after_scan():
+    """Régénère le tableau de bord (appelé à la fin de chaque scan)"""
+    if not PRERENDER_ENABLED:
+        return None
+    manifest = write_dashboard()
+    print(f"Tableau de bord pré-rendu : {manifest['html']}")
+    return manifest
+
+
+def get_prerendered():
+    """
+    Retourne le manifeste du tableau de bord pré-rendu, ou None s'il n'existe pas.
+
+    Le manifeste n'est relu que si son mtime change : une requête ne coûte qu'un stat().
+    """
+    global _manifest_cache
+    if not PRERENDER_ENABLED:
+        return None
+    manifest_path = os.path.join(STATIC_DIR, MANIFEST_NAME)
+    try:
+        mtime = os.stat(manifest_path).st_mtime_ns
+    except OSError:
+        return None
+    cached_mtime, cached = _manifest_cache
+    if cached_mtime == mtime:
+        return cached
+    manifest = _read_manifest(manifest_path)
+    if manifest is None:
+        print(f"Erreur lors de la lecture du manifeste {manifest_path}")
+        return None
+    try:
+        manifest['html_path'] = os.path.join(STATIC_DIR, manifest['html'])
+        manifest['gzip_path'] = os.path.join(STATIC_DIR, manifest['gzip'])
+    except KeyError as e:
+        print(f"Manifeste {manifest_path} incomplet : {e}")
+        return None
+    _manifest_cache = (mtime, manifest)
+    return manifest
@@ -10,6 +10,7 @@ from datetime import datetime
 from jinja2 import Template
 import os
 from dotenv import load_dotenv
+from machine_record import MachineRecord
 
 load_dotenv()
 
@@ -70,7 +71,7 @@ def prepare_email_data(machines):
     Prépare les données pour le template email
     
     Args:
-        machines: Liste des machines du scan réseau
+        machines: Liste des machines du scan réseau (MachineRecord ou dicts)
     
     Returns:
         dict: Données formatées pour le template, ou None si aucune alerte
@@ -81,6 +82,7 @@ def prepare_email_data(machines):
     trigger_machine = None
     
     for machine in machines:
+        machine = MachineRecord.from_dict(machine)
         disk_free_str = machine.get('disk_free', 'Unknown')
         disk_space_gb = parse_disk_space(disk_free_str)
         
@@ -88,9 +90,9 @@ def prepare_email_data(machines):
             continue
         
         # Récupération des infos batterie
-        battery_status = machine.get('battery_status', {})
+        battery_status = machine.get('battery_status') or {}
         battery_percent = battery_status.get('percent', 'N/A')
-        drawing_from = battery_status.get('drawing_from', '')
+        drawing_from = battery_status.get('drawing_from') or ''
         
         # La machine est sur secteur si drawing_from contient "AC Power"
         is_on_ac_power = 'AC Power' in drawing_from
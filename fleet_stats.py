@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Colonnes NumPy du parc pour les agrégats (`/stats`).
+
+Chaque machine occupe une ligne ; chaque métrique est une colonne float64
+(NaN = valeur inconnue). Les colonnes sont mises à jour incrémentalement : à
+chaque nouvelle version de la fusion, seules les machines dont la date de
+récupération a changé sont recalculées, les machines disparues libèrent leur
+ligne. Pour chaque version, les valeurs connues de chaque colonne (et de chaque
+groupe) sont triées une seule fois : percentiles, seuils et histogrammes se
+réduisent ensuite à des indexations et des recherches dichotomiques.
+"""
+import threading
+
+import numpy as np
+
+from email_notifier import parse_disk_space
+from machine_index import FIELDS, parse_version
+
+GIB = 1024 ** 3
+
+
+def _version_code(version):
+    """(14, 2, 1) -> 140201 (comparable numériquement)"""
+    if not version:
+        return None
+    major, minor, patch = (tuple(version) + (0, 0))[:3]
+    return major * 10000 + minor * 100 + patch
+
+
+def _macos_code(entry):
+    return _version_code(FIELDS['macos'][1](entry))
+
+
+def _disk_bytes(entry):
+    value = FIELDS['disk'][1](entry)
+    return value * GIB if value is not None else None
+
+
+# Colonnes : nom -> (unité, extracteur)
+COLUMNS = {
+    'disk_bytes': ('bytes', _disk_bytes),
+    'battery_percent': ('%', FIELDS['battery'][1]),
+    'max_capacity': ('%', FIELDS['max_capacity'][1]),
+    'cycle_count': ('cycles', FIELDS['cycles'][1]),
+    'year': ('année', FIELDS['year'][1]),
+    'macos_version': ('code majeur*10000+mineur*100+correctif', _macos_code),
+}
+
+# Regroupements possibles : nom -> fonction colonnes -> clés de groupe
+GROUPS = {
+    'year': lambda cols: cols['year'],
+    'macos_major': lambda cols: np.floor(cols['macos_version'] / 10000),
+}
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def parse_threshold(metric, value):
+    """
+    Seuil dans l'unité de la colonne.
+
+    Pour le disque, accepte aussi '15GB', '500Mi'... ; pour macOS, une version ('14', '13.6').
+    """
+    if metric == 'macos_version':
+        code = _version_code(parse_version(value))
+        if code is None:
+            raise ValueError(f"Version invalide : {value!r}")
+        return code
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    if metric == 'disk_bytes':
+        gb = parse_disk_space(str(value))
+        if gb is not None:
+            return gb * GIB
+    raise ValueError(f"Seuil invalide pour {metric} : {value!r}")
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 3)
+
+
+class FleetColumns:
+    """Colonnes NumPy des machines de la fusion courante"""
+
+    def __init__(self, capacity=1024):
+        self.version = None
+        self.rows = {}
+        self.stamps = {}
+        self.free = []
+        self.size = 0
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.columns = {name: np.full(capacity, np.nan) for name in COLUMNS}
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    def _grow(self):
+        self.valid = np.concatenate([self.valid, np.zeros(len(self.valid), dtype=bool)])
+        for name, column in self.columns.items():
+            self.columns[name] = np.concatenate([column, np.full(len(column), np.nan)])
+
+    def _row(self, hostname):
+        row = self.rows.get(hostname)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                if self.size == len(self.valid):
+                    self._grow()
+                row = self.size
+                self.size += 1
+            self.rows[hostname] = row
+            self.valid[row] = True
+        return row
+
+    def update(self, machines, version):
+        """
+        Applique une nouvelle version de la fusion.
+
+        Returns:
+            int: nombre de machines recalculées
+        """
+        with self._lock:
+            seen = set()
+            changed = 0
+            for entry in machines:
+                hostname = entry.get('hostname')
+                if not hostname:
+                    continue
+                seen.add(hostname)
+                stamp = entry.get('date_recuperation')
+                if hostname in self.rows and stamp is not None and self.stamps.get(hostname) == stamp:
+                    continue
+                row = self._row(hostname)
+                for name, (_, extract) in COLUMNS.items():
+                    value = extract(entry)
+                    self.columns[name][row] = np.nan if value is None else value
+                self.stamps[hostname] = stamp
+                changed += 1
+            for hostname in [h for h in self.rows if h not in seen]:
+                row = self.rows.pop(hostname)
+                self.stamps.pop(hostname, None)
+                self.valid[row] = False
+                for column in self.columns.values():
+                    column[row] = np.nan
+                self.free.append(row)
+            self.version = version
+            self._sorted = {}
+            return changed
+
+    def _sorted_values(self, metric, group_by=None):
+        """
+        Valeurs connues triées, mises en cache pour la version courante.
+
+        Returns:
+            dict: clé de groupe (None sans regroupement) -> (valeurs triées, nb de valeurs inconnues)
+        """
+        key = (metric, group_by)
+        with self._lock:
+            cached = self._sorted.get(key)
+            if cached is not None:
+                return cached
+            valid = self.valid[:self.size]
+            column = self.columns[metric][:self.size][valid]
+            if group_by:
+                groups = GROUPS[group_by]({n: c[:self.size][valid] for n, c in self.columns.items()})
+                parts = {str(_number(g)): groups == g for g in np.unique(groups[~np.isnan(groups)])}
+                unknown = np.isnan(groups)
+                if unknown.any():
+                    parts['unknown'] = unknown
+            else:
+                parts = {None: slice(None)}
+            cached = {}
+            for group, selector in parts.items():
+                values = column[selector]
+                known = np.sort(values[~np.isnan(values)])
+                cached[group] = (known, len(values) - len(known))
+            self._sorted[key] = cached
+            return cached
+
+    def stats(self, metric, percentiles=DEFAULT_PERCENTILES, bins=10, below=None, above=None, group_by=None):
+        """Comptages, percentiles, histogramme (et regroupement optionnel) d'une colonne"""
+        values, missing = self._sorted_values(metric)[None]
+        result = {'metric': metric, 'unit': COLUMNS[metric][0], 'machines': len(values) + missing}
+        result.update(self._summary(values, missing, percentiles, below, above))
+        if len(values):
+            result['histogram'] = self._histogram(values, bins)
+        if group_by:
+            result['group_by'] = group_by
+            result['groups'] = {
+                group: self._summary(group_values, group_missing, percentiles, below, above)
+                for group, (group_values, group_missing) in self._sorted_values(metric, group_by).items()
+            }
+        return result
+
+    def summary(self):
+        """Résumé de toutes les colonnes (sans histogramme)"""
+        result = {'machines': None, 'metrics': {}}
+        for name in COLUMNS:
+            values, missing = self._sorted_values(name)[None]
+            result['machines'] = len(values) + missing
+            result['metrics'][name] = {'unit': COLUMNS[name][0], **self._summary(values, missing, (50,))}
+        return result
+
+    @staticmethod
+    def _histogram(values, bins):
+        """Équivalent de np.histogram sur des valeurs déjà triées"""
+        low, high = values[0], values[-1]
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges = np.linspace(low, high, bins + 1)
+        # Intervalles [a, b[ sauf le dernier, fermé [a, b]
+        index = np.searchsorted(values, edges, side='left')
+        index[-1] = len(values)
+        return {'edges': [_number(e) for e in edges], 'counts': np.diff(index).tolist()}
+
+    @staticmethod
+    def _summary(values, missing, percentiles, below=None, above=None):
+        count = len(values)
+        summary = {'count': count, 'missing': int(missing)}
+        if count:
+            # Interpolation linéaire, comme np.percentile
+            position = np.asarray(percentiles, dtype=float) / 100 * (count - 1)
+            lower = np.floor(position).astype(int)
+            upper = np.minimum(lower + 1, count - 1)
+            points = values[lower] + (values[upper] - values[lower]) * (position - lower)
+            summary.update({
+                'min': _number(values[0]),
+                'max': _number(values[-1]),
+                'mean': _number(values.mean()),
+                'percentiles': {f"p{_number(p)}": _number(v) for p, v in zip(percentiles, points)},
+            })
+        if below is not None:
+            summary['below'] = {'threshold': _number(below), 'count': int(np.searchsorted(values, below, side='left'))}
+        if above is not None:
+            summary['above'] = {'threshold': _number(above), 'count': int(count - np.searchsorted(values, above, side='right'))}
+        return summary
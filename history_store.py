@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Historique agrégé (rollups) des métriques machines.
+
+Chaque scan est intégré une seule fois dans des buckets horaires, par machine
+et pour l'ensemble du parc (clé FLEET_KEY). Les buckets horaires anciens sont
+ensuite compactés en buckets journaliers (voir retention.py). Un bucket conserve
+[min, max, somme, nombre, dernière valeur, horodatage de la dernière valeur],
+ce qui permet de recombiner des buckets en buckets plus larges sans revenir
+aux scans bruts. Les requêtes de l'API (`/machines/{hostname}/history`,
+`/history`) ne lisent que ces agrégats.
+
+Présence (`online`) : part des scans complets du bucket où la machine a été
+vue. Les publications partielles (snapshots `.partial` : lots de l'ordonnanceur
+continu, rapports des agents, scan interrompu) ne comptent pas comme des scans
+du parc ; elles marquent seulement la machine comme vue dans le bucket. Pour
+un bucket sans scan complet, la présence du parc est le nombre de machines vues.
+
+Stockage : un fichier par niveau (`history/rollups_hour.json.gz`,
+`history/rollups_day.json.gz`), JSON compressé en colonnes
+(une liste par champ : t, min, max, sum, count, last, last_ts).
+Chargement, intégration et sauvegarde se font sous verrou fcntl
+(`history/rollups.lock`) : le scanner, l'API et la rétention ne s'écrasent pas.
+"""
+import contextlib
+import fcntl
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from dashboard_renderer import atomic_write
+from machine_index import FIELDS
+import snapshot_store
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+ROLLUP_FILE = "rollups_{tier}.json.gz"
+LOCK_FILE = "rollups.lock"
+
+# Taille des buckets par niveau d'agrégation (secondes)
+TIERS = {'hour': 3600, 'day': 86400}
+
+# Métriques agrégées : nom exposé -> champ de machine_index.FIELDS ('online' = présence)
+ROLLUP_METRICS = {
+    'battery_percent': 'battery',
+    'max_capacity': 'max_capacity',
+    'disk_free_gb': 'disk',
+}
+ALL_METRICS = tuple(ROLLUP_METRICS) + ('online',)
+
+# Pseudo-machine portant les agrégats du parc (online = nombre de machines vues par scan)
+FLEET_KEY = '__fleet__'
+
+COLUMNS = ('min', 'max', 'sum', 'count', 'last', 'last_ts')
+
+
+def bucket_start(tier, ts):
+    """Début du bucket contenant `ts` (minuit local pour les buckets journaliers)"""
+    if tier == 'day':
+        dt = datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int(dt.timestamp())
+    size = TIERS[tier]
+    return int(ts // size * size)
+
+
+def _merge_agg(agg, other):
+    """Fusionne l'agrégat `other` dans `agg` (listes au format COLUMNS)"""
+    if other[0] < agg[0]:
+        agg[0] = other[0]
+    if other[1] > agg[1]:
+        agg[1] = other[1]
+    agg[2] += other[2]
+    agg[3] += other[3]
+    if other[5] >= agg[5]:
+        agg[4] = other[4]
+        agg[5] = other[5]
+
+
+def scan_observations(machines):
+    """Valeurs agrégées d'un scan : liste de (hostname, {métrique: valeur})"""
+    observations = []
+    seen = set()
+    for entry in machines:
+        host = entry.get('hostname')
+        if not host or host in seen:
+            continue
+        seen.add(host)
+        values = {}
+        for metric, field in ROLLUP_METRICS.items():
+            value = FIELDS[field][1](entry)
+            if value is not None:
+                values[metric] = value
+        observations.append((host, values))
+    return observations
+
+
+def _observe(date, machines):
+    """Version de scan_observations pour snapshot_store.map_snapshots (processus de travail)"""
+    return scan_observations(machines)
+
+
+class RollupStore:
+    """Buckets agrégés : tiers[tier][host][metric][bucket_start] = [min, max, sum, count, last, last_ts]"""
+
+    def __init__(self, directory=HISTORY_DIR):
+        self.directory = directory
+        self.tiers = {tier: {} for tier in TIERS}
+        # Horodatage ("YYYYmmdd_HHMMSS") du dernier scan intégré : garantit l'idempotence
+        self.high_water = None
+        # Niveaux modifiés depuis le dernier chargement (seuls ceux-ci sont réécrits)
+        self.dirty = set()
+
+    # --- Écriture -------------------------------------------------------
+
+    def _add(self, host, metric, start, agg, tier='hour'):
+        buckets = self.tiers[tier].setdefault(host, {}).setdefault(metric, {})
+        current = buckets.get(start)
+        if current is None:
+            buckets[start] = list(agg)
+        else:
+            _merge_agg(current, agg)
+        self.dirty.add(tier)
+
+    def add_scan(self, dt, machines, partial=False):
+        """Intègre un scan (liste de machines) horodaté `dt` dans les buckets horaires"""
+        self.add_observations(dt, scan_observations(machines), partial)
+
+    def add_observations(self, dt, observations, partial=False):
+        """
+        Intègre les observations d'un scan, extraites par scan_observations().
+
+        `partial` : publication ne couvrant qu'une partie du parc ; la machine est
+        marquée vue (nombre 0) sans compter de scan du parc.
+        """
+        ts = int(dt.timestamp())
+        start = bucket_start('hour', ts)
+        fleet = {metric: [] for metric in ROLLUP_METRICS}
+        seen = 0 if partial else 1
+        for host, values in observations:
+            self._add(host, 'online', start, [1, 1, seen, seen, 1, ts])
+            for metric, value in values.items():
+                fleet[metric].append(value)
+                self._add(host, metric, start, [value, value, value, 1, value, ts])
+
+        # Agrégats du parc : une observation par scan (dernière valeur = moyenne du scan)
+        if not partial:
+            online = len(observations)
+            self._add(FLEET_KEY, 'online', start, [online, online, online, 1, online, ts])
+        for metric, values in fleet.items():
+            if values:
+                total = sum(values)
+                avg = total / len(values)
+                self._add(FLEET_KEY, metric, start, [min(values), max(values), total, len(values), avg, ts])
+
+    def compact(self, before_ts):
+        """
+        Compacte les buckets horaires antérieurs à `before_ts` en buckets journaliers.
+
+        Les agrégats étant additifs, un jour peut être alimenté en plusieurs fois.
+
+        Returns:
+            int: Nombre de buckets horaires compactés
+        """
+        compacted = 0
+        for host, metrics in self.tiers['hour'].items():
+            for metric, buckets in metrics.items():
+                old = [b for b in buckets if b < before_ts]
+                for b in old:
+                    self._add(host, metric, bucket_start('day', b), buckets.pop(b), tier='day')
+                compacted += len(old)
+        if compacted:
+            self.dirty.add('hour')
+        return compacted
+
+    def prune(self, tier, before_ts):
+        """Supprime les buckets du niveau `tier` antérieurs à `before_ts`"""
+        removed = 0
+        for host in list(self.tiers[tier]):
+            metrics = self.tiers[tier][host]
+            for metric in list(metrics):
+                buckets = metrics[metric]
+                for b in [b for b in buckets if b < before_ts]:
+                    del buckets[b]
+                    removed += 1
+                if not buckets:
+                    del metrics[metric]
+            if not metrics:
+                del self.tiers[tier][host]
+        if removed:
+            self.dirty.add(tier)
+        return removed
+
+    # --- Lecture --------------------------------------------------------
+
+    def hosts(self):
+        hosts = set(self.tiers['hour']) | set(self.tiers['day'])
+        hosts.discard(FLEET_KEY)
+        return sorted(hosts)
+
+    def _buckets(self, tier, host, metric):
+        """Buckets d'une métrique au niveau `tier` ; au niveau jour, inclut les heures pas encore compactées"""
+        hourly = self.tiers['hour'].get(host, {}).get(metric, {})
+        if tier == 'hour':
+            return hourly
+        buckets = {b: list(agg) for b, agg in self.tiers['day'].get(host, {}).get(metric, {}).items()}
+        for b, agg in hourly.items():
+            day = bucket_start('day', b)
+            if day in buckets:
+                _merge_agg(buckets[day], agg)
+            else:
+                buckets[day] = list(agg)
+        return buckets
+
+    def _seen_counts(self, tier, origin, end, bucket_seconds):
+        """Nombre de machines vues par bucket : présence du parc là où il n'y a que des publications partielles"""
+        seen = {}
+        for host in self.hosts():
+            for b, agg in self._rebucket(self._buckets(tier, host, 'online'), origin, end, bucket_seconds, tier).items():
+                count = seen.setdefault(b, [0, 0])
+                count[0] += 1
+                count[1] = max(count[1], agg[5])
+        return seen
+
+    def query(self, host, metrics, start, end, bucket_seconds):
+        """
+        Série agrégée pour `host` (ou FLEET_KEY) entre `start` et `end` (timestamps).
+
+        Les buckets du niveau le plus grossier compatible avec `bucket_seconds`
+        sont recombinés en buckets de `bucket_seconds` alignés sur `start`.
+        Au niveau horaire, seule la période non encore compactée est disponible.
+
+        Returns:
+            dict: {metric: {'t': [...], 'min': [...], 'max': [...], 'avg': [...], 'last': [...]}}
+            ou None si la machine est inconnue
+        """
+        tier = 'day' if bucket_seconds >= TIERS['day'] else 'hour'
+        if host not in self.tiers['hour'] and host not in self.tiers['day']:
+            return None
+        origin = bucket_start(tier, start)
+        scans = self._rebucket(self._buckets(tier, FLEET_KEY, 'online'), origin, end, bucket_seconds, tier)
+
+        series = {}
+        for metric in metrics:
+            out = self._rebucket(self._buckets(tier, host, metric), origin, end, bucket_seconds, tier)
+            if metric == 'online' and host == FLEET_KEY:
+                for b, (count, last_ts) in self._seen_counts(tier, origin, end, bucket_seconds).items():
+                    out.setdefault(b, [count, count, count, 1, count, last_ts])
+            columns = {'t': [], 'min': [], 'max': [], 'avg': [], 'last': []}
+            for b in sorted(out):
+                agg = out[b]
+                columns['t'].append(datetime.fromtimestamp(b).strftime("%Y-%m-%d %H:%M:%S"))
+                if metric == 'online' and host != FLEET_KEY:
+                    # Présence : part des scans complets du bucket où la machine a été vue
+                    # (1 si elle n'a été vue que dans des publications partielles)
+                    total_scans = scans[b][3] if b in scans else agg[3]
+                    ratio = min(agg[3] / total_scans, 1.0) if agg[3] and total_scans else 1.0
+                    last_scan = scans[b][5] if b in scans else agg[5]
+                    columns['min'].append(1 if ratio >= 1.0 else 0)
+                    columns['max'].append(1)
+                    columns['avg'].append(round(ratio, 4))
+                    columns['last'].append(1 if agg[5] >= last_scan else 0)
+                else:
+                    columns['min'].append(agg[0])
+                    columns['max'].append(agg[1])
+                    columns['avg'].append(round(agg[2] / agg[3], 2) if agg[3] else None)
+                    columns['last'].append(agg[4])
+            series[metric] = columns
+        return series
+
+    @staticmethod
+    def _rebucket(buckets, origin, end, bucket_seconds, tier='hour'):
+        """
+        Recombine `buckets` en buckets de `bucket_seconds` à partir de `origin`.
+
+        Au niveau jour, les buckets (minuit local) sont regroupés par date
+        calendaire : un jour de changement d'heure dure 23 ou 25 heures.
+        """
+        out = {}
+        if tier == 'day':
+            first = datetime.fromtimestamp(origin).date()
+            days = max(1, bucket_seconds // TIERS['day'])
+        for b, agg in buckets.items():
+            if b < origin or b >= end:
+                continue
+            if tier == 'day':
+                offset = (datetime.fromtimestamp(b).date() - first).days // days * days
+                key = int(datetime.combine(first + timedelta(days=offset), datetime.min.time()).timestamp())
+            else:
+                key = origin + (b - origin) // bucket_seconds * bucket_seconds
+            current = out.get(key)
+            if current is None:
+                out[key] = list(agg)
+            else:
+                _merge_agg(current, agg)
+        return out
+
+    # --- Persistance ----------------------------------------------------
+
+    def tier_path(self, tier):
+        return os.path.join(self.directory, ROLLUP_FILE.format(tier=tier))
+
+    def tier_payload(self, tier):
+        hosts = {}
+        for host, metrics in self.tiers[tier].items():
+            hosts[host] = {}
+            for metric, buckets in metrics.items():
+                keys = sorted(buckets)
+                columns = {'t': keys}
+                for i, name in enumerate(COLUMNS):
+                    columns[name] = [buckets[k][i] for k in keys]
+                hosts[host][metric] = columns
+        return {'version': 2, 'tier': tier, 'high_water': self.high_water, 'hosts': hosts}
+
+    def load_tier(self, tier, payload):
+        if tier == 'hour':
+            self.high_water = payload.get('high_water')
+        hosts = self.tiers[tier]
+        for host, metrics in payload.get('hosts', {}).items():
+            for metric, columns in metrics.items():
+                rows = zip(*(columns[name] for name in COLUMNS))
+                hosts.setdefault(host, {})[metric] = {t: list(row) for t, row in zip(columns['t'], rows)}
+
+    def save(self, force=False):
+        """Réécrit (atomiquement) les niveaux modifiés ; le niveau horaire porte le high-water mark"""
+        for tier in TIERS:
+            if not force and tier not in self.dirty:
+                continue
+            payload = json.dumps(self.tier_payload(tier), separators=(',', ':')).encode('utf-8')
+            atomic_write(self.tier_path(tier), gzip.compress(payload, compresslevel=6))
+        self.dirty.clear()
+
+    @classmethod
+    def load(cls, directory=HISTORY_DIR):
+        store = cls(directory)
+        for tier in TIERS:
+            path = store.tier_path(tier)
+            if os.path.exists(path):
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    store.load_tier(tier, json.load(f))
+        return store
+
+
+def ingest_snapshots(store, workers=None):
+    """
+    Intègre dans `store` les snapshots plus récents que son high-water mark.
+
+    La lecture et l'extraction des métriques sont parallélisées par chaîne de
+    snapshots quand il y en a beaucoup (reconstruction complète de l'historique).
+    """
+    added = 0
+    partial = snapshot_store.partial_dates()
+    for date, observations in snapshot_store.map_snapshots(_observe, since=store.high_water, workers=workers):
+        store.add_observations(datetime.strptime(date, snapshot_store.DATE_FORMAT), observations, date in partial)
+        store.high_water = date
+        added += 1
+    return added
+
+
+@contextlib.contextmanager
+def locked(directory=HISTORY_DIR):
+    """Verrou inter-processus à tenir de RollupStore.load() jusqu'à store.save()"""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def update_from_snapshots():
+    """Met à jour les rollups persistés avec les nouveaux scans (appelé après chaque scan)"""
+    with locked():
+        store = RollupStore.load()
+        added = ingest_snapshots(store)
+        if added:
+            store.save()
+    if added:
+        print(f"Historique agrégé mis à jour : {added} scan(s) intégré(s)")
+    return added
+
+
+# Cache côté API : (mtime_ns des fichiers, store)
+_store_cache = (None, None)
+
+
+def get_store():
+    """Retourne le RollupStore persisté, relu uniquement si le fichier a changé"""
+    global _store_cache
+    mtime = []
+    for tier in TIERS:
+        try:
+            mtime.append(os.stat(os.path.join(HISTORY_DIR, ROLLUP_FILE.format(tier=tier))).st_mtime_ns)
+        except OSError:
+            mtime.append(None)
+    mtime = tuple(mtime)
+    cached_mtime, cached = _store_cache
+    if cached_mtime == mtime:
+        return cached
+    store = RollupStore.load()
+    _store_cache = (mtime, store)
+    return store
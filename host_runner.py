@@ -4,11 +4,10 @@
 Utilisation prévue : ce script est appelé périodiquement par systemd-timer ou launchd.
 Il fait :
 - change le working dir vers le dossier du projet (pour écrire les JSON/CSV au bon endroit)
-- nettoie les anciens fichiers JSON si > 5
+- applique la rétention (agrège les anciens scans en rollups avant de supprimer les JSON bruts)
 - appelle `network_scanner.main()`
 """
 import os
-import glob
 import logging
 import sys
 
@@ -19,23 +18,13 @@ os.chdir(HERE)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
 
-def cleanup_json_limit(max_files=5, pattern="smartelia_machines_*.json"):
-    files = glob.glob(pattern)
-    if len(files) <= max_files:
-        return
-    files_sorted = sorted(files, key=lambda f: os.path.getmtime(f))
-    while len(files_sorted) > max_files:
-        to_remove = files_sorted.pop(0)
-        try:
-            os.remove(to_remove)
-            logging.info(f"Removed old json file: {to_remove}")
-        except Exception:
-            logging.exception(f"Failed to remove {to_remove}")
-
-
 def main():
     logging.info("Host runner started: cleaning and launching network scan")
-    cleanup_json_limit(5)
+    try:
+        import retention
+        retention.run_retention()
+    except Exception:
+        logging.exception("Error while applying retention")
     try:
         # Import local module and call main
         import network_scanner
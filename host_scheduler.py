@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Ordonnanceur continu, machine par machine.
+
+Au lieu de scanner toute la plage toutes les 10 minutes avec 100 threads (pic
+de CPU et de réseau, puis plus rien), chaque IP a sa propre échéance dans un tas
+(heapq). Les échéances initiales sont réparties sur tout l'intervalle et chaque
+replanification est décalée d'une gigue aléatoire : la charge reste uniforme.
+
+L'intervalle de chaque machine s'adapte :
+- divisé par deux (jusqu'à MIN_INTERVAL) quand ses métriques bougent (batterie
+  qui se vide ou varie, disque qui se remplit) ;
+- multiplié par 1,5 (jusqu'à MAX_INTERVAL) quand elle est stable ;
+- BASE_INTERVAL pour les IP sans machine SMARTELIA (découverte).
+
+Le débit est borné (RATE scans/s, CONCURRENCY scans simultanés). Les résultats
+sont publiés par lots toutes les BATCH_SECONDS secondes (snapshot, journal
+d'observations, rollups, pré-rendu) comme des publications partielles : elles ne
+comptent pas comme des scans du parc dans la présence des rollups. Alertes et
+rétention sont évaluées une fois par BASE_INTERVAL sur l'ensemble du parc.
+"""
+import concurrent.futures
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import email_notifier
+import network_scanner
+import retention
+from machine_index import FIELDS
+from scan_priority import BATTERY_CHANGE, DISK_CHANGE_GB
+
+BASE_INTERVAL = network_scanner.SCAN_INTERVAL_SECONDS
+MIN_INTERVAL = int(os.getenv("SCHEDULER_MIN_INTERVAL", "120"))
+MAX_INTERVAL = int(os.getenv("SCHEDULER_MAX_INTERVAL", "1800"))
+# Gigue relative appliquée à chaque replanification (0.1 = ±10%)
+JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+# Débit maximal (scans démarrés par seconde) et nombre de scans simultanés
+RATE = float(os.getenv("SCHEDULER_RATE", "4"))
+CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "16"))
+BATCH_SECONDS = int(os.getenv("SCHEDULER_BATCH_SECONDS", "60"))
+
+
+def is_changing(previous, entry):
+    """Vrai si la machine est sur batterie ou si batterie/disque ont varié depuis le scan précédent"""
+    if FIELDS['on_battery'][1](entry):
+        return True
+    for field, threshold in (('battery', BATTERY_CHANGE), ('disk', DISK_CHANGE_GB)):
+        before = FIELDS[field][1](previous)
+        after = FIELDS[field][1](entry)
+        if before is not None and after is not None and abs(after - before) >= threshold:
+            return True
+    return False
+
+
+class HostScheduler:
+    """Tas des échéances (date, ordre, ip) et intervalle adaptatif de chaque IP"""
+
+    def __init__(self, ips, publish=None, clock=time.monotonic, rate=RATE, concurrency=CONCURRENCY):
+        self.publish = publish or self.publish_batch
+        self.clock = clock
+        self.rate = rate
+        self.concurrency = concurrency
+        self.heap = []
+        self.intervals = {}
+        # Dernière observation (dict) de chaque IP hébergeant une machine SMARTELIA
+        self.last = {}
+        self.pending = []
+        self.scanned = 0
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        now = clock()
+        for ip in ips:
+            # Échéances initiales réparties uniformément sur l'intervalle
+            self._push(ip, now + random.uniform(0, BASE_INTERVAL))
+
+    def _push(self, ip, due):
+        heapq.heappush(self.heap, (due, next(self._order), ip))
+
+    def next_interval(self, ip, entry):
+        """Nouvel intervalle de `ip` d'après son observation (dict ou None)"""
+        previous = self.last.get(ip)
+        interval = self.intervals.get(ip, BASE_INTERVAL)
+        if entry is None:
+            return BASE_INTERVAL
+        if previous is None:
+            return interval
+        if is_changing(previous, entry):
+            return max(MIN_INTERVAL, interval / 2)
+        return min(MAX_INTERVAL, interval * 1.5)
+
+    def complete(self, ip, record, now=None):
+        """Résultat du scan de `ip` (MachineRecord ou None) : replanification et mise en attente"""
+        now = self.clock() if now is None else now
+        entry = None
+        if record is not None and network_scanner.is_smartelia_machine(record.get('hostname', '')):
+            entry = record.to_dict()
+        with self._lock:
+            interval = self.next_interval(ip, entry)
+            self.intervals[ip] = interval
+            if entry is None:
+                self.last.pop(ip, None)
+            else:
+                self.last[ip] = entry
+                self.pending.append(record)
+            self.scanned += 1
+            self._push(ip, now + interval * random.uniform(1 - JITTER, 1 + JITTER))
+
+    def _scan(self, ip, ssh_credentials, slots):
+        record = None
+        try:
+            record = network_scanner.scan_ip(ip, ssh_credentials)
+        except Exception as e:
+            print(f"Erreur lors du scan de {ip}: {e}")
+        finally:
+            slots.release()
+            self.complete(ip, record)
+
+    def flush(self):
+        """Publie les machines scannées depuis le lot précédent"""
+        network_scanner.save_scan_state()
+        with self._lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        # Une seule entrée par machine (la plus récente)
+        latest = {}
+        for record in batch:
+            latest[record.get('hostname')] = record
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        try:
+            self.publish(list(latest.values()), timestamp)
+        except Exception as e:
+            print(f"Erreur lors de la publication du lot {timestamp}: {e}")
+        return len(latest)
+
+    @staticmethod
+    def publish_batch(results, timestamp):
+        # Seul le CSV du dernier lot est conservé (comme pour un scan complet)
+        network_scanner.cleanup_old_csv()
+        # Lot partiel : l'historique agrégé ne le compte pas comme un scan du parc
+        network_scanner.process_results(results, timestamp, notify=False, partial=True)
+
+    def housekeeping(self):
+        """Une fois par BASE_INTERVAL : rétention et alertes sur l'ensemble du parc"""
+        try:
+            retention.run_retention()
+        except Exception as e:
+            print(f"Erreur lors de la rétention: {e}")
+        with self._lock:
+            fleet = list(self.last.values())
+        if fleet:
+            print("\n🔔 Vérification des alertes...")
+            email_notifier.check_and_notify(fleet)
+
+    def status(self):
+        with self._lock:
+            intervals = [self.intervals[ip] for ip in self.last if ip in self.intervals]
+            return {
+                'queued': len(self.heap),
+                'machines': len(self.last),
+                'scanned': self.scanned,
+                'min_interval': round(min(intervals)) if intervals else None,
+                'max_interval': round(max(intervals)) if intervals else None,
+            }
+
+    def run(self, stop=None, ssh_credentials=None):
+        """Boucle de distribution : démarre les scans échus, au plus `rate` par seconde"""
+        stop = stop or threading.Event()
+        slots = threading.BoundedSemaphore(self.concurrency)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="host-scan")
+        gap = 1.0 / self.rate
+        next_dispatch = last_flush = self.clock()
+        next_housekeeping = last_flush
+        try:
+            while not stop.is_set():
+                now = self.clock()
+                if now >= next_housekeeping:
+                    self.housekeeping()
+                    next_housekeeping = now + BASE_INTERVAL
+                if now - last_flush >= BATCH_SECONDS:
+                    published = self.flush()
+                    last_flush = now
+                    if published:
+                        print(f"Ordonnanceur : {published} machine(s) publiée(s), {self.status()}")
+                with self._lock:
+                    due = self.heap[0][0] if self.heap else now + 1
+                wait = max(due, next_dispatch) - now
+                if wait > 0:
+                    # Réveil au moins chaque seconde (nouvelles échéances, lot à publier)
+                    stop.wait(min(wait, 1.0))
+                    continue
+                if not slots.acquire(timeout=1.0):
+                    continue
+                with self._lock:
+                    _, _, ip = heapq.heappop(self.heap)
+                next_dispatch = max(now, next_dispatch) + gap
+                executor.submit(self._scan, ip, ssh_credentials, slots)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.flush()
+
+
+def main():
+    print(f"Démarrage de l'ordonnanceur continu (intervalle {BASE_INTERVAL}s, {RATE} scans/s max)")
+    scheduler = HostScheduler(network_scanner.get_ips_to_scan())
+    scheduler.run(ssh_credentials=network_scanner.get_ssh_credentials())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Applications ouvertes interrogées à la demande (`GET /machines/{hostname}/apps`).
+
+La requête `osascript` (processus avec interface) est lente et peut bloquer sans
+session graphique : elle ne fait plus partie du scan périodique (collecteur
+`open_apps` de niveau `on_demand`, voir collectors.py). L'API l'exécute seulement
+quand quelqu'un consulte les applications d'une machine :
+- connexions SSH réutilisées (SSHPool) : fermées après SSH_POOL_IDLE_SECONDS
+  d'inactivité, SSH_POOL_MAX connexions au plus ; une connexion réutilisée qui
+  échoue (Mac redémarré, mis en veille) est remplacée par une nouvelle, un seul essai ;
+- résultat gardé APPS_CACHE_SECONDS secondes ;
+- requêtes simultanées pour une même machine regroupées : une seule commande SSH.
+
+La commande vérifie aussi le nom d'hôte : si l'IP du dernier scan a été
+réattribuée à une autre machine, rien n'est renvoyé (409).
+"""
+import concurrent.futures
+import os
+import threading
+import time
+from datetime import datetime
+
+import paramiko
+
+import collectors
+import ssh_failures
+
+APPS_CACHE_SECONDS = int(os.getenv("APPS_CACHE_SECONDS", "60"))
+POOL_IDLE_SECONDS = int(os.getenv("SSH_POOL_IDLE_SECONDS", "300"))
+POOL_MAX = int(os.getenv("SSH_POOL_MAX", "32"))
+CONNECT_TIMEOUT = 5
+
+
+class AppsQueryError(Exception):
+    """Interrogation impossible ; `status_code` est le code HTTP à renvoyer"""
+
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SSHPool:
+    """Connexions SSH ouvertes, par IP : {ip: [client, dernière utilisation]}"""
+
+    def __init__(self, credentials=None, idle=POOL_IDLE_SECONDS, max_size=POOL_MAX):
+        self._credentials = credentials
+        self.idle = idle
+        self.max_size = max_size
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def credentials(self):
+        if self._credentials is None:
+            import network_scanner
+            self._credentials = network_scanner.get_ssh_credentials() or {}
+        return self._credentials
+
+    def _connect(self, ip):
+        creds = self.credentials()
+        if not creds.get('username'):
+            raise AppsQueryError("Identifiants SSH non configurés", 503)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(ip, username=creds['username'], password=creds.get('password'), timeout=CONNECT_TIMEOUT)
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def acquire(self, ip):
+        """
+        Connexion ouverte vers `ip` (réutilisée si encore active).
+
+        Returns:
+            tuple: (client, vrai si la connexion vient du pool)
+        """
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for other, (client, used) in list(self._clients.items()):
+                if now - used > self.idle:
+                    stale.append(self._clients.pop(other)[0])
+            entry = self._clients.get(ip)
+            if entry is not None:
+                transport = entry[0].get_transport()
+                if transport is not None and transport.is_active():
+                    entry[1] = now
+                    client = entry[0]
+                else:
+                    stale.append(self._clients.pop(ip)[0])
+                    client = None
+            else:
+                client = None
+        for old in stale:
+            old.close()
+        if client is not None:
+            return client, True
+        client = self._connect(ip)
+        with self._lock:
+            previous = self._clients.get(ip)
+            self._clients[ip] = [client, time.monotonic()]
+            # Au-delà de max_size : fermeture des connexions les moins récemment utilisées
+            evicted = sorted(self._clients.items(), key=lambda item: item[1][1])[:max(0, len(self._clients) - self.max_size)]
+            for other, _ in evicted:
+                del self._clients[other]
+        if previous is not None and previous[0] is not client:
+            previous[0].close()
+        for _, (old, _) in evicted:
+            old.close()
+        return client, False
+
+    def discard(self, ip):
+        with self._lock:
+            entry = self._clients.pop(ip, None)
+        if entry is not None:
+            entry[0].close()
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client, _ in clients:
+            client.close()
+
+    def __len__(self):
+        return len(self._clients)
+
+
+def parse_apps(output):
+    """Liste des applications à partir de la sortie d'osascript ("Finder, Safari, ...")"""
+    value = collectors.REGISTRY['open_apps'].parse(output).get('open_apps') or ""
+    return [app.strip() for app in value.split(",") if app.strip()]
+
+
+class AppsService:
+    """Cache (hostname -> résultat) et regroupement des requêtes simultanées"""
+
+    def __init__(self, pool=None, ttl=APPS_CACHE_SECONDS, clock=time.monotonic):
+        self.pool = pool or SSHPool()
+        self.ttl = ttl
+        self.clock = clock
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def query(self, entry, refresh=False):
+        """
+        Applications ouvertes de la machine `entry` (entrée de la fusion).
+
+        Returns:
+            dict: hostname, ip, apps, fetched_at, cached
+        """
+        hostname = entry.get('hostname')
+        with self._lock:
+            cached = self._cache.get(hostname)
+            if cached is not None and not refresh and self.clock() - cached[0] < self.ttl:
+                return dict(cached[1], cached=True)
+            future = self._inflight.get(hostname)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[hostname] = future
+        if not owner:
+            # Une interrogation est déjà en cours pour cette machine : même résultat
+            return dict(future.result(), cached=False)
+        try:
+            result = self._fetch(hostname, entry.get('ip'), entry.get('mac'))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            with self._lock:
+                self._cache[hostname] = (self.clock(), result)
+            future.set_result(result)
+            return dict(result, cached=False)
+        finally:
+            with self._lock:
+                self._inflight.pop(hostname, None)
+            ssh_failures.save()
+            collectors.save_stats()
+
+    def _fetch(self, hostname, ip, mac):
+        if not ip or ip == "Unknown":
+            raise AppsQueryError(f"Adresse IP inconnue pour {hostname}", 404)
+        if ssh_failures.should_skip(ip, mac):
+            raise AppsQueryError(f"{hostname} ({ip}) en attente après un échec SSH récent", 503)
+        collector = collectors.REGISTRY['open_apps']
+        started = time.perf_counter()
+        while True:
+            reused = False
+            try:
+                client, reused = self.pool.acquire(ip)
+                stdin, stdout, stderr = client.exec_command(f"hostname; {collector.command}", timeout=collector.timeout)
+                output = stdout.read().decode(errors="replace")
+                rc = stdout.channel.recv_exit_status()
+                break
+            except AppsQueryError:
+                raise
+            except TimeoutError:
+                self.pool.discard(ip)
+                collectors.stats.record(collector.name, (time.perf_counter() - started) * 1000, False, timed_out=True)
+                raise AppsQueryError(f"Délai dépassé pour {hostname} ({ip})", 504)
+            except Exception as e:
+                self.pool.discard(ip)
+                if reused:
+                    # Connexion du pool coupée côté Mac : nouvel essai sur une nouvelle connexion
+                    continue
+                ssh_failures.record_failure(ip, mac, ssh_failures.classify(e))
+                raise AppsQueryError(f"Connexion SSH impossible à {hostname} ({ip}) : {e}", 502)
+        collectors.stats.record(collector.name, (time.perf_counter() - started) * 1000, rc == 0)
+        remote_hostname, _, apps_output = output.partition("\n")
+        if remote_hostname.strip() != hostname:
+            raise AppsQueryError(f"{ip} correspond maintenant à {remote_hostname.strip() or 'une autre machine'}", 409)
+        return {
+            'hostname': hostname,
+            'ip': ip,
+            'apps': parse_apps(apps_output),
+            'fetched_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def close(self):
+        self.pool.close()
+
+
+_service = {}
+_service_lock = threading.Lock()
+
+
+def get_service():
+    with _service_lock:
+        if 'service' not in _service:
+            _service['service'] = AppsService()
+        return _service['service']
+
+
+def query(entry, refresh=False):
+    return get_service().query(entry, refresh)
+
+
+def close():
+    with _service_lock:
+        service = _service.pop('service', None)
+    if service is not None:
+        service.close()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Petit langage de filtre pour `/machines?filter=`.
+
+Exemples :
+    battery < 30 and on_battery
+    disk < 15 GB and macos < 14
+    (model = "Mac15,3" or year <= 2020) and not on_ac
+    hostname ~ compta
+
+Grammaire :
+    expr       := and_expr ('or' and_expr)*
+    and_expr   := not_expr ('and' not_expr)*
+    not_expr   := 'not' not_expr | '(' expr ')' | comparison | champ_booléen
+    comparison := champ op valeur        op : < <= > >= = == != ~ (contient)
+    valeur     := nombre [unité] | "chaîne" | mot
+
+Les expressions sont compilées une seule fois (cache LRU) puis évaluées sur les
+buckets d'un MachineIndex (ensembles d'ids), sans parcourir toutes les machines.
+"""
+import re
+from functools import lru_cache
+
+from machine_index import FIELDS, NUMERIC, BOOLEAN, CATEGORY, VERSION, parse_version, resolve_field
+
+# Conversion des unités d'espace disque vers des Go
+UNITS = {
+    'k': 1 / (1024 * 1024), 'kb': 1 / (1024 * 1024), 'ko': 1 / (1024 * 1024), 'ki': 1 / (1024 * 1024),
+    'm': 1 / 1024, 'mb': 1 / 1024, 'mo': 1 / 1024, 'mi': 1 / 1024,
+    'g': 1, 'gb': 1, 'go': 1, 'gi': 1, 'gib': 1,
+    't': 1024, 'tb': 1024, 'to': 1024, 'ti': 1024,
+    '%': 1,
+}
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)*)(?:\s*(?P<unit>%|[a-zA-Z]{1,3}\b))? |
+        (?P<string>"[^"]*"|'[^']*') |
+        (?P<op><=|>=|==|!=|<|>|=|~) |
+        (?P<paren>[()]) |
+        (?P<word>[A-Za-z_][\w\-.,]*)
+    )""", re.VERBOSE)
+
+KEYWORDS = {'and', 'or', 'not'}
+
+
+class FilterError(ValueError):
+    """Expression de filtre invalide"""
+
+
+def tokenize(source):
+    tokens = []
+    pos = 0
+    source = source.strip()
+    while pos < len(source):
+        match = TOKEN_PATTERN.match(source, pos)
+        if not match or match.end() == pos:
+            raise FilterError(f"Caractère inattendu à la position {pos} : {source[pos:pos + 10]!r}")
+        pos = match.end()
+        if match.group('number') is not None:
+            unit = (match.group('unit') or '').lower()
+            if unit and unit not in UNITS and unit not in KEYWORDS:
+                raise FilterError(f"Unité inconnue : {match.group('unit')}")
+            if unit in KEYWORDS:
+                # "30and" n'est pas une unité : on rend le mot-clé au flux
+                tokens.append(('number', (match.group('number'), '')))
+                tokens.append(('word', unit))
+            else:
+                tokens.append(('number', (match.group('number'), unit)))
+        elif match.group('string') is not None:
+            tokens.append(('string', match.group('string')[1:-1]))
+        elif match.group('op') is not None:
+            tokens.append(('op', match.group('op')))
+        elif match.group('paren') is not None:
+            tokens.append(('paren', match.group('paren')))
+        else:
+            tokens.append(('word', match.group('word')))
+    return tokens
+
+
+class _Parser:
+    """Analyseur descendant récursif produisant un arbre de tuples"""
+
+    def __init__(self, source):
+        self.tokens = tokenize(source)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def keyword(self, word):
+        kind, value = self.peek()
+        if kind == 'word' and value.lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        if not self.tokens:
+            raise FilterError("Expression vide")
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise FilterError(f"Élément inattendu : {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.keyword('or'):
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.keyword('and'):
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.keyword('not'):
+            return ('not', self.parse_not())
+        kind, value = self.peek()
+        if kind == 'paren' and value == '(':
+            self.next()
+            node = self.parse_or()
+            if self.next() != ('paren', ')'):
+                raise FilterError("Parenthèse fermante manquante")
+            return node
+        if kind != 'word':
+            raise FilterError(f"Nom de champ attendu, obtenu {value!r}")
+        self.next()
+        field = resolve_field(value)
+        if field is None:
+            raise FilterError(f"Champ inconnu : {value!r} (champs disponibles : {', '.join(sorted(FIELDS))})")
+        op_kind, op = self.peek()
+        if op_kind != 'op':
+            if FIELDS[field][0] != BOOLEAN:
+                raise FilterError(f"Opérateur attendu après {value!r}")
+            return ('bool', field)
+        self.next()
+        value_kind, literal = self.next()
+        if value_kind not in ('number', 'string', 'word'):
+            raise FilterError(f"Valeur attendue après {value} {op}")
+        return ('cmp', field, op, value_kind, literal)
+
+
+def _numeric_literal(value_kind, literal):
+    if value_kind != 'number':
+        raise FilterError(f"Valeur numérique attendue, obtenu {literal!r}")
+    number, unit = literal
+    if number.count('.') > 1:
+        raise FilterError(f"Nombre invalide : {number}")
+    return float(number) * UNITS.get(unit, 1)
+
+
+def _text_literal(value_kind, literal):
+    if value_kind == 'number':
+        number, unit = literal
+        return number + unit
+    return literal
+
+
+def _compile_node(node):
+    """Transforme l'arbre en une fonction index -> ensemble d'ids"""
+    kind = node[0]
+    if kind == 'or':
+        left, right = _compile_node(node[1]), _compile_node(node[2])
+        return lambda index: left(index) | right(index)
+    if kind == 'and':
+        left, right = _compile_node(node[1]), _compile_node(node[2])
+        return lambda index: left(index) & right(index)
+    if kind == 'not':
+        inner = _compile_node(node[1])
+        return lambda index: index.all_ids - inner(index)
+    if kind == 'bool':
+        field = node[1]
+        return lambda index: set(index.booleans[field])
+
+    _, field, op, value_kind, literal = node
+    field_kind = FIELDS[field][0]
+
+    if field_kind == NUMERIC:
+        value = _numeric_literal(value_kind, literal)
+        if op in ('=', '=='):
+            return lambda index: index.numeric_range(field, value, value)
+        if op == '!=':
+            return lambda index: index.numeric_range(field) - index.numeric_range(field, value, value)
+        if op == '<':
+            return lambda index: index.numeric_range(field, high=value, include_high=False)
+        if op == '<=':
+            return lambda index: index.numeric_range(field, high=value)
+        if op == '>':
+            return lambda index: index.numeric_range(field, low=value, include_low=False)
+        if op == '>=':
+            return lambda index: index.numeric_range(field, low=value)
+        raise FilterError(f"Opérateur {op} non supporté pour le champ numérique {field}")
+
+    if field_kind == VERSION:
+        target = parse_version(_text_literal(value_kind, literal))
+        if target is None:
+            raise FilterError(f"Version invalide : {literal!r}")
+        # Comparaison à la précision du littéral : "macos < 14" compare la version majeure
+        comparators = {
+            '<': lambda v: v[:len(target)] < target,
+            '<=': lambda v: v[:len(target)] <= target,
+            '>': lambda v: v[:len(target)] > target,
+            '>=': lambda v: v[:len(target)] >= target,
+            '=': lambda v: v[:len(target)] == target,
+            '==': lambda v: v[:len(target)] == target,
+            '!=': lambda v: v[:len(target)] != target,
+        }
+        if op not in comparators:
+            raise FilterError(f"Opérateur {op} non supporté pour le champ version {field}")
+        predicate = comparators[op]
+        return lambda index: index.bucket_ids(field, predicate)
+
+    if field_kind == CATEGORY:
+        text = _text_literal(value_kind, literal).lower()
+        if op in ('=', '=='):
+            return lambda index: set(index.categories[field].get(text, ()))
+        if op == '!=':
+            return lambda index: index.bucket_ids(field, lambda key: key != text)
+        if op == '~':
+            return lambda index: index.bucket_ids(field, lambda key: text in key)
+        raise FilterError(f"Opérateur {op} non supporté pour le champ texte {field}")
+
+    # Champ booléen comparé explicitement : on_ac = true
+    expected = _text_literal(value_kind, literal).lower() in ('true', '1', 'yes', 'oui', 'vrai')
+    if op in ('!=',):
+        expected = not expected
+    elif op not in ('=', '=='):
+        raise FilterError(f"Opérateur {op} non supporté pour le champ booléen {field}")
+    if expected:
+        return lambda index: set(index.booleans[field])
+    return lambda index: index.all_ids - index.booleans[field]
+
+
+class CompiledFilter:
+    """Filtre compilé, évaluable sur n'importe quelle version de l'index"""
+
+    def __init__(self, source, evaluate):
+        self.source = source
+        self.evaluate = evaluate
+
+
+@lru_cache(maxsize=256)
+def compile_filter(source):
+    """Compile une expression de filtre (résultat mis en cache)"""
+    tree = _Parser(source).parse()
+    return CompiledFilter(source, _compile_node(tree))
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Index en mémoire des machines fusionnées.
+
+Chaque machine est normalisée une seule fois (espace disque en Go, batterie en %,
+version macOS en tuple...) puis rangée dans des "buckets" :
+- champs numériques : liste triée (valeur, id) interrogée par bisection
+- champs booléens : ensemble des ids pour lesquels le champ est vrai
+- champs catégoriels / versions : dictionnaire valeur -> ensemble d'ids
+
+Les filtres (voir machine_filter.py) sont évalués sur ces buckets au lieu de
+parcourir toutes les machines.
+"""
+import bisect
+import re
+from collections import OrderedDict
+
+from email_notifier import parse_disk_space, CRITICAL_THRESHOLD, WARNING_THRESHOLD
+
+# Seuil batterie faible (identique aux alertes email)
+LOW_BATTERY_THRESHOLD = 30
+
+
+def parse_version(value):
+    """Convertit '14.2.1' en (14, 2, 1) ; None si la version est inconnue"""
+    if value is None:
+        return None
+    parts = re.findall(r'\d+', str(value))
+    return tuple(int(p) for p in parts) if parts else None
+
+
+def normalize_mac(value):
+    """Normalise une adresse MAC ('A-B-0C-...' ou 'a:b:c:...') en '0a:0b:0c:...'"""
+    if not value or value == "Unknown":
+        return None
+    parts = re.split(r'[:\-]', str(value).strip().lower())
+    if len(parts) != 6:
+        return None
+    try:
+        return ':'.join(f"{int(p, 16):02x}" for p in parts)
+    except ValueError:
+        return None
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _drawing_from(entry):
+    batt = entry.get('battery_status') or {}
+    return str(batt.get('drawing_from') or '') if isinstance(batt, dict) else ''
+
+
+def _on_ac(entry):
+    drawing_from = _drawing_from(entry)
+    if drawing_from:
+        return 'AC' in drawing_from
+    batt = entry.get('battery_status') or {}
+    return isinstance(batt, dict) and batt.get('power_plugged') is True
+
+
+def _battery(entry):
+    batt = entry.get('battery_status') or {}
+    return _int_or_none(batt.get('percent')) if isinstance(batt, dict) else None
+
+
+def _battery_detail(entry, key):
+    details = entry.get('battery_details') or {}
+    return _int_or_none(details.get(key)) if isinstance(details, dict) else None
+
+
+def _below(value, threshold, inclusive=False):
+    if value is None:
+        return False
+    return value <= threshold if inclusive else value < threshold
+
+
+def _text(entry, key):
+    value = entry.get(key)
+    if value is None or value == "Unknown":
+        return None
+    return str(value)
+
+
+# Champs filtrables : nom -> (type, extracteur)
+NUMERIC, BOOLEAN, CATEGORY, VERSION = 'numeric', 'boolean', 'category', 'version'
+
+FIELDS = {
+    'disk': (NUMERIC, lambda e: parse_disk_space(e.get('disk_free'))),
+    'battery': (NUMERIC, _battery),
+    'max_capacity': (NUMERIC, lambda e: _battery_detail(e, 'max_capacity')),
+    'cycles': (NUMERIC, lambda e: _battery_detail(e, 'cycle_count')),
+    'year': (NUMERIC, lambda e: _int_or_none(e.get('annee'))),
+    'charger_100_hours': (NUMERIC, lambda e: (e.get('charger_100_duration_seconds') or 0) / 3600),
+    'macos': (VERSION, lambda e: parse_version(_text(e, 'macos_version'))),
+    'on_ac': (BOOLEAN, _on_ac),
+    'on_battery': (BOOLEAN, lambda e: 'Battery' in _drawing_from(e)),
+    'charging_100': (BOOLEAN, lambda e: bool(e.get('charger_100_since'))),
+    'disk_critical': (BOOLEAN, lambda e: _below(parse_disk_space(e.get('disk_free')), CRITICAL_THRESHOLD, inclusive=True)),
+    'disk_warning': (BOOLEAN, lambda e: _below(parse_disk_space(e.get('disk_free')), WARNING_THRESHOLD)),
+    'battery_low': (BOOLEAN, lambda e: _below(_battery(e), LOW_BATTERY_THRESHOLD)),
+    'hostname': (CATEGORY, lambda e: _text(e, 'hostname')),
+    'ip': (CATEGORY, lambda e: _text(e, 'ip')),
+    'mac': (CATEGORY, lambda e: _text(e, 'mac')),
+    'user': (CATEGORY, lambda e: _text(e, 'current_user')),
+    'model': (CATEGORY, lambda e: _text(e, 'model_identifier')),
+    'taille': (CATEGORY, lambda e: _text(e, 'taille')),
+    'condition': (CATEGORY, lambda e: _text(e.get('battery_details') or {}, 'condition')),
+    'site': (CATEGORY, lambda e: _text(e, 'site')),
+}
+
+# Synonymes acceptés dans les expressions
+FIELD_ALIASES = {
+    'disk_free': 'disk', 'battery_percent': 'battery', 'percent': 'battery',
+    'cycle_count': 'cycles', 'annee': 'year', 'macos_version': 'macos',
+    'plugged': 'on_ac', 'current_user': 'user', 'model_identifier': 'model',
+}
+
+
+# Métriques conservées dans l'historique par machine : nom exposé -> champ de FIELDS
+HISTORY_METRICS = {
+    'battery_percent': 'battery',
+    'max_capacity': 'max_capacity',
+    'cycle_count': 'cycles',
+    'disk_free_gb': 'disk',
+    'on_ac': 'on_ac',
+}
+
+
+def history_point(dt, entry):
+    """Extrait un point d'historique (date + métriques sélectionnées) d'une entrée de scan"""
+    point = {'date': dt.strftime("%Y-%m-%d %H:%M:%S")}
+    for metric, field in HISTORY_METRICS.items():
+        point[metric] = FIELDS[field][1](entry)
+    return point
+
+
+def resolve_field(name):
+    """Retourne le nom canonique d'un champ (ou None s'il est inconnu)"""
+    name = name.lower()
+    name = FIELD_ALIASES.get(name, name)
+    return name if name in FIELDS else None
+
+
+class MachineIndex:
+    """Index des machines d'une version donnée de la fusion"""
+
+    RESULT_CACHE_SIZE = 128
+
+    def __init__(self, machines, version=0):
+        self.version = version
+        self.machines = list(machines)
+        self.all_ids = frozenset(range(len(self.machines)))
+        self.numeric = {}
+        self.booleans = {}
+        self.categories = {}
+        self._results = OrderedDict()
+        # Accès direct O(1) par nom d'hôte (insensible à la casse) et par adresse MAC
+        self.by_hostname = {}
+        self.by_mac = {}
+        for i, entry in enumerate(self.machines):
+            hostname = _text(entry, 'hostname')
+            if hostname:
+                self.by_hostname[hostname.lower()] = i
+            mac = normalize_mac(entry.get('mac'))
+            if mac:
+                self.by_mac[mac] = i
+
+        for name, (kind, extract) in FIELDS.items():
+            if kind == NUMERIC:
+                pairs = []
+                for i, entry in enumerate(self.machines):
+                    value = extract(entry)
+                    if value is not None:
+                        pairs.append((value, i))
+                pairs.sort()
+                self.numeric[name] = ([v for v, _ in pairs], [i for _, i in pairs])
+            elif kind == BOOLEAN:
+                self.booleans[name] = frozenset(i for i, e in enumerate(self.machines) if extract(e))
+            else:
+                buckets = {}
+                for i, entry in enumerate(self.machines):
+                    value = extract(entry)
+                    if value is None:
+                        continue
+                    key = value.lower() if kind == CATEGORY else value
+                    buckets.setdefault(key, set()).add(i)
+                self.categories[name] = buckets
+
+    def __len__(self):
+        return len(self.machines)
+
+    def get_by_hostname(self, hostname):
+        i = self.by_hostname.get(str(hostname).lower())
+        return self.machines[i] if i is not None else None
+
+    def get_by_mac(self, mac):
+        i = self.by_mac.get(normalize_mac(mac))
+        return self.machines[i] if i is not None else None
+
+    def numeric_range(self, field, low=None, high=None, include_low=True, include_high=True):
+        """Ids dont la valeur est dans [low, high] (bornes optionnelles), par bisection"""
+        values, ids = self.numeric[field]
+        start = 0
+        end = len(values)
+        if low is not None:
+            start = bisect.bisect_left(values, low) if include_low else bisect.bisect_right(values, low)
+        if high is not None:
+            end = bisect.bisect_right(values, high) if include_high else bisect.bisect_left(values, high)
+        return set(ids[start:end]) if start < end else set()
+
+    def bucket_ids(self, field, predicate):
+        """Union des buckets (catégoriels / versions) dont la clé satisfait `predicate`"""
+        result = set()
+        for key, ids in self.categories[field].items():
+            if predicate(key):
+                result |= ids
+        return result
+
+    def query(self, compiled):
+        """Évalue un filtre compilé ; les résultats sont mis en cache pour cette version"""
+        cached = self._results.get(compiled.source)
+        if cached is not None:
+            self._results.move_to_end(compiled.source)
+            return cached
+        ids = sorted(compiled.evaluate(self))
+        result = [self.machines[i] for i in ids]
+        self._results[compiled.source] = result
+        if len(self._results) > self.RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+        return result
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Représentation mémoire compacte d'une machine scannée.
+
+Un résultat de scan est un dict de 14 clés avec deux dicts imbriqués ; les mêmes
+valeurs ("Unknown", modèles, versions macOS, noms d'applications...) y sont
+dupliquées d'une entrée à l'autre. MachineRecord les remplace par :
+- des objets à `__slots__` (pas de dict par instance) ;
+- des chaînes catégorielles internées (une seule copie par valeur) ;
+- `open_apps` encodé par dictionnaire : tableau d'identifiants vers APP_NAMES.
+
+Un champ absent du dict d'origine reste non initialisé : `to_dict()` restitue
+exactement le dict d'origine, qui n'est produit qu'à la frontière JSON
+(écriture des snapshots, réponses de l'API).
+"""
+import sys
+import threading
+from array import array
+
+
+class AppDictionary:
+    """Dictionnaire partagé nom d'application <-> identifiant"""
+
+    SEPARATOR = ", "
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self._lock = threading.Lock()
+
+    def _id(self, name):
+        app_id = self.ids.get(name)
+        if app_id is None:
+            with self._lock:
+                app_id = self.ids.get(name)
+                if app_id is None:
+                    app_id = len(self.names)
+                    self.names.append(sys.intern(name))
+                    self.ids[self.names[app_id]] = app_id
+        return app_id
+
+    def encode(self, value):
+        """'Finder, Safari' -> array d'identifiants (les autres valeurs sont conservées telles quelles)"""
+        if not isinstance(value, str):
+            return value
+        return array('I', (self._id(name) for name in value.split(self.SEPARATOR)))
+
+    def decode(self, value):
+        if not isinstance(value, array):
+            return value
+        return self.SEPARATOR.join(self.names[i] for i in value)
+
+
+APP_NAMES = AppDictionary()
+
+# Valeur sentinelle : champ absent du dict d'origine
+_MISSING = object()
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _SlotRecord:
+    """Base des enregistrements : FIELDS connus en slots, clés inconnues dans `extra`"""
+
+    __slots__ = ('extra',)
+    FIELDS = ()
+    CATEGORICAL = frozenset()
+    NESTED = {}
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            if name in values:
+                setattr(self, name, self._encode(name, values.pop(name)))
+        self.extra = {k: _intern(v) for k, v in values.items()} or None
+
+    def _encode(self, name, value):
+        if name in self.NESTED and isinstance(value, dict):
+            return self.NESTED[name].from_dict(value)
+        if name in self.CATEGORICAL:
+            return _intern(value)
+        return value
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(**data)
+
+    def get(self, key, default=None):
+        """Accès façon dict (champ absent -> `default`)"""
+        if key in self.FIELDS:
+            value = getattr(self, key, default)
+            if isinstance(value, array):
+                return APP_NAMES.decode(value)
+            return value
+        return self.extra.get(key, default) if self.extra else default
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, self._encode(key, value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return hasattr(self, key)
+        return bool(self.extra) and key in self.extra
+
+    def to_dict(self):
+        data = {}
+        for name in self.FIELDS:
+            value = getattr(self, name, _MISSING)
+            if value is _MISSING:
+                continue
+            if isinstance(value, _SlotRecord):
+                value = value.to_dict()
+            elif isinstance(value, array):
+                value = APP_NAMES.decode(value)
+            data[name] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __eq__(self, other):
+        if isinstance(other, _SlotRecord):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class BatteryStatus(_SlotRecord):
+    FIELDS = ('percent', 'power_plugged', 'time_left', 'drawing_from')
+    __slots__ = FIELDS
+    CATEGORICAL = frozenset({'drawing_from'})
+
+
+class BatteryDetails(_SlotRecord):
+    FIELDS = ('cycle_count', 'max_capacity', 'condition')
+    __slots__ = FIELDS
+    CATEGORICAL = frozenset({'condition'})
+
+
+class MachineRecord(_SlotRecord):
+    """Machine scannée (mêmes clés que les dicts de scan historiques)"""
+
+    FIELDS = (
+        'ip', 'mac', 'hostname', 'model_info', 'macos_version', 'model_identifier',
+        'taille', 'annee', 'disk_free', 'ram_info', 'open_apps',
+        'battery_status', 'battery_details', 'current_user',
+    )
+    __slots__ = FIELDS
+    CATEGORICAL = frozenset({
+        'ip', 'mac', 'hostname', 'model_info', 'macos_version', 'model_identifier',
+        'taille', 'annee', 'disk_free', 'current_user',
+    })
+    NESTED = {'battery_status': BatteryStatus, 'battery_details': BatteryDetails}
+
+    def _encode(self, name, value):
+        if name == 'open_apps':
+            return APP_NAMES.encode(value)
+        return super()._encode(name, value)
+
+
+def to_dicts(records):
+    """Conversion d'une liste d'enregistrements (ou de dicts) vers des dicts, pour la sérialisation JSON"""
+    return [r.to_dict() if isinstance(r, _SlotRecord) else r for r in records if r]
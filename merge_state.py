@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Fusion incrémentale des scans.
+
+MergeReducer applique les scans un par un, dans l'ordre chronologique
+(la donnée la plus récente gagne pour chaque hostname) et suit depuis quand
+chaque machine est branchée à 100%. Son état est sérialisable : il sert de
+checkpoint à observation_log.py pour redémarrer l'API sans rejouer tous les scans.
+"""
+import os
+from datetime import datetime, timedelta
+from functools import partial
+
+from machine_index import history_point
+from machine_record import MachineRecord
+import snapshot_store
+
+DATE_FORMAT = "%Y%m%d_%H%M%S"
+NICE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Machines non vues depuis plus de N jours retirées de la fusion (0 = jamais)
+HOST_TTL_DAYS = int(os.getenv("MERGE_HOST_TTL_DAYS", "30"))
+# Profondeur de l'historique par machine conservé en mémoire (`?history=`) ;
+# au-delà, utiliser les rollups (`/machines/{hostname}/history`)
+HISTORY_WINDOW_DAYS = int(os.getenv("MERGE_HISTORY_DAYS", "1"))
+
+
+def is_charging_100(entry):
+    """Vrai si la machine est à 100% et branchée sur secteur"""
+    batt = entry.get('battery_status', {}) or {}
+    percent = None
+    power_plugged = None
+    try:
+        if isinstance(batt, dict):
+            percent = batt.get('percent')
+            power_plugged = batt.get('power_plugged')
+    except Exception:
+        pass
+
+    # Prendre aussi en compte le champ drawing_from (ex: 'AC Power' / 'Battery Power')
+    drawing_from = None
+    try:
+        if isinstance(batt, dict):
+            drawing_from = batt.get('drawing_from')
+    except Exception:
+        drawing_from = None
+
+    if percent is None or percent != 100:
+        return False
+    # Si drawing_from indique 'Battery', considérer comme non branchée
+    if drawing_from and 'battery' in str(drawing_from).lower():
+        return False
+    # sinon, utiliser power_plugged ou des indices textuels
+    if isinstance(power_plugged, bool):
+        return power_plugged is True
+    s = str(power_plugged).lower()
+    return 'ac' in s or 'charge' in s or 'true' in s or 'oui' in s
+
+
+def format_duration(secs):
+    """Durée lisible : '1d 2h 5m' (secondes seulement en dessous d'une minute)"""
+    days, rem = divmod(secs, 86400)
+    hours, rem = divmod(rem, 3600)
+    minutes, seconds = divmod(rem, 60)
+    parts = []
+    if days:
+        parts.append(f"{days}d")
+    if hours:
+        parts.append(f"{hours}h")
+    if minutes:
+        parts.append(f"{minutes}m")
+    if seconds and not parts:
+        parts.append(f"{seconds}s")
+    return ' '.join(parts) if parts else '0s'
+
+
+def normalize_scan(date, machines, keep_history=True):
+    """
+    Normalise les entrées d'un scan, sans dépendre de l'état de la fusion.
+
+    Fonction pure (exécutable dans un processus de travail) : ajoute la date de
+    récupération, renomme full_charge_capacity, évalue la charge à 100% et extrait
+    le point d'historique.
+
+    Returns:
+        list: tuples (hostname, entrée, branchée à 100%, point d'historique ou None)
+    """
+    dt = datetime.strptime(date, DATE_FORMAT)
+    nice_date = dt.strftime(NICE_DATE_FORMAT)
+    rows = []
+    try:
+        for entry in machines:
+            hostname = entry.get('hostname')
+            if not hostname:
+                continue
+            if isinstance(entry, MachineRecord):
+                entry = entry.to_dict()
+            # Ajout de la date de récupération (format lisible)
+            entry['date_recuperation'] = nice_date
+            # Remplacement de full_charge_capacity par max_capacity
+            battery_details = entry.get('battery_details', {})
+            if 'full_charge_capacity' in battery_details:
+                battery_details['max_capacity'] = battery_details.get('full_charge_capacity')
+            entry['battery_details'] = battery_details
+            point = history_point(dt, entry) if keep_history else None
+            rows.append((hostname, entry, is_charging_100(entry), point))
+    except Exception as e:
+        print(f"Erreur lors de la fusion du scan {date}: {e}")
+    return rows
+
+
+class MergeReducer:
+    """État fusionné du parc, mis à jour scan par scan (dans l'ordre chronologique)"""
+
+    def __init__(self, keep_history=True):
+        self.keep_history = keep_history
+        # Pour chaque hostname, la donnée la plus récente (représentation compacte)
+        self.latest = {}
+        # trackers pour calculer depuis quand le chargeur est branché à 100%
+        self.charger_starts = {}
+        self.latest_dt = {}
+        # série chronologique des métriques de chaque machine (voir HISTORY_METRICS)
+        self.history = {}
+        self.last_date = None
+        # Numéro de séquence de la dernière entrée du journal d'observations intégrée
+        self.last_seq = None
+
+    def apply(self, date, machines, seq=None):
+        """Intègre un scan (date 'YYYYmmdd_HHMMSS', liste de dicts ou de MachineRecord)"""
+        self.apply_rows(date, normalize_scan(date, machines, self.keep_history))
+        if seq is not None:
+            self.last_seq = seq
+
+    def apply_rows(self, date, rows):
+        """Intègre un scan déjà normalisé par normalize_scan (éventuellement dans un autre processus)"""
+        dt = datetime.strptime(date, DATE_FORMAT)
+        for hostname, entry, charging, point in rows:
+            # Entrée journalisée après une observation plus récente de la machine
+            # (scan terminé après un rescan ou un lot d'agents) : ignorée
+            if hostname in self.latest_dt and dt < self.latest_dt[hostname]:
+                continue
+            self.latest_dt[hostname] = dt
+            # mettre à jour le démarrage du mode 100%+secteur
+            if charging:
+                self.charger_starts.setdefault(hostname, dt)
+            else:
+                # si condition non satisfaite, supprimer tout démarrage enregistré
+                self.charger_starts.pop(hostname, None)
+            # On écrase si plus récent (entry vaut None si une entrée plus récente suit)
+            if entry is not None:
+                self.latest[hostname] = MachineRecord.from_dict(entry)
+            elif hostname not in self.latest:
+                # réserve la position de la machine (ordre de la fusion), remplie plus loin
+                self.latest[hostname] = None
+            if self.keep_history and point is not None:
+                self.history.setdefault(hostname, []).append(point)
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+            self._expire(dt)
+
+    def _expire(self, now):
+        """Retire les machines disparues depuis HOST_TTL_DAYS et l'historique trop ancien"""
+        if HOST_TTL_DAYS:
+            limit = now - timedelta(days=HOST_TTL_DAYS)
+            for hostname in [h for h, last in self.latest_dt.items() if last < limit]:
+                for state in (self.latest, self.latest_dt, self.charger_starts, self.history):
+                    state.pop(hostname, None)
+        if self.keep_history and HISTORY_WINDOW_DAYS:
+            since = (now - timedelta(days=HISTORY_WINDOW_DAYS)).strftime(NICE_DATE_FORMAT)
+            for hostname, points in self.history.items():
+                if points and points[0]['date'] < since:
+                    self.history[hostname] = [p for p in points if p['date'] >= since]
+
+    def result(self):
+        """Liste fusionnée des machines (dicts), complétée par la durée de charge à 100%"""
+        merged = []
+        for hostname, record in self.latest.items():
+            entry = record.to_dict()
+            start = self.charger_starts.get(hostname)
+            last = self.latest_dt.get(hostname)
+            if start and last:
+                secs = int((last - start).total_seconds())
+                entry['charger_100_since'] = start.strftime(NICE_DATE_FORMAT)
+                entry['charger_100_duration_seconds'] = secs
+                entry['charger_100_duration'] = format_duration(secs)
+            else:
+                entry['charger_100_since'] = None
+                entry['charger_100_duration_seconds'] = 0
+                entry['charger_100_duration'] = None
+            merged.append(entry)
+        return merged
+
+    def to_state(self):
+        """État sérialisable en JSON (checkpoint)"""
+        return {
+            'last_date': self.last_date,
+            'last_seq': self.last_seq,
+            'latest': [record.to_dict() for record in self.latest.values()],
+            'charger_starts': {h: dt.strftime(DATE_FORMAT) for h, dt in self.charger_starts.items()},
+            'latest_dt': {h: dt.strftime(DATE_FORMAT) for h, dt in self.latest_dt.items()},
+            'history': self.history if self.keep_history else {},
+        }
+
+    @classmethod
+    def from_state(cls, state, keep_history=True):
+        reducer = cls(keep_history=keep_history)
+        reducer.last_date = state.get('last_date')
+        reducer.last_seq = state.get('last_seq')
+        for entry in state.get('latest', []):
+            reducer.latest[entry['hostname']] = MachineRecord.from_dict(entry)
+        reducer.charger_starts = {h: datetime.strptime(d, DATE_FORMAT) for h, d in state.get('charger_starts', {}).items()}
+        reducer.latest_dt = {h: datetime.strptime(d, DATE_FORMAT) for h, d in state.get('latest_dt', {}).items()}
+        if keep_history:
+            reducer.history = state.get('history', {})
+        return reducer
+
+
+def drop_superseded(results):
+    """
+    Retire d'une suite de scans normalisés les entrées écrasées plus loin dans la suite.
+
+    Seule la dernière entrée de chaque machine est conservée en entier ; les autres
+    gardent leur indicateur de charge et leur point d'historique. Le processus
+    principal n'a ainsi à reconstruire qu'un MachineRecord par machine et par chaîne.
+    """
+    seen = set()
+    for _, rows in reversed(results):
+        for i in range(len(rows) - 1, -1, -1):
+            hostname, entry, charging, point = rows[i]
+            if hostname in seen:
+                rows[i] = (hostname, None, charging, point)
+            else:
+                seen.add(hostname)
+    return results
+
+
+def rebuild_from_snapshots(keep_history=True, workers=None):
+    """
+    Reconstruction complète de l'état depuis les snapshots.
+
+    Lecture et normalisation en parallèle (voir snapshot_store.map_snapshots),
+    réduction séquentielle dans l'ordre chronologique : mêmes règles que apply().
+    """
+    reducer = MergeReducer(keep_history=keep_history)
+    normalize = partial(normalize_scan, keep_history=keep_history)
+    for date, rows in snapshot_store.map_snapshots(normalize, workers=workers, finalize=drop_superseded):
+        reducer.apply_rows(date, rows)
+    return reducer
@@ -1,173 +1,540 @@
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
-import glob
-import json
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, Response
+import asyncio
+import contextlib
 import os
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional
 from fastapi.templating import Jinja2Templates
-from fastapi import Request
+from fastapi import Request, Query
+from starlette.concurrency import run_in_threadpool
 import re
+import threading
+import time
 
-app = FastAPI()
+import agent_ingest
+import collectors
+import dashboard_renderer
+import email_notifier
+import fleet_stats
+import history_store
+import live_apps
+import observation_log
+import refresh_jobs
+import shared_state
+import snapshot_store
+from machine_filter import compile_filter, FilterError
+from machine_index import MachineIndex, HISTORY_METRICS
+from merge_state import rebuild_from_snapshots
+
+# Mode intégré : la boucle de scan tourne dans le processus de l'API (voir lifespan)
+INTEGRATED_SCANNER = os.getenv("INTEGRATED_SCANNER", "0") == "1"
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    tasks = [asyncio.create_task(ingest_flush_loop())]
+    if INTEGRATED_SCANNER:
+        import network_scanner
+        tasks.append(asyncio.create_task(network_scanner.run_integrated(publish_scan)))
+    yield
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    live_apps.close()
+    refresh_manager.close()
+
+
+def flush_ingested():
+    """Publie les rapports d'agents en attente ; alertes sur le parc fusionné au plus une fois par intervalle"""
+    published = agent_ingest.flush()
+    if published:
+        print(f"Ingestion agents : {published} machine(s) publiée(s)")
+        if agent_ingest.alert_due():
+            email_notifier.check_and_notify(get_merged_data())
+    agent_ingest.publish_aggregates()
+    return published
+
+
+async def ingest_flush_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(agent_ingest.FLUSH_SECONDS)
+        try:
+            await loop.run_in_executor(None, flush_ingested)
+        except Exception as e:
+            print(f"Erreur lors de la publication des rapports d'agents: {e}")
+
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
 # Fonction utilitaire pour charger et fusionner les données sans doublons
 
-def load_and_merge_json_files() -> List[Dict]:
-    files = glob.glob("smartelia_machines_*.json")
-    # Correction du pattern pour matcher le nom de fichier
-    file_date_pattern = re.compile(r"smartelia_machines_(\d{8}_\d{6})\.json")
-    file_dates = {}
-    for file in files:
-        m = file_date_pattern.search(file)
-        if m:
-            file_dates[file] = m.group(1)
-    # Trier les fichiers par date croissante
-    sorted_files = sorted(file_dates.items(), key=lambda x: x[1])
-    # Pour chaque hostname, garder la donnée la plus récente
-    latest_data = {}
-    # trackers pour calculer depuis quand le chargeur est branché à 100%
-    charger_starts = {}
-    latest_dt = {}
-
-    for file, date in sorted_files:
-        # tenter de parser la date extraite du nom de fichier et la formater lisiblement
-        nice_date = date
+def load_and_merge_json_files(history: Optional[Dict[str, List[Dict]]] = None) -> List[Dict]:
+    """Reconstruction complète depuis les snapshots (la donnée la plus récente gagne pour chaque hostname).
+
+    Si un dictionnaire `history` est fourni, il est rempli avec la série
+    chronologique des métriques de chaque machine (voir HISTORY_METRICS).
+    En fonctionnement normal l'API part plutôt du checkpoint (voir get_merged_data).
+    """
+    reducer = rebuild_from_snapshots(keep_history=history is not None)
+    if history is not None:
+        history.update(reducer.history)
+    return reducer.result()
+
+# Cache de la fusion : état incrémental restauré depuis le checkpoint, puis mis à jour
+# avec les nouvelles entrées du journal d'observations uniquement
+_merge_lock = threading.Lock()
+_merge_cache = {'signature': None, 'version': 0, 'data': [], 'history': {}, 'reducer': None}
+
+
+def _data_signature():
+    """Signature du journal d'observations (ou des snapshots tant que le journal n'existe pas)"""
+    return observation_log.signature() or snapshot_store.snapshot_signature()
+
+
+def _advance_reducer():
+    """Intègre les nouvelles entrées du journal au reducer courant (ou repart du checkpoint)"""
+    reducer = _merge_cache['reducer']
+    applied = None
+    if reducer is not None and observation_log.list_segments():
+        applied = observation_log.catch_up(reducer)
+    if applied is None:
+        started = time.perf_counter()
+        reducer, applied = observation_log.restore()
+        print(f"État fusionné restauré en {time.perf_counter() - started:.2f}s ({applied} scan(s) rejoué(s))")
+    _merge_cache['reducer'] = reducer
+    return reducer
+
+
+def get_shared_view() -> shared_state.SharedView:
+    """
+    Publication courante de l'état partagé (API_SHARED_STATE=1, plusieurs workers).
+
+    Si les données ont changé depuis la dernière publication, un seul worker
+    (verrou inter-processus) calcule la fusion et la publie ; les autres la relisent.
+    """
+    key = shared_state.signature_key(_data_signature())
+    view = shared_state.current()
+    if view is not None and view.signature == key:
+        return view
+    with _merge_lock, shared_state.publisher_lock():
+        view = shared_state.current()
+        if view is None or view.signature != key:
+            reducer = _advance_reducer()
+            view = shared_state.publish(key, reducer.result(), reducer.history)
+    return view
+
+
+def get_merged_data() -> List[Dict]:
+    """Retourne la fusion courante, en n'intégrant que les scans ajoutés depuis le dernier appel"""
+    if shared_state.SHARED_STATE:
+        view = get_shared_view()
+        if view.version != _merge_cache['version']:
+            with _merge_lock:
+                _merge_cache.update(version=view.version, data=view.machines(), history=view.history())
+        return _merge_cache['data']
+    signature = _data_signature()
+    if signature == _merge_cache['signature']:
+        return _merge_cache['data']
+    with _merge_lock:
+        if signature != _merge_cache['signature']:
+            reducer = _advance_reducer()
+            _merge_cache.update(signature=signature, version=_merge_cache['version'] + 1,
+                                data=reducer.result(), history=reducer.history)
+    return _merge_cache['data']
+
+
+def publish_scan(date: str, machines: List) -> int:
+    """
+    Mode intégré : intègre un scan directement dans l'état en mémoire.
+
+    Le scan est aussi ajouté au journal d'observations (checkpoint écrit depuis
+    la mémoire) pour survivre à un redémarrage, mais n'est jamais relu : sous le
+    verrou du journal, l'état en mémoire intègre d'abord les entrées écrites par
+    d'autres processus, puis ce scan (observation_log.record_scan).
+
+    Returns:
+        int: nouvelle version des données
+    """
+    get_merged_data()
+    with _merge_lock:
+        reducer = _merge_cache['reducer'] or _advance_reducer()
+        last_seq = reducer.last_seq
         try:
-            from datetime import datetime
-            dt = datetime.strptime(date, "%Y%m%d_%H%M%S")
-            nice_date = dt.strftime("%Y-%m-%d %H:%M:%S")
-        except Exception:
-            # si parse échoue, conserver la valeur brute
-            pass
-
-        with open(file, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-                for entry in data:
-                    hostname = entry.get('hostname')
-                    if not hostname:
-                        continue
-                    # Ajout de la date de récupération (format lisible)
-                    entry['date_recuperation'] = nice_date
-                    # Remplacement de full_charge_capacity par max_capacity
-                    battery_details = entry.get('battery_details', {})
-                    if 'full_charge_capacity' in battery_details:
-                        battery_details['max_capacity'] = battery_details.get('full_charge_capacity')
-                    entry['battery_details'] = battery_details
-                    # tracker du dernier dt connu pour ce hostname
-                    if 'dt' in locals() and isinstance(dt, datetime):
-                        latest_dt[hostname] = dt
-
-                    # déterminer si, à ce moment, la machine est branchée et à 100%
-                    batt = entry.get('battery_status', {}) or {}
-                    percent = None
-                    power_plugged = None
-                    try:
-                        if isinstance(batt, dict):
-                            percent = batt.get('percent')
-                            power_plugged = batt.get('power_plugged')
-                    except Exception:
-                        pass
-
-                    # Prendre aussi en compte le champ drawing_from (ex: 'AC Power' / 'Battery Power')
-                    drawing_from = None
-                    try:
-                        if isinstance(batt, dict):
-                            drawing_from = batt.get('drawing_from')
-                    except Exception:
-                        drawing_from = None
-
-                    is_charging_100 = False
-                    if percent is not None and percent == 100:
-                        # Si drawing_from indique 'Battery', considérer comme non branchée
-                        if drawing_from:
-                            sdraw = str(drawing_from).lower()
-                            if 'battery' in sdraw:
-                                is_charging_100 = False
-                            else:
-                                # otherwise fallback to power_plugged or textual checks
-                                if isinstance(power_plugged, bool):
-                                    is_charging_100 = power_plugged is True
-                                else:
-                                    s = str(power_plugged).lower()
-                                    if 'ac' in s or 'charge' in s or 'true' in s or 'oui' in s:
-                                        is_charging_100 = True
-                        else:
-                            # Pas de drawing_from, utiliser power_plugged
-                            if isinstance(power_plugged, bool):
-                                is_charging_100 = power_plugged is True
-                            else:
-                                s = str(power_plugged).lower()
-                                if 'ac' in s or 'charge' in s or 'true' in s or 'oui' in s:
-                                    is_charging_100 = True
-
-                    # mettre à jour le démarrage du mode 100%+secteur
-                    if is_charging_100 and 'dt' in locals() and isinstance(dt, datetime):
-                        if hostname not in charger_starts:
-                            charger_starts[hostname] = dt
-                    else:
-                        # si condition non satisfaite, supprimer tout démarrage enregistré
-                        if hostname in charger_starts:
-                            del charger_starts[hostname]
-
-                    # On écrase si plus récent
-                    latest_data[hostname] = entry
-            except Exception as e:
-                print(f"Erreur lors de la lecture de {file}: {e}")
-    # Après avoir parcouru l'historique, compléter les entrées finales avec la durée si applicable
-    for hostname, entry in latest_data.items():
-        start = charger_starts.get(hostname)
-        last = latest_dt.get(hostname)
-        if start and last and isinstance(start, datetime) and isinstance(last, datetime):
-            delta = last - start
-            secs = int(delta.total_seconds())
-            # formater en human readable
-            days, rem = divmod(secs, 86400)
-            hours, rem = divmod(rem, 3600)
-            minutes, seconds = divmod(rem, 60)
-            parts = []
-            if days:
-                parts.append(f"{days}d")
-            if hours:
-                parts.append(f"{hours}h")
-            if minutes:
-                parts.append(f"{minutes}m")
-            if seconds and not parts:
-                parts.append(f"{seconds}s")
-            human = ' '.join(parts) if parts else '0s'
-            entry['charger_100_since'] = start.strftime("%Y-%m-%d %H:%M:%S")
-            entry['charger_100_duration_seconds'] = secs
-            entry['charger_100_duration'] = human
-        else:
-            entry['charger_100_since'] = None
-            entry['charger_100_duration_seconds'] = 0
-            entry['charger_100_duration'] = None
+            observation_log.record_scan(date, machines, reducer=reducer)
+        except Exception as e:
+            print(f"Erreur lors de l'écriture du journal d'observations: {e}")
+            reducer.apply(date, machines)
+        _merge_cache.update(version=_merge_cache['version'] + 1, data=reducer.result(), history=reducer.history)
+        # Le journal vient d'être écrit par ce processus : inutile de le rejouer,
+        # sauf si l'état en mémoire n'a pas pu suivre (journal compacté ou erreur)
+        _merge_cache['signature'] = _data_signature() if reducer.last_seq != last_seq else None
+        return _merge_cache['version']
+
+
+def get_data_version() -> int:
+    """Numéro de version de la fusion courante (incrémenté à chaque changement de données)"""
+    get_merged_data()
+    return _merge_cache['version']
+
+
+_index_cache = {'index': None}
+
+
+def get_machine_index() -> MachineIndex:
+    """Index des machines pour la version courante de la fusion (reconstruit à chaque changement)"""
+    data = get_merged_data()
+    version = _merge_cache['version']
+    index = _index_cache['index']
+    if index is None or index.version != version:
+        index = MachineIndex(data, version=version)
+        _index_cache['index'] = index
+    return index
+
+
+_fleet_columns = fleet_stats.FleetColumns()
+
+
+def get_fleet_columns() -> fleet_stats.FleetColumns:
+    """Colonnes NumPy du parc, mises à jour (machines modifiées uniquement) à chaque changement de données"""
+    data = get_merged_data()
+    version = _merge_cache['version']
+    if _fleet_columns.version != version:
+        _fleet_columns.update(data, version)
+    return _fleet_columns
 
-    return list(latest_data.values())
 
 @app.get("/machines", response_class=JSONResponse)
-def get_machines():
-    """Retourne la liste fusionnée des machines sans doublons."""
-    data = load_and_merge_json_files()
-    return data
+def get_machines(response: Response, offset: int = 0, limit: Optional[int] = None,
+                 filter: Optional[str] = None):
+    """Retourne la liste fusionnée des machines sans doublons.
+
+    `offset`/`limit` permettent de paginer ; le total est renvoyé dans l'en-tête
+    X-Total-Count et la version des données dans X-Data-Version (le client
+    recommence son chargement si elle change entre deux pages).
+    `filter` accepte une expression (ex: "battery < 30 and on_battery", voir machine_filter.py).
+    """
+    if filter:
+        try:
+            compiled = compile_filter(filter)
+        except FilterError as e:
+            return JSONResponse(status_code=400, content={"error": f"Filtre invalide : {e}"})
+        data = get_machine_index().query(compiled)
+    elif shared_state.SHARED_STATE:
+        # Page servie telle quelle depuis l'état partagé, sans désérialisation
+        view = get_shared_view()
+        return Response(content=view.page(offset, limit), media_type="application/json", headers={
+            "X-Total-Count": str(view.count),
+            "X-Data-Version": str(view.version),
+        })
+    else:
+        data = get_merged_data()
+    response.headers["X-Total-Count"] = str(len(data))
+    response.headers["X-Data-Version"] = str(_merge_cache['version'])
+    offset = max(offset, 0)
+    if limit is None:
+        return data[offset:] if offset else data
+    return data[offset:offset + max(limit, 0)]
+
+def _etag_matches(request: Request, etags) -> bool:
+    """Vérifie si l'en-tête If-None-Match correspond à l'un des ETag donnés"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return any(etag in candidates for etag in etags)
+
+
+def serve_prerendered_dashboard(request: Request, manifest: Dict):
+    """Sert le tableau de bord pré-rendu (variante gzip si acceptée), avec ETag"""
+    etag = manifest['etag']
+    gzip_etag = etag[:-1] + '-gz"'
+    if _etag_matches(request, (etag, gzip_etag)):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", "") and os.path.exists(manifest['gzip_path']):
+        headers.update({"ETag": gzip_etag, "Content-Encoding": "gzip"})
+        path = manifest['gzip_path']
+    else:
+        headers["ETag"] = etag
+        path = manifest['html_path']
+    return FileResponse(path=path, media_type="text/html; charset=utf-8", headers=headers)
+
+
+def parse_window(value: str) -> timedelta:
+    """Convertit une fenêtre de type '90m', '24h' ou '7d' en timedelta"""
+    m = re.fullmatch(r"\s*(\d+)\s*([mhd])\s*", value or "")
+    if not m:
+        raise ValueError(f"Fenêtre invalide : {value!r} (ex: 90m, 24h, 7d)")
+    amount, unit = int(m.group(1)), m.group(2)
+    return {'m': timedelta(minutes=amount), 'h': timedelta(hours=amount), 'd': timedelta(days=amount)}[unit]
+
+
+def machine_response(entry: Optional[Dict], key: str, history: Optional[str], metrics: Optional[str]):
+    """Construit la réponse d'un accès individuel : état courant + série optionnelle"""
+    if entry is None:
+        return JSONResponse(status_code=404, content={"error": f"Machine {key} introuvable"})
+    result = {"machine": entry}
+    if history:
+        try:
+            window = parse_window(history)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        selected = list(HISTORY_METRICS)
+        if metrics:
+            selected = [m.strip() for m in metrics.split(",") if m.strip()]
+            unknown = [m for m in selected if m not in HISTORY_METRICS]
+            if unknown:
+                return JSONResponse(status_code=400, content={
+                    "error": f"Métriques inconnues : {', '.join(unknown)} (disponibles : {', '.join(HISTORY_METRICS)})"
+                })
+        since = (datetime.now() - window).strftime("%Y-%m-%d %H:%M:%S")
+        points = _merge_cache['history'].get(entry.get('hostname'), [])
+        result["history"] = {
+            "window": history,
+            "metrics": selected,
+            "points": [
+                {"date": p['date'], **{m: p[m] for m in selected}}
+                for p in points if p['date'] >= since
+            ],
+        }
+    return result
+
+
+@app.get("/machines/by-mac/{mac}", response_class=JSONResponse)
+def get_machine_by_mac(mac: str, history: Optional[str] = None, metrics: Optional[str] = None):
+    """Retourne une machine par adresse MAC (index O(1)), avec historique optionnel (?history=24h)"""
+    entry = get_machine_index().get_by_mac(mac)
+    return machine_response(entry, mac, history, metrics)
+
+
+@app.get("/machines/{hostname}", response_class=JSONResponse)
+def get_machine(hostname: str, history: Optional[str] = None, metrics: Optional[str] = None):
+    """Retourne une machine par nom d'hôte (index O(1)), avec historique optionnel (?history=24h)"""
+    entry = get_machine_index().get_by_hostname(hostname)
+    return machine_response(entry, hostname, history, metrics)
+
+
+@app.get("/machines/{hostname}/apps", response_class=JSONResponse)
+def get_machine_apps(hostname: str, refresh: bool = False):
+    """Applications ouvertes, interrogées en direct par SSH (cache de APPS_CACHE_SECONDS, `?refresh=true` pour l'ignorer)"""
+    entry = get_machine_index().get_by_hostname(hostname)
+    if entry is None:
+        return JSONResponse(status_code=404, content={"error": f"Machine {hostname} introuvable"})
+    try:
+        return live_apps.query(entry, refresh)
+    except live_apps.AppsQueryError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+
+
+def publish_refreshed(results: List[Dict]):
+    """Publie les machines rescannées (refresh_jobs) par le chemin d'ingestion des agents"""
+    counts = agent_ingest.accept([{'timestamp': r['timestamp'], 'machine': r['machine']} for r in results], dedupe=False)
+    agent_ingest.flush(force=True)
+    if counts['accepted'] < len(results):
+        raise ValueError(f"{len(results) - counts['accepted']} machine(s) refusée(s) par l'ingestion")
+
+
+refresh_manager = refresh_jobs.RefreshManager(
+    lookup=lambda hostname: get_machine_index().get_by_hostname(hostname),
+    publish=publish_refreshed,
+)
+
+
+def refresh_response(job: refresh_jobs.RefreshJob, wait: float):
+    """État du job ; attend au plus `wait` secondes (MAX_WAIT_SECONDS) qu'il se termine"""
+    if wait > 0:
+        job.done.wait(min(wait, refresh_jobs.MAX_WAIT_SECONDS))
+    status_code = 200 if job.done.is_set() else 202
+    return JSONResponse(status_code=status_code, content=job.to_dict())
+
+
+@app.post("/machines/refresh", response_class=JSONResponse)
+async def refresh_machines(request: Request, wait: float = 0):
+    """Rescan immédiat de plusieurs machines. Corps : {"hostnames": [...]} ; `?wait=30` attend le résultat"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "JSON invalide"})
+    hostnames = payload.get('hostnames') if isinstance(payload, dict) else None
+    if not isinstance(hostnames, list) or not hostnames or not all(isinstance(h, str) and h for h in hostnames):
+        return JSONResponse(status_code=400, content={"error": "Format attendu : {\"hostnames\": [\"...\"]}"})
+    if len(hostnames) > refresh_jobs.REFRESH_MAX_HOSTS:
+        return JSONResponse(status_code=400, content={
+            "error": f"{refresh_jobs.REFRESH_MAX_HOSTS} machines au plus par demande"
+        })
+    job = await run_in_threadpool(refresh_manager.submit, hostnames)
+    return await run_in_threadpool(refresh_response, job, wait)
+
+
+@app.post("/machines/{hostname}/refresh", response_class=JSONResponse)
+def refresh_machine(hostname: str, wait: float = 0):
+    """Rescan immédiat d'une machine à sa dernière IP connue ; `?wait=30` attend le résultat"""
+    if get_machine_index().get_by_hostname(hostname) is None:
+        return JSONResponse(status_code=404, content={"error": f"Machine {hostname} introuvable"})
+    return refresh_response(refresh_manager.submit([hostname]), wait)
+
+
+@app.get("/refresh/{job_id}", response_class=JSONResponse)
+def get_refresh_job(job_id: str, wait: float = 0):
+    """État d'un job de rescan (jobs gardés en mémoire par le processus de l'API)"""
+    job = refresh_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job {job_id} introuvable"})
+    return refresh_response(job, wait)
+
+
+def default_bucket(window: timedelta) -> timedelta:
+    """Taille de bucket par défaut : quelques centaines de points au maximum"""
+    if window <= timedelta(days=2):
+        return timedelta(hours=1)
+    if window <= timedelta(days=14):
+        return timedelta(hours=6)
+    return timedelta(days=1)
+
+
+def history_response(host: str, range_: str, bucket: Optional[str], metrics: Optional[str]):
+    """Série agrégée (min/max/avg/last par bucket) lue depuis les rollups"""
+    try:
+        window = parse_window(range_)
+        step = parse_window(bucket) if bucket else default_bucket(window)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    step_seconds = int(step.total_seconds())
+    unit = history_store.TIERS['day'] if step_seconds >= history_store.TIERS['day'] else history_store.TIERS['hour']
+    if step_seconds % unit:
+        return JSONResponse(status_code=400, content={
+            "error": "Le bucket doit être un multiple de 1h (ou de 1d au-delà d'une journée)"
+        })
+    selected = list(history_store.ALL_METRICS)
+    if metrics:
+        selected = [m.strip() for m in metrics.split(",") if m.strip()]
+        unknown = [m for m in selected if m not in history_store.ALL_METRICS]
+        if unknown:
+            return JSONResponse(status_code=400, content={
+                "error": f"Métriques inconnues : {', '.join(unknown)} (disponibles : {', '.join(history_store.ALL_METRICS)})"
+            })
+    end = datetime.now()
+    start = end - window
+    series = history_store.get_store().query(host, selected, start.timestamp(), end.timestamp(), step_seconds)
+    if series is None:
+        return JSONResponse(status_code=404, content={"error": f"Aucun historique pour {host}"})
+    return {
+        "hostname": None if host == history_store.FLEET_KEY else host,
+        "range": range_,
+        "bucket_seconds": step_seconds,
+        "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+        "series": series,
+    }
+
+
+@app.get("/machines/{hostname}/history", response_class=JSONResponse)
+def get_machine_history(hostname: str, range_: str = Query("7d", alias="range"),
+                        bucket: Optional[str] = None, metrics: Optional[str] = None):
+    """Historique agrégé d'une machine (ex: ?range=90d&bucket=1d&metrics=battery_percent)"""
+    entry = get_machine_index().get_by_hostname(hostname)
+    host = entry.get('hostname') if entry else hostname
+    return history_response(host, range_, bucket, metrics)
+
+
+@app.get("/history", response_class=JSONResponse)
+def get_fleet_history(range_: str = Query("7d", alias="range"),
+                      bucket: Optional[str] = None, metrics: Optional[str] = None):
+    """Historique agrégé du parc : min/max/moyenne des machines, online = nombre de machines vues"""
+    return history_response(history_store.FLEET_KEY, range_, bucket, metrics)
+
+
+@app.get("/stats", response_class=JSONResponse)
+def get_stats(metric: Optional[str] = None, group_by: Optional[str] = None, bins: int = 10,
+              percentiles: Optional[str] = None, below: Optional[str] = None, above: Optional[str] = None):
+    """Agrégats du parc calculés sur les colonnes NumPy.
+
+    Sans `metric` : résumé de toutes les colonnes. Avec `metric` : comptage, percentiles,
+    histogramme (`bins`), nombre de machines sous/au-dessus d'un seuil (`below`/`above`,
+    ex: metric=disk_bytes&below=15GB) et regroupement optionnel (`group_by=year|macos_major`).
+    """
+    columns = get_fleet_columns()
+    if metric is None:
+        return columns.summary()
+    if metric not in fleet_stats.COLUMNS:
+        return JSONResponse(status_code=400, content={
+            "error": f"Métrique inconnue : {metric} (disponibles : {', '.join(fleet_stats.COLUMNS)})"
+        })
+    if group_by is not None and group_by not in fleet_stats.GROUPS:
+        return JSONResponse(status_code=400, content={
+            "error": f"Regroupement inconnu : {group_by} (disponibles : {', '.join(fleet_stats.GROUPS)})"
+        })
+    if not 1 <= bins <= 200:
+        return JSONResponse(status_code=400, content={"error": "bins doit être compris entre 1 et 200"})
+    try:
+        selected = fleet_stats.DEFAULT_PERCENTILES
+        if percentiles:
+            selected = tuple(float(p) for p in percentiles.split(",") if p.strip())
+            if any(not 0 <= p <= 100 for p in selected):
+                raise ValueError("Les percentiles doivent être compris entre 0 et 100")
+        low = fleet_stats.parse_threshold(metric, below) if below is not None else None
+        high = fleet_stats.parse_threshold(metric, above) if above is not None else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return columns.stats(metric, percentiles=selected, bins=bins, below=low, above=high, group_by=group_by)
+
+
+@app.post("/ingest", response_class=JSONResponse)
+async def ingest(request: Request):
+    """Reçoit les rapports des agents (smartelia_agent.sh), éventuellement par lots et compressés (gzip).
+
+    Corps : {"reports": [{"timestamp": "YYYYmmdd_HHMMSS", "machine": {...}}]} (schéma de scan_ip),
+    avec "site" et "seq" pour un scanner de site distant (site_shipper.py).
+    Renvoyer un lot déjà reçu est sans effet (déduplication par hostname et timestamp, ou par séquence).
+    """
+    if agent_ingest.INGEST_TOKEN and request.headers.get("x-ingest-token") != agent_ingest.INGEST_TOKEN:
+        return JSONResponse(status_code=401, content={"error": "Jeton d'ingestion invalide"})
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > agent_ingest.MAX_BODY_BYTES:
+        return JSONResponse(status_code=413, content={"error": "Charge utile trop volumineuse"})
+    body = await request.body()
+    try:
+        reports, site, seq = agent_ingest.decode_payload(body, request.headers.get("content-encoding"))
+    except agent_ingest.PayloadError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    # Verrou fichier et fsync : hors de la boucle asyncio
+    return await run_in_threadpool(agent_ingest.accept, reports, site=site, seq=seq)
+
+
+@app.get("/sites", response_class=JSONResponse)
+def get_sites():
+    """Sites distants : dernière séquence reçue, lots perdus, dernier contact et nombre de machines"""
+    sites = {name: dict(info, machines=0) for name, info in agent_ingest.site_status().items()}
+    for entry in get_merged_data():
+        site = entry.get('site')
+        if site:
+            sites.setdefault(site, {'machines': 0})['machines'] += 1
+    return sites
+
+
+@app.get("/collectors", response_class=JSONResponse)
+def get_collectors():
+    """Collecteurs SSH (collectors.py) : configuration, durée (moyenne, p95, max) et taux d'échec sur le parc"""
+    return collectors.stats.summary()
+
 
 @app.get("/", response_class=HTMLResponse)
 def get_machines_html(request: Request):
-    data = load_and_merge_json_files()
-    print(f"Nombre de machines à afficher : {len(data)}")
-    if data:
-        print("Premier élément :", data[0])
-    columns = [
-        'ip', 'mac', 'hostname', 'model_info', 'macos_version', 'model_identifier',
-        'taille', 'annee', 'disk_free', 'ram_info', 'open_apps',
-        'battery_status', 'battery_details', 'current_user', 'date_recuperation',
-        'charger_100_since', 'charger_100_duration'
-    ]
+    # Mode pré-rendu : le fichier est régénéré après chaque scan, aucun rendu Jinja ici
+    manifest = dashboard_renderer.get_prerendered()
+    if manifest and os.path.exists(manifest['html_path']):
+        return serve_prerendered_dashboard(request, manifest)
+
+    # Les lignes sont chargées côté client via /machines : le template ne contient que la structure
     return templates.TemplateResponse(
         "machines_table.html",
-        {"request": request, "data": data, "columns": columns}
+        {"request": request, "columns": dashboard_renderer.DASHBOARD_COLUMNS}
     )
 
 @app.get("/test")
@@ -190,6 +557,22 @@ def download_os_downloader():
             content={"error": "Le fichier os_downloader.sh n'a pas été trouvé"}
         )
 
+@app.get("/installers/smartelia_agent.sh")
+def download_agent():
+    """Endpoint pour télécharger l'agent de collecte smartelia_agent.sh (voir POST /ingest)"""
+    file_path = "smartelia_agent.sh"
+    if os.path.exists(file_path):
+        return FileResponse(
+            path=file_path,
+            filename="smartelia_agent.sh",
+            media_type="application/x-sh"
+        )
+    else:
+        return JSONResponse(
+            status_code=404,
+            content={"error": "Le fichier smartelia_agent.sh n'a pas été trouvé"}
+        )
+
 @app.get("/installers/os_installer.sh")
 def download_os_installer():
     """Endpoint pour télécharger le script os_installer.sh"""
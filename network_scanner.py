@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
+import asyncio
 import socket
 import subprocess
 import platform
 import concurrent.futures
+import multiprocessing
+import queue
 from datetime import datetime
 from tqdm import tqdm
 import paramiko
@@ -12,7 +15,18 @@ import csv
 import os
 import json
 from dotenv import load_dotenv
+import collectors
 import email_notifier
+import dashboard_renderer
+import history_store
+import observation_log
+import remote_probe
+import retention
+import scan_priority
+import site_shipper
+import snapshot_store
+import ssh_failures
+from machine_record import MachineRecord, to_dicts
 
 # Configuration SSH
 USE_SSH = True  # Mettre à False pour désactiver SSH
@@ -72,6 +86,24 @@ load_dotenv()
 SSH_USERNAME = os.getenv("SSH_USERNAME")
 SSH_PASSWORD = os.getenv("SSH_PASSWORD")
 
+# Mode intégré (voir run_integrated) : intervalle entre deux scans
+SCAN_INTERVAL_SECONDS = int(os.getenv("SCAN_INTERVAL_SECONDS", str(10 * 60)))
+SCAN_THREADS = 100
+# Processus de scan (partitions de la plage d'IP) : le chiffrement SSH de paramiko
+# sature un cœur sous le GIL, chaque processus a donc son propre pool de threads
+SCAN_PROCESSES = int(os.getenv("SCAN_PROCESSES", str(os.cpu_count() or 1)))
+# Taille des blocs distribués aux processus (64 adresses ~ un /26)
+SHARD_BLOCK_SIZE = 64
+# Relances d'une partition dont le processus s'est arrêté avant la fin
+SHARD_RETRIES = 1
+# Durée maximale d'un scan main() (0 : aucune) : au-delà, les IP restantes sont
+# abandonnées et les résultats déjà obtenus publiés, avant que runner.py ne tue
+# le cycle (CYCLE_TIMEOUT_SECONDS, 9 minutes)
+SCAN_DEADLINE_SECONDS = int(os.getenv("SCAN_DEADLINE_SECONDS", str(7 * 60)))
+# Après le délai : attente maximale des scans déjà commencés, pour enregistrer le
+# cache des échecs SSH et les statistiques des collecteurs (save_scan_state)
+SCAN_STOP_GRACE_SECONDS = int(os.getenv("SCAN_STOP_GRACE_SECONDS", "30"))
+
 def ping(ip):
     """Ping une adresse IP et retourne True si elle répond"""
     param = '-n' if platform.system().lower() == 'windows' else '-c'
@@ -95,105 +127,60 @@ def get_mac_address(ip):
         pass
     return "Unknown"
 
-def try_ssh_connection(ip, username, password):
-    """Tente une connexion SSH et récupère les infos d'état de la machine"""
+def collect_with_probe(ssh):
+    """Sorties des collecteurs via la sonde déposée sur le Mac (remote_probe.py) ; None si elle a échoué"""
+    data = remote_probe.collect(ssh)
+    if data is None:
+        return None
+    outputs = {}
+    for name, entry in data.items():
+        if isinstance(entry, dict):
+            outputs[name] = (entry.get('out') or "", entry.get('rc', -1), entry.get('ms', 0),
+                             bool(entry.get('timeout')), bool(entry.get('cached')))
+    return outputs
+
+def collect_with_commands(ssh):
+    """Sorties des collecteurs sans sonde : une commande SSH par collecteur activé"""
+    return collectors.run_commands(ssh)
+
+def try_ssh_connection(ip, username, password, mac="Unknown"):
+    """
+    Tente une connexion SSH et récupère les infos d'état de la machine.
+
+    Les échecs (refus, délai, authentification, machine qui n'est pas un Mac)
+    sont enregistrés dans le cache des échecs (ssh_failures.py) avec `mac`.
+    Une machine n'est classée `not_macos` que si `sw_vers` s'est exécuté et a
+    montré un autre système : un `sw_vers` trop lent ou en erreur est un échec transitoire.
+    """
     try:
         ssh = paramiko.SSHClient()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         ssh.connect(ip, username=username, password=password, timeout=5)
-
-        stdin, stdout, stderr = ssh.exec_command('hostname')
-        hostname = stdout.read().decode().strip()
-
-        stdin, stdout, stderr = ssh.exec_command('system_profiler SPHardwareDataType | grep "Model Name\\|Model Identifier"')
-        model_info = stdout.read().decode().replace('\n', ' ').strip()
-
-        stdin, stdout, stderr = ssh.exec_command('sw_vers -productVersion')
-        macos_version = stdout.read().decode().strip()
-        
-        stdin, stdout, stderr = ssh.exec_command('df -h / | awk \'NR==2 {print $4}\'')
-        disk_free = stdout.read().decode().strip()
-
-        stdin, stdout, stderr = ssh.exec_command('top -l 1 | grep PhysMem | awk \'{print $2" used, "$6" free"}\'')
-        ram_info = stdout.read().decode().strip()
-
-        stdin, stdout, stderr = ssh.exec_command('osascript -e \'tell application "System Events" to get name of every process where background only is false\'')
-        open_apps = stdout.read().decode().strip()
-
-        stdin, stdout, stderr = ssh.exec_command('pmset -g batt')
-        battery_status_raw = stdout.read().decode().strip()
-        percent = None
-        power_plugged = None
-        time_left = None
-        drawing_from = None
-        percent_match = re.search(r'(\d+)%', battery_status_raw)
-        if percent_match:
-            percent = int(percent_match.group(1))
-        power_plugged = 'AC Power' in battery_status_raw or 'chargé' in battery_status_raw or 'charging' in battery_status_raw
-        time_left_match = re.search(r'(\d+:\d+) remaining', battery_status_raw)
-        if time_left_match:
-            time_left = time_left_match.group(1)
-        else:
-            time_left = None
-        drawing_from_match = re.search(r"Now drawing from '([^']+)'", battery_status_raw)
-        if drawing_from_match:
-            drawing_from = drawing_from_match.group(1)
-        battery_status = {
-            'percent': percent,
-            'power_plugged': power_plugged,
-            'time_left': time_left,
-            'drawing_from': drawing_from
-        }
-
-        stdin, stdout, stderr = ssh.exec_command('system_profiler SPPowerDataType')
-        battery_profiler = stdout.read().decode()
-        cycle_count = None
-        max_capacity = None
-        condition = None
-        for line in battery_profiler.splitlines():
-            if 'Cycle Count' in line:
-                try:
-                    cycle_count = int(line.split(':')[-1].strip())
-                except:
-                    pass
-            if 'Condition' in line:
-                condition = line.split(':')[-1].strip()
-        # Récupérer la capacité maximale avec la commande demandée
-        stdin, stdout, stderr = ssh.exec_command("system_profiler SPPowerDataType | awk -F': ' '/Maximum Capacity/ {gsub(/[^0-9]/, \"\", $2); print $2}'")
-        max_capacity_str = stdout.read().decode().strip()
         try:
-            max_capacity = int(max_capacity_str) if max_capacity_str else None
-        except:
-            max_capacity = None
-        battery_details = {
-            'cycle_count': cycle_count,
-            'max_capacity': max_capacity,
-            'condition': condition
-        }
-        
-        stdin, stdout, stderr = ssh.exec_command('stat -f%Su /dev/console')
-        current_user = stdout.read().decode().strip()
-        
-        ssh.close()
-        return {
-            'hostname': hostname if hostname else "Unknown",
-            'model_info': model_info if model_info else "Unknown",
-            'macos_version': macos_version if macos_version else "Unknown",
-            'disk_free': disk_free,
-            'ram_info': ram_info,
-            'open_apps': open_apps,
-            'battery_status': battery_status,
-            'battery_details': battery_details,
-            'current_user': current_user if current_user else "Unknown"
-        }
-    except:
+            outputs = None
+            if remote_probe.USE_PROBE:
+                try:
+                    outputs = collect_with_probe(ssh)
+                except Exception as e:
+                    print(f"Sonde indisponible sur {ip} ({e}), collecte par commandes")
+            if outputs is None:
+                outputs = collect_with_commands(ssh)
+        finally:
+            ssh.close()
+        verdict = collectors.macos_check(outputs)
+        if verdict in (None, 'macos'):
+            ssh_failures.record_success(ip, mac)
+        else:
+            ssh_failures.record_failure(ip, mac, verdict)
+        return collectors.build_result(outputs)
+    except Exception as e:
+        ssh_failures.record_failure(ip, mac, ssh_failures.classify(e))
         return {
             'hostname': "Unknown",
             'model_info': "Unknown",
             'macos_version': "Unknown",
             'disk_free': "Unknown",
             'ram_info': "Unknown",
-            'open_apps': "Unknown",
             'battery_status': {},
             'battery_details': {},
             'current_user': "Unknown"
@@ -205,8 +192,13 @@ def extract_model_identifier(model_info):
         return match.group(1)
     return "Unknown"
 
-def scan_ip(ip, ssh_credentials=None):
-    """Scan une adresse IP et retourne les infos d'état"""
+def scan_ip(ip, ssh_credentials=None, ignore_failures=False):
+    """
+    Scan une adresse IP et retourne les infos d'état.
+
+    `ignore_failures=True` tente le SSH même si la machine est en attente après
+    un échec (rescan demandé explicitement, voir refresh_jobs.py).
+    """
     try:
         if ping(ip):
             mac = get_mac_address(ip)
@@ -218,8 +210,9 @@ def scan_ip(ip, ssh_credentials=None):
             annee = "Unknown"
             current_user = "Unknown"
             ssh_result = {}
-            if USE_SSH and ssh_credentials:
-                ssh_result = try_ssh_connection(ip, ssh_credentials['username'], ssh_credentials['password'])
+            # Machine en attente après un échec SSH récent : pas de nouvelle tentative
+            if USE_SSH and ssh_credentials and (ignore_failures or not ssh_failures.should_skip(ip, mac)):
+                ssh_result = try_ssh_connection(ip, ssh_credentials['username'], ssh_credentials['password'], mac)
                 if isinstance(ssh_result, dict):
                     hostname = ssh_result.get('hostname', 'Unknown')
                     model_info = ssh_result.get('model_info', 'Unknown')
@@ -229,33 +222,34 @@ def scan_ip(ip, ssh_credentials=None):
                     current_user = ssh_result.get('current_user', 'Unknown')
                 else:
                     hostname = ssh_result
-            return {
-                'ip': ip,
-                'mac': mac if mac else "Unknown",
-                'hostname': hostname if hostname else "Unknown",
-                'model_info': model_info if model_info else "Unknown",
-                'macos_version': macos_version if macos_version else "Unknown",
-                'model_identifier': model_identifier,
-                'taille': taille,
-                'annee': annee,
-                'disk_free': ssh_result.get('disk_free', 'Unknown'),
-                'ram_info': ssh_result.get('ram_info', 'Unknown'),
-                'open_apps': ssh_result.get('open_apps', 'Unknown'),
-                'battery_status': ssh_result.get('battery_status', {}),
-                'battery_details': ssh_result.get('battery_details', {}),
-                'current_user': current_user
-            }
+            return MachineRecord(
+                ip=ip,
+                mac=mac if mac else "Unknown",
+                hostname=hostname if hostname else "Unknown",
+                model_info=model_info if model_info else "Unknown",
+                macos_version=macos_version if macos_version else "Unknown",
+                model_identifier=model_identifier,
+                taille=taille,
+                annee=annee,
+                disk_free=ssh_result.get('disk_free', 'Unknown'),
+                ram_info=ssh_result.get('ram_info', 'Unknown'),
+                battery_status=ssh_result.get('battery_status', {}),
+                battery_details=ssh_result.get('battery_details', {}),
+                current_user=current_user
+            )
     except:
         pass
     return None
 
-def save_to_csv(results, filename):
-    """Sauvegarde les résultats dans un fichier CSV et JSON"""
+def save_to_csv(results, filename, partial=False):
+    """Sauvegarde les résultats (MachineRecord ou dicts) dans un fichier CSV et JSON"""
     try:
+        # Conversion en dicts uniquement au moment de la sérialisation
+        results = to_dicts(results)
         with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
             fieldnames = [
                 'IP Address', 'MAC Address', 'Hostname', 'Model Info', 'macOS Version',
-                'Model Identifier', 'Taille', 'Annee', 'Disk Free', 'RAM Info', 'Open Apps',
+                'Model Identifier', 'Taille', 'Annee', 'Disk Free', 'RAM Info',
                 'Battery Status', 'Battery Details', 'Current User'
             ]
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
@@ -283,14 +277,14 @@ def save_to_csv(results, filename):
                         'Annee': result.get('annee', 'Unknown'),
                         'Disk Free': result.get('disk_free', 'Unknown'),
                         'RAM Info': result.get('ram_info', 'Unknown'),
-                        'Open Apps': result.get('open_apps', 'Unknown'),
                         'Battery Status': battery_status_str,
                         'Battery Details': battery_details_str,
                         'Current User': result.get('current_user', 'Unknown')
                     })
-        json_filename = filename.replace('.csv', '.json')
-        with open(json_filename, 'w', encoding='utf-8') as jsonfile:
-            json.dump(results, jsonfile, ensure_ascii=False, indent=4)
+        # Snapshot JSON : keyframe complète ou delta par rapport au scan précédent
+        m = re.search(r"(\d{8}_\d{6})", filename)
+        json_filename = snapshot_store.write_snapshot(results, m.group(1) if m else None, partial=partial)
+        print(f"Snapshot enregistré : {json_filename}")
     except Exception as e:
         print(f"Erreur lors de la sauvegarde du fichier CSV/JSON: {str(e)}")
 
@@ -308,74 +302,388 @@ def cleanup_old_csv():
         pass
 
 def merge_latest_machine_data():
-    """Fusionne tous les fichiers smartelia_machines_*.json et conserve la donnée la plus récente pour chaque machine."""
-    import glob
-    import re
-    json_files = glob.glob("smartelia_machines_*.json")
-    file_dates = {}
-    for f in json_files:
-        m = re.search(r"smartelia_machines_(\d{8}_\d{6})\.json", f)
-        if m:
-            file_dates[f] = m.group(1)
-    sorted_files = sorted(file_dates.items(), key=lambda x: x[1])
+    """Fusionne tous les snapshots (keyframes et deltas) et conserve la donnée la plus récente pour chaque machine."""
     latest_data = {}
-    for f, date in sorted_files:
-        try:
-            with open(f, 'r', encoding='utf-8') as jf:
-                machines = json.load(jf)
-                for machine in machines:
-                    hostname = machine.get('hostname')
-                    if not hostname:
-                        continue
-                    latest_data[hostname] = machine
-        except Exception as e:
-            print(f"Erreur lors de la lecture de {f}: {e}")
+    for date, machines in snapshot_store.iter_snapshots():
+        for machine in machines:
+            hostname = machine.get('hostname')
+            if not hostname:
+                continue
+            latest_data[hostname] = MachineRecord.from_dict(machine)
     with open('smartelia_machines_latest.json', 'w', encoding='utf-8') as out:
-        json.dump(list(latest_data.values()), out, ensure_ascii=False, indent=4)
+        json.dump(to_dicts(latest_data.values()), out, ensure_ascii=False, indent=4)
     print(f"Fusion terminée : {len(latest_data)} machines uniques dans smartelia_machines_latest.json")
 
-def main():
-    print("Démarrage du scan réseau...")
-    print("Scan des plages d'IP : 172.17.17.0/24 à 172.17.20.0/24")
-
-    cleanup_old_csv()
+def get_ssh_credentials():
+    if not USE_SSH:
+        return None
+    return {
+        'username': SSH_USERNAME,
+        'password': SSH_PASSWORD
+    }
 
-    ssh_credentials = None
-    if USE_SSH:
-        ssh_credentials = {
-            'username': SSH_USERNAME,
-            'password': SSH_PASSWORD
-        }
 
+def get_ips_to_scan():
+    """Plages 172.17.17.0/24 à 172.17.20.0/24"""
     ips_to_scan = []
     for x in range(17, 21):
         for y in range(1, 256):
             ips_to_scan.append(f"172.17.{x}.{y}")
+    return ips_to_scan
+
+
+def get_prioritized_ips():
+    """IP à scanner, par priorité décroissante (voir scan_priority.py) ; ordre des adresses en cas d'erreur"""
+    ips_to_scan = get_ips_to_scan()
+    try:
+        machines, history = scan_priority.load_fleet()
+    except Exception as e:
+        print(f"Erreur lors du calcul des priorités de scan: {e}")
+        return ips_to_scan
+    ordered, scores = scan_priority.prioritize(ips_to_scan, machines, history, SCAN_INTERVAL_SECONDS)
+    print(f"Ordre de scan : {len(scores)} machine(s) connue(s) en premier, {len(ordered) - len(scores)} autre(s) adresse(s)")
+    return ordered
+
+
+def process_results(results, timestamp, record=True, notify=True, partial=False, aggregate=True):
+    """
+    Traitements après un scan : CSV/snapshot, journal d'observations, alertes,
+    historique agrégé et pré-rendu du tableau de bord.
+
+    `record=False` quand le scan a déjà été journalisé (mode intégré, voir network_api.publish_scan).
+    `notify=False` quand les alertes sont évaluées sur tout le parc (ordonnanceur continu, host_scheduler.py).
+    `partial=True` quand `results` ne couvre qu'une partie du parc : le snapshot est
+    marqué partiel et ne compte pas comme un scan du parc dans l'historique agrégé.
+    `aggregate=False` : historique agrégé et pré-rendu laissés à l'appelant (rapports
+    des agents, regroupés par agent_ingest.publish_aggregates).
+    Avec SITE_NAME et CENTRAL_API_URL, le scan est aussi envoyé à l'API centrale (site_shipper.py).
+    """
+    # Provenance : machines étiquetées avec le site (SITE_NAME) qui les a scannées
+    site_shipper.tag(results)
+    filename = f"smartelia_machines_{timestamp}.csv"
+    save_to_csv(results, filename, partial)
+    print(f"\nNombre de machines SMARTELIA trouvées : {len(results)}")
+
+    # Scanner de site : envoi du scan (et des lots en attente) à l'API centrale
+    if site_shipper.enabled():
+        try:
+            site_shipper.ship(results, timestamp)
+        except Exception as e:
+            print(f"Erreur lors de l'envoi à l'API centrale: {e}")
 
+    # Journal d'observations : l'API rejoue ces entrées depuis son dernier checkpoint
+    if record:
+        try:
+            observation_log.record_scan(timestamp, results)
+        except Exception as e:
+            print(f"Erreur lors de l'écriture du journal d'observations: {e}")
+
+    # Vérifier et envoyer des notifications d'alerte
+    if notify:
+        print("\n🔔 Vérification des alertes...")
+        email_notifier.check_and_notify(results)
+
+    if aggregate:
+        update_aggregates()
+
+
+def update_aggregates():
+    """Intègre les nouveaux snapshots dans l'historique agrégé, puis pré-rend le tableau de bord"""
+    # Intégration du scan dans l'historique agrégé (rollups horaires/journaliers)
+    try:
+        history_store.update_from_snapshots()
+    except Exception as e:
+        print(f"Erreur lors de la mise à jour de l'historique: {e}")
+
+    # Pré-rendu du tableau de bord : l'API servira directement le fichier généré
+    try:
+        dashboard_renderer.render_after_scan()
+    except Exception as e:
+        print(f"Erreur lors du pré-rendu du tableau de bord: {e}")
+
+
+def save_scan_state():
+    """Fin de scan (ou de lot) : cache des échecs SSH et statistiques des collecteurs"""
+    ssh_failures.save()
+    collectors.save_stats()
+
+
+def scan_threaded(ips_to_scan, ssh_credentials=None, deadline=None):
+    """
+    Scan des IP dans un pool de SCAN_THREADS threads (un seul processus), dans l'ordre de `ips_to_scan`.
+
+    `deadline` (time.monotonic) : les IP pas encore scannées à cette heure sont
+    abandonnées ; les scans en cours sont attendus au plus SCAN_STOP_GRACE_SECONDS.
+
+    Returns:
+        tuple: (machines SMARTELIA trouvées, True si toutes les IP ont été scannées)
+    """
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=100) as executor:
+    complete = True
+
+    def keep(future):
+        try:
+            result = future.result()
+            if result and is_smartelia_machine(result.get('hostname', '')):
+                results.append(result)
+        except:
+            pass
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_THREADS)
+    try:
         with tqdm(total=len(ips_to_scan), desc="Scanning", unit="IP") as pbar:
             futures = {executor.submit(scan_ip, ip, ssh_credentials): ip for ip in ips_to_scan}
-            for future in concurrent.futures.as_completed(futures):
-                pbar.update(1)
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                for future in concurrent.futures.as_completed(futures, timeout=timeout):
+                    pbar.update(1)
+                    keep(future)
+            except concurrent.futures.TimeoutError:
+                complete = False
+                executor.shutdown(wait=False, cancel_futures=True)
+                # Scans déjà commencés : leurs échecs SSH doivent être dans save_scan_state
+                running = [future for future in futures if not future.done()]
+                concurrent.futures.wait(running, timeout=SCAN_STOP_GRACE_SECONDS)
+                for future in running:
+                    if future.done():
+                        pbar.update(1)
+                        keep(future)
+                left = sum(1 for future in futures if future.cancelled() or not future.done())
+                print(f"\nDélai du scan atteint : {left} IP non scannée(s)")
+    finally:
+        executor.shutdown(wait=deadline is None, cancel_futures=True)
+    save_scan_state()
+    return results, complete
+
+
+def partition_ips(ips, shards, block_size=SHARD_BLOCK_SIZE):
+    """
+    Répartit les IP en `shards` partitions.
+
+    La plage est découpée en blocs contigus (sous-réseaux de `block_size` adresses)
+    distribués à tour de rôle : une zone dense en Mac ne tombe pas sur un seul processus.
+    Avec des IP triées par priorité, chaque partition commence par ses IP les plus prioritaires.
+    """
+    partitions = [[] for _ in range(shards)]
+    for i in range(0, len(ips), block_size):
+        partitions[(i // block_size) % shards].extend(ips[i:i + block_size])
+    return [p for p in partitions if p]
+
+
+def _scan_shard(shard_id, ips, ssh_credentials, threads, results, stop=None):
+    """
+    Processus de scan : scanne sa partition et envoie un message par IP au coordinateur.
+
+    Quand `stop` (multiprocessing.Event) est levé, les IP pas encore commencées sont
+    annulées et les scans en cours terminés avant save_scan_state.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    try:
+        futures = {executor.submit(scan_ip, ip, ssh_credentials): ip for ip in ips}
+        pending = set(futures)
+
+        def send(done):
+            for future in done:
+                if future.cancelled():
+                    continue
+                machine = None
                 try:
                     result = future.result()
                     if result and is_smartelia_machine(result.get('hostname', '')):
-                        results.append(result)
-                except:
+                        # dict : les identifiants d'applications (APP_NAMES) sont propres au processus
+                        machine = result.to_dict()
+                except Exception:
                     pass
+                results.put((shard_id, futures[future], machine))
+
+        while pending and not (stop is not None and stop.is_set()):
+            done, pending = concurrent.futures.wait(pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+            send(done)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    # Scans en cours à l'arrêt : terminés par shutdown
+    send(pending)
+    save_scan_state()
+
+
+def scan_sharded(ips_to_scan, ssh_credentials=None, processes=None, deadline=None):
+    """
+    Coordinateur : répartit les IP entre `processes` processus (chacun avec son pool
+    de threads), agrège leurs résultats et leur progression au fil de l'eau.
+
+    Si un processus s'arrête avant d'avoir traité toute sa partition, les IP
+    restantes sont relancées dans un nouveau processus (SHARD_RETRIES fois).
+    À `deadline` (time.monotonic), les processus encore actifs sont priés de s'arrêter
+    (scans en cours terminés, état enregistré) ; ceux qui n'ont pas fini après
+    SCAN_STOP_GRACE_SECONDS sont tués.
+
+    Returns:
+        tuple: (machines SMARTELIA trouvées, True si toutes les IP ont été scannées)
+    """
+    processes = processes or SCAN_PROCESSES
+    partitions = partition_ips(ips_to_scan, processes)
+    threads = max(1, SCAN_THREADS // len(partitions))
+    results_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    remaining = {}
+    workers = {}
+    retries = {}
+
+    def start(shard_id, ips):
+        remaining[shard_id] = set(ips)
+        proc = multiprocessing.Process(target=_scan_shard, args=(shard_id, ips, ssh_credentials, threads, results_queue, stop),
+                                       name=f"scan-shard-{shard_id}", daemon=True)
+        proc.start()
+        workers[shard_id] = proc
+
+    for shard_id, ips in enumerate(partitions):
+        start(shard_id, ips)
+
+    results = []
+    complete = True
+
+    def handle(message):
+        shard_id, ip, machine = message
+        if ip in remaining.get(shard_id, ()):
+            remaining[shard_id].discard(ip)
+            pbar.update(1)
+            if machine:
+                results.append(MachineRecord.from_dict(machine))
+
+    with tqdm(total=len(ips_to_scan), desc=f"Scanning ({len(partitions)} processus)", unit="IP") as pbar:
+        while any(remaining.values()):
+            if deadline is not None and time.monotonic() >= deadline:
+                complete = False
+                stop.set()
+                # Les processus finissent leurs scans en cours et enregistrent leur état
+                # (save_scan_state) ; leurs résultats sont lus pendant l'attente
+                grace_end = time.monotonic() + SCAN_STOP_GRACE_SECONDS
+                while any(proc.is_alive() for proc in workers.values()) and time.monotonic() < grace_end:
+                    try:
+                        handle(results_queue.get(timeout=0.5))
+                    except queue.Empty:
+                        pass
+                try:
+                    while True:
+                        handle(results_queue.get_nowait())
+                except queue.Empty:
+                    pass
+                left = sum(len(ips) for ips in remaining.values())
+                print(f"\nDélai du scan atteint : {left} IP non scannée(s)")
+                for shard_id, proc in workers.items():
+                    if proc.is_alive():
+                        print(f"Processus de scan {shard_id} toujours actif après {SCAN_STOP_GRACE_SECONDS} s : arrêt forcé")
+                        proc.terminate()
+                break
+            try:
+                handle(results_queue.get(timeout=1))
+                continue
+            except queue.Empty:
+                pass
+            for shard_id, proc in list(workers.items()):
+                if proc.is_alive() or not remaining[shard_id]:
+                    continue
+                # Messages envoyés juste avant l'arrêt
+                try:
+                    while True:
+                        handle(results_queue.get(timeout=0.2))
+                except queue.Empty:
+                    pass
+                # Ordre de la partition conservé (IP triées par priorité)
+                left = [ip for ip in partitions[shard_id] if ip in remaining[shard_id]]
+                if not left:
+                    continue
+                retries[shard_id] = retries.get(shard_id, 0) + 1
+                if retries[shard_id] > SHARD_RETRIES:
+                    complete = False
+                    print(f"\nPartition {shard_id} abandonnée : {len(left)} IP non scannée(s)")
+                    pbar.update(len(left))
+                    remaining[shard_id] = set()
+                    continue
+                print(f"\nProcessus de scan {shard_id} arrêté (code {proc.exitcode}), relance pour {len(left)} IP")
+                start(shard_id, left)
+
+    for proc in workers.values():
+        proc.join(timeout=5)
+    return results, complete
+
+
+def main():
+    print("Démarrage du scan réseau...")
+    print("Scan des plages d'IP : 172.17.17.0/24 à 172.17.20.0/24")
+
+    cleanup_old_csv()
+
+    deadline = time.monotonic() + SCAN_DEADLINE_SECONDS if SCAN_DEADLINE_SECONDS else None
+    ssh_credentials = get_ssh_credentials()
+    ips_to_scan = get_prioritized_ips()
+
+    if SCAN_PROCESSES > 1:
+        results, complete = scan_sharded(ips_to_scan, ssh_credentials, deadline=deadline)
+    else:
+        results, complete = scan_threaded(ips_to_scan, ssh_credentials, deadline=deadline)
 
     if results:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"smartelia_machines_{timestamp}.csv"
-        save_to_csv(results, filename)
-        print(f"\nNombre de machines SMARTELIA trouvées : {len(results)}")
-        
-        # Vérifier et envoyer des notifications d'alerte
-        print("\n🔔 Vérification des alertes...")
-        email_notifier.check_and_notify(results)
+        # Scan interrompu (délai, partition abandonnée) : les machines non atteintes
+        # ne doivent pas compter comme absentes dans l'historique agrégé
+        process_results(results, timestamp, partial=not complete)
     else:
         print("\nAucune machine SMARTELIA trouvée")
 
+
+async def scan_network_async(executor, ssh_credentials=None):
+    """Même scan que main(), piloté par asyncio : ping et SSH (paramiko, bloquants) tournent dans `executor`"""
+    loop = asyncio.get_running_loop()
+    ips_to_scan = await loop.run_in_executor(None, get_prioritized_ips)
+    tasks = [loop.run_in_executor(executor, scan_ip, ip, ssh_credentials) for ip in ips_to_scan]
+    results = []
+    for task in asyncio.as_completed(tasks):
+        try:
+            result = await task
+        except Exception:
+            continue
+        if result and is_smartelia_machine(result.get('hostname', '')):
+            results.append(result)
+    await loop.run_in_executor(None, save_scan_state)
+    return results
+
+
+async def run_integrated(publish, interval=None):
+    """
+    Mode intégré : boucle de scan exécutée comme tâche asyncio dans le processus de l'API.
+
+    Chaque scan est transmis à `publish(timestamp, results)` (network_api.publish_scan),
+    qui l'intègre directement à l'état en mémoire et le journalise ; les autres
+    traitements (snapshot, alertes, historique, pré-rendu) suivent en arrière-plan.
+    """
+    interval = SCAN_INTERVAL_SECONDS if interval is None else interval
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_THREADS, thread_name_prefix="scan")
+    try:
+        while True:
+            # Rétention avant scan : agrège puis supprime les anciens snapshots
+            try:
+                await loop.run_in_executor(None, retention.run_retention)
+            except Exception as e:
+                print(f"Erreur lors de la rétention: {e}")
+            try:
+                print("Démarrage du scan réseau (mode intégré)...")
+                started = time.perf_counter()
+                results = await scan_network_async(executor, get_ssh_credentials())
+                if results:
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    await loop.run_in_executor(None, publish, timestamp, results)
+                    print(f"Scan publié en {time.perf_counter() - started:.1f}s : {len(results)} machine(s)")
+                    await loop.run_in_executor(None, process_results, results, timestamp, False)
+                else:
+                    print("\nAucune machine SMARTELIA trouvée")
+            except Exception as e:
+                print(f"Erreur pendant le scan intégré: {e}")
+            await asyncio.sleep(interval)
+    finally:
+        # Arrêt de l'API : ne pas attendre les IP restant à scanner
+        executor.shutdown(wait=False, cancel_futures=True)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Journal des observations (event sourcing) et checkpoints de l'état fusionné.
+
+Chaque scan est ajouté en fin de journal (`observations/log-<date>.jsonl`, une
+ligne JSON par scan). Tous les CHECKPOINT_INTERVAL scans, l'état du
+MergeReducer est sauvegardé (`observations/checkpoint.json.gz`) puis un nouveau
+segment de journal est ouvert ; les segments entièrement couverts par le
+checkpoint sont supprimés.
+
+Plusieurs processus écrivent dans le journal (scanner, API pour les agents) : les
+écritures sont protégées par un verrou fcntl et chaque entrée reçoit un numéro de
+séquence (`seq`) croissant. L'ordre du journal est celui des numéros, pas des dates :
+un scan daté avant un lot d'agents déjà journalisé n'est pas ignoré par catch_up.
+
+Au démarrage, l'API charge le checkpoint et ne rejoue que la fin du journal :
+le temps de démarrage reste borné quelle que soit la profondeur de l'historique.
+Sans checkpoint ni journal (première installation), l'état est reconstruit une
+fois depuis les snapshots existants (snapshot_store).
+"""
+import contextlib
+import fcntl
+import glob
+import gzip
+import json
+import os
+import re
+
+import snapshot_store
+from dashboard_renderer import atomic_write
+from machine_record import to_dicts
+from merge_state import MergeReducer, rebuild_from_snapshots
+
+OBSERVATION_DIR = os.getenv("OBSERVATION_DIR", "observations")
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "24"))
+CHECKPOINT_FILE = "checkpoint.json.gz"
+SEGMENT_PATTERN = re.compile(r"log-(\d{8}_\d{6})\.jsonl$")
+CHECKPOINT_VERSION = 1
+LOCK_FILE = "journal.lock"
+SEQ_FILE = "seq"
+# Début d'une ligne du journal : le numéro de séquence est lu sans décoder le scan
+SEQ_PREFIX = re.compile(r'\{"seq":(\d+),')
+
+
+def checkpoint_path(directory=None):
+    return os.path.join(directory or OBSERVATION_DIR, CHECKPOINT_FILE)
+
+
+@contextlib.contextmanager
+def _locked(directory=None):
+    directory = directory or OBSERVATION_DIR
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def list_segments(directory=None):
+    """Segments du journal triés : liste de (date de la première entrée, chemin)"""
+    segments = []
+    for path in glob.glob(os.path.join(directory or OBSERVATION_DIR, "log-*.jsonl")):
+        m = SEGMENT_PATTERN.search(os.path.basename(path))
+        if m:
+            segments.append((m.group(1), path))
+    return sorted(segments)
+
+
+def signature(directory=None):
+    """Signature (nom, mtime, taille) du journal et du checkpoint"""
+    paths = [path for _, path in list_segments(directory)] + [checkpoint_path(directory)]
+    result = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        result.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(result)
+
+
+def load_checkpoint(directory=None):
+    """Retourne l'état sauvegardé (dict) ou None"""
+    path = checkpoint_path(directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+    except Exception as e:
+        print(f"Checkpoint illisible ({path}): {e}")
+        return None
+    if payload.get('version') != CHECKPOINT_VERSION:
+        return None
+    return payload.get('state')
+
+
+def iter_entries(after=None, since=None, directory=None):
+    """
+    Entrées du journal postérieures au numéro de séquence `after`, dans l'ordre.
+
+    Les entrées sans numéro (journal antérieur aux séquences) sont filtrées par
+    date (`since`).
+
+    Yields:
+        tuple: (seq ou None, date, machines)
+    """
+    for start, path in list_segments(directory):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                m = SEQ_PREFIX.match(line)
+                if m and after is not None and int(m.group(1)) <= after:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Dernière ligne tronquée (arrêt pendant l'écriture)
+                    continue
+                seq = entry.get('seq')
+                if seq is None and since and entry['date'] <= since:
+                    continue
+                yield seq, entry['date'], entry['machines']
+
+
+def restore(directory=None, keep_history=True):
+    """
+    Reconstruit l'état fusionné : checkpoint + fin du journal.
+
+    Returns:
+        tuple: (MergeReducer, nombre de scans rejoués)
+    """
+    state = load_checkpoint(directory)
+    if state is None and not list_segments(directory):
+        # Première utilisation : amorçage (parallèle) depuis les snapshots existants
+        reducer = rebuild_from_snapshots(keep_history)
+        return reducer, len(snapshot_store.list_snapshots())
+    reducer = MergeReducer.from_state(state, keep_history) if state else MergeReducer(keep_history)
+    replayed = 0
+    for seq, date, machines in iter_entries(reducer.last_seq, reducer.last_date, directory):
+        reducer.apply(date, machines, seq)
+        replayed += 1
+    return reducer, replayed
+
+
+def catch_up(reducer, directory=None):
+    """
+    Applique à `reducer` les entrées ajoutées depuis sa dernière date.
+
+    Returns:
+        int: nombre de scans appliqués, ou None si le journal a été compacté au-delà
+        de l'état du reducer (il faut alors repartir du checkpoint)
+    """
+    state = load_checkpoint(directory)
+    if state:
+        if state.get('last_seq') is not None:
+            compacted = reducer.last_seq is None or state['last_seq'] > reducer.last_seq
+        else:
+            compacted = reducer.last_date is None or state.get('last_date', '') > reducer.last_date
+        if compacted:
+            return None
+    applied = 0
+    for seq, date, machines in iter_entries(reducer.last_seq, reducer.last_date, directory):
+        reducer.apply(date, machines, seq)
+        applied += 1
+    return applied
+
+
+def write_checkpoint(reducer, directory=None):
+    """
+    Sauvegarde l'état puis supprime les segments qu'il couvre entièrement.
+
+    Appelé sous le verrou du journal avec un état à jour de toutes ses entrées.
+    """
+    directory = directory or OBSERVATION_DIR
+    os.makedirs(directory, exist_ok=True)
+    payload = {'version': CHECKPOINT_VERSION, 'state': reducer.to_state()}
+    data = gzip.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), mtime=0)
+    atomic_write(checkpoint_path(directory), data)
+    for start, path in list_segments(directory):
+        if start <= (reducer.last_date or ''):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Impossible de supprimer {path}: {e}")
+
+
+def _next_seq(directory=None):
+    """Numéro de séquence de la prochaine entrée (appelé sous le verrou du journal)"""
+    directory = directory or OBSERVATION_DIR
+    path = os.path.join(directory, SEQ_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            last = int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        # Fichier absent : reprise après le checkpoint et les entrées existantes
+        state = load_checkpoint(directory) or {}
+        last = state.get('last_seq') or 0
+        for seq, _, _ in iter_entries(last, directory=directory):
+            last = max(last, seq or 0)
+    atomic_write(path, str(last + 1).encode("utf-8"))
+    return last + 1
+
+
+def append(date, machines, directory=None, seq=None):
+    """
+    Ajoute un scan en fin de journal (sous le verrou du journal, voir record_scan).
+
+    Returns:
+        int: nombre de scans dans le segment courant (non couverts par le checkpoint)
+    """
+    directory = directory or OBSERVATION_DIR
+    os.makedirs(directory, exist_ok=True)
+    segments = list_segments(directory)
+    path = segments[-1][1] if segments else os.path.join(directory, f"log-{date}.jsonl")
+    entry = {'seq': seq, 'date': date, 'machines': to_dicts(machines)} if seq is not None \
+        else {'date': date, 'machines': to_dicts(machines)}
+    line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def record_scan(date, machines, directory=None, reducer=None):
+    """
+    Journalise un scan et écrit un checkpoint si nécessaire, sous le verrou du journal.
+
+    `reducer` : état fusionné en mémoire (mode intégré), sans ce scan. Il intègre
+    d'abord les entrées écrites par d'autres processus, puis le scan ; le
+    checkpoint est alors écrit depuis la mémoire, sans relire le journal.
+    """
+    with _locked(directory):
+        if load_checkpoint(directory) is None and not list_segments(directory):
+            # Amorçage : le checkpoint initial couvre les snapshots déjà présents
+            base = reducer if reducer is not None else restore(directory)[0]
+            if base.last_date:
+                write_checkpoint(base, directory)
+        if reducer is not None and catch_up(reducer, directory) is None:
+            # Checkpoint plus récent que l'état en mémoire : l'API repartira du checkpoint
+            reducer.apply(date, machines)
+            reducer = None
+        seq = _next_seq(directory)
+        pending = append(date, machines, directory, seq)
+        if reducer is not None:
+            reducer.apply(date, machines, seq)
+        if pending >= CHECKPOINT_INTERVAL:
+            replayed = pending
+            if reducer is None:
+                reducer, replayed = restore(directory)
+            write_checkpoint(reducer, directory)
+            print(f"Checkpoint de l'état fusionné écrit ({replayed} scan(s) intégrés)")
+    return pending
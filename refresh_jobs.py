@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Rescan immédiat de quelques machines (`POST /machines/{hostname}/refresh`,
+`POST /machines/refresh`).
+
+Après une intervention sur un Mac, inutile d'attendre le prochain balayage des
+1 020 IP : l'API scanne tout de suite la machine à sa dernière IP connue, dans
+un pool de threads dédié (REFRESH_THREADS), indépendant des scans périodiques.
+
+- Chaque demande crée un job (identifiant renvoyé immédiatement) ; son état et
+  les enregistrements mis à jour sont consultables sur `GET /refresh/{job_id}`.
+- Une machine déjà en cours de rescan n'est pas scannée une deuxième fois : les
+  jobs simultanés partagent le même résultat.
+- Le rescan ignore le cache des échecs SSH (la machine vient peut-être d'être réparée)
+  et vérifie que l'IP correspond toujours au même nom d'hôte.
+- Les machines rescannées sont publiées à la fin du job par le chemin d'ingestion
+  des agents (agent_ingest.py) : snapshot partiel (hors comptage des scans du
+  parc dans les rollups), journal d'observations, fusion. Un scan périodique
+  journalisé ensuite mais daté avant le rescan n'écrase pas la machine rescannée.
+  Ils échappent au dédoublonnage par timestamp des agents (horloges différentes) ;
+  si la publication échoue, les machines du job sont marquées en échec.
+
+Les jobs sont gardés en mémoire (JOBS_KEEP derniers) par le processus de l'API :
+avec plusieurs workers, `?wait=` évite de consulter un autre worker.
+"""
+import concurrent.futures
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+REFRESH_THREADS = int(os.getenv("REFRESH_THREADS", "8"))
+REFRESH_MAX_HOSTS = 50
+JOBS_KEEP = 200
+MAX_WAIT_SECONDS = 60
+
+DATE_FORMAT = "%Y%m%d_%H%M%S"
+
+
+class RefreshError(Exception):
+    """Rescan impossible pour une machine (injoignable, IP réattribuée, site distant)"""
+
+
+def scan_host(hostname, entry):
+    """Scanne `hostname` à sa dernière IP connue ; retourne le dict de la machine"""
+    import network_scanner
+    import site_shipper
+    if entry.get('site') and entry.get('site') != site_shipper.SITE_NAME:
+        raise RefreshError(f"Machine du site {entry['site']} : rescan à demander au scanner de ce site")
+    ip = entry.get('ip')
+    if not ip or ip == "Unknown":
+        raise RefreshError("Adresse IP inconnue")
+    record = network_scanner.scan_ip(ip, network_scanner.get_ssh_credentials(), ignore_failures=True)
+    if record is None:
+        raise RefreshError(f"{ip} ne répond pas au ping")
+    found = record.get('hostname')
+    if found != hostname:
+        if found in (None, "Unknown"):
+            raise RefreshError(f"Connexion SSH impossible à {ip}")
+        raise RefreshError(f"{ip} correspond maintenant à {found}")
+    return record.to_dict()
+
+
+class RefreshJob:
+    """Rescan d'une ou plusieurs machines"""
+
+    def __init__(self, hostnames):
+        self.id = uuid.uuid4().hex[:12]
+        self.hostnames = hostnames
+        self.created = datetime.now()
+        self.finished = None
+        self.results = {}
+        self.done = threading.Event()
+
+    @property
+    def status(self):
+        if not self.done.is_set():
+            return "running"
+        if all(r['status'] == "ok" for r in self.results.values()):
+            return "done"
+        return "failed" if all(r['status'] != "ok" for r in self.results.values()) else "partial"
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'hostnames': self.hostnames,
+            'created': self.created.strftime("%Y-%m-%d %H:%M:%S"),
+            'finished': self.finished.strftime("%Y-%m-%d %H:%M:%S") if self.finished else None,
+            'results': {h: self.results[h] for h in self.hostnames if h in self.results},
+        }
+
+
+class RefreshManager:
+    """Pool de rescan, déduplication par machine et historique des jobs"""
+
+    def __init__(self, lookup, publish, scan=scan_host, threads=REFRESH_THREADS):
+        self.lookup = lookup
+        self.publish = publish
+        self.scan = scan
+        self.threads = threads
+        self.executor = None
+        self.jobs = OrderedDict()
+        self._inflight = {}
+        # Réentrant : un rescan déjà terminé appelle _release pendant _host_future
+        self._lock = threading.RLock()
+
+    def _collect(self, hostname, entry):
+        try:
+            machine = self.scan(hostname, entry)
+        except RefreshError as e:
+            return {'status': "failed", 'error': str(e)}
+        except Exception as e:
+            return {'status': "failed", 'error': f"Erreur pendant le rescan : {e}"}
+        return {'status': "ok", 'timestamp': datetime.now().strftime(DATE_FORMAT), 'machine': machine}
+
+    def _host_future(self, hostname):
+        """Rescan en cours pour `hostname` ou nouveau rescan (appelé sous verrou)"""
+        future = self._inflight.get(hostname)
+        if future is not None:
+            return future
+        entry = self.lookup(hostname)
+        if entry is None:
+            future = concurrent.futures.Future()
+            future.set_result({'status': "failed", 'error': "Machine inconnue"})
+            return future
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="refresh")
+        future = self.executor.submit(self._collect, hostname, entry)
+        self._inflight[hostname] = future
+        future.add_done_callback(lambda f, h=hostname: self._release(h, f))
+        return future
+
+    def _release(self, hostname, future):
+        with self._lock:
+            if self._inflight.get(hostname) is future:
+                del self._inflight[hostname]
+
+    def submit(self, hostnames):
+        """Crée un job pour `hostnames` (sans doublons, dans l'ordre)"""
+        job = RefreshJob(list(dict.fromkeys(hostnames)))
+        with self._lock:
+            futures = {hostname: self._host_future(hostname) for hostname in job.hostnames}
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOBS_KEEP:
+                self.jobs.popitem(last=False)
+        remaining = [len(futures)]
+        remaining_lock = threading.Lock()
+
+        def host_done(hostname, future):
+            job.results[hostname] = future.result()
+            with remaining_lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._finish(job)
+
+        for hostname, future in futures.items():
+            future.add_done_callback(lambda f, h=hostname: host_done(h, f))
+        return job
+
+    def _finish(self, job):
+        """Publication des machines rescannées, puis job terminé (machines en échec si la publication échoue)"""
+        refreshed = [r for r in job.results.values() if r['status'] == "ok"]
+        if refreshed:
+            try:
+                self.publish(refreshed)
+            except Exception as e:
+                print(f"Erreur lors de la publication du rescan {job.id}: {e}")
+                for hostname, result in list(job.results.items()):
+                    if result['status'] == "ok":
+                        job.results[hostname] = {'status': "failed", 'error': f"Publication impossible : {e}"}
+        job.finished = datetime.now()
+        job.done.set()
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
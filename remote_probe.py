@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Sonde de collecte déposée sur les Mac (`smartelia_probe.sh`).
+
+Au lieu d'envoyer à chaque scan une dizaine de commandes (system_profiler, awk,
+grep, osascript...), le scanner exécute une seule commande : elle vérifie
+l'empreinte SHA-256 de `~/.smartelia/smartelia_probe.sh` et, si elle correspond
+à la version locale de la sonde, l'exécute. Sinon (première visite, nouvelle
+version), la sonde est déposée par SFTP sur la connexion SSH existante puis exécutée.
+
+Le script déposé est `smartelia_probe.sh` complété par la table des
+collecteurs activés (collectors.py) : activer ou désactiver un collecteur change
+l'empreinte et redéploie la sonde. Elle exécute chaque collecteur avec son délai
+maximal, mesure sa durée, met en cache côté Mac les informations statiques
+(modèle, santé de la batterie ; rafraîchies une fois par jour) et renvoie un objet JSON compact.
+
+Si la sonde reste introuvable juste après son dépôt (répertoire courant SFTP
+différent de `$HOME`), la machine passe en collecte par commandes jusqu'au
+redémarrage du processus, sans nouveau dépôt à chaque scan.
+"""
+import hashlib
+import io
+import json
+import os
+
+import collectors
+
+PROBE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smartelia_probe.sh")
+# Chemins relatifs au dossier personnel de l'utilisateur SSH (répertoire courant SFTP)
+REMOTE_DIR = ".smartelia"
+REMOTE_NAME = "smartelia_probe.sh"
+# SSH_PROBE=0 : commandes SSH individuelles (comportement historique)
+USE_PROBE = os.getenv("SSH_PROBE", "1") == "1"
+# Marge ajoutée à la somme des délais des collecteurs (dépôt, vérification de l'empreinte)
+PROBE_TIMEOUT_MARGIN = 15
+
+MISSING = "SMARTELIA_PROBE_MISSING"
+
+_script = {}
+# Adresses où la sonde déposée reste introuvable (voir collect)
+_unavailable = set()
+
+
+def build_script():
+    """Sonde à déposer : modèle smartelia_probe.sh + une ligne par collecteur activé"""
+    with open(PROBE_FILE, "r", encoding="utf-8") as f:
+        template = f.read()
+    table = "\n".join(
+        f"{c.name}\t{c.timeout}\t{c.cache_key if c.static else '-'}\t{c.command}"
+        for c in collectors.enabled_collectors())
+    return template.replace("@COLLECTORS@", table).encode("utf-8")
+
+
+def load_script():
+    """Contenu (bytes) et empreinte SHA-256 de la sonde, construits une fois par processus"""
+    if not _script:
+        content = build_script()
+        _script.update(content=content, digest=hashlib.sha256(content).hexdigest())
+    return _script['content'], _script['digest']
+
+
+def probe_command(digest):
+    """Commande distante : exécute la sonde si son empreinte est `digest`, sinon affiche MISSING"""
+    path = f'"$HOME/{REMOTE_DIR}/{REMOTE_NAME}"'
+    return (f'p={path}; if [ "$(shasum -a 256 "$p" 2>/dev/null | cut -d" " -f1)" = "{digest}" ]; '
+            f'then /bin/bash "$p"; else echo {MISSING}; fi')
+
+
+def _run(ssh, command):
+    timeout = sum(c.timeout for c in collectors.enabled_collectors()) + PROBE_TIMEOUT_MARGIN
+    stdin, stdout, stderr = ssh.exec_command(command, timeout=timeout)
+    return stdout.read().decode(errors="replace").strip()
+
+
+def upload(ssh, content):
+    """Dépose la sonde par SFTP (fichier temporaire puis renommage : jamais de sonde tronquée)"""
+    sftp = ssh.open_sftp()
+    try:
+        try:
+            sftp.mkdir(REMOTE_DIR, 0o700)
+        except IOError:
+            pass  # Dossier déjà présent
+        target = f"{REMOTE_DIR}/{REMOTE_NAME}"
+        tmp = f"{target}.tmp"
+        sftp.putfo(io.BytesIO(content), tmp)
+        sftp.chmod(tmp, 0o700)
+        try:
+            sftp.posix_rename(tmp, target)
+        except IOError:
+            # Serveur sans l'extension posix-rename : rename SFTP refuse d'écraser
+            try:
+                sftp.remove(target)
+            except IOError:
+                pass
+            sftp.rename(tmp, target)
+    finally:
+        sftp.close()
+
+
+def collect(ssh):
+    """
+    Exécute la sonde sur une connexion SSH ouverte (dépôt si absente ou périmée).
+
+    Returns:
+        dict: {nom du collecteur: {"rc", "ms", "timeout", "cached", "out"}},
+        ou None si la sonde n'a pas pu être exécutée
+    """
+    host = ssh.get_transport().getpeername()[0]
+    if host in _unavailable:
+        return None
+    content, digest = load_script()
+    command = probe_command(digest)
+    output = _run(ssh, command)
+    if output == MISSING:
+        upload(ssh, content)
+        output = _run(ssh, command)
+        if output == MISSING:
+            _unavailable.add(host)
+            print(f"Sonde déposée mais introuvable dans $HOME/{REMOTE_DIR} sur {host} "
+                  f"(répertoire SFTP différent ?) : collecte par commandes")
+            return None
+    try:
+        # strict=False : caractère de contrôle oublié par la sonde toléré
+        data = json.loads(output, strict=False)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('c'), dict):
+        return None
+    return data['c']
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Moteur de rétention des scans.
+
+Remplace la simple suppression des plus anciens fichiers `smartelia_machines_*.json`
+(keyframes et deltas, voir snapshot_store.py) :
+1. les snapshots bruts pas encore intégrés sont agrégés dans les rollups horaires ;
+2. les rollups sont sauvegardés AVANT toute suppression de fichier brut ;
+3. seuls les snapshots déjà intégrés au-delà de RAW_MAX_FILES sont supprimés ;
+4. les buckets horaires plus anciens que HOURLY_RETENTION_DAYS sont compactés en jours ;
+5. les buckets journaliers plus anciens que DAILY_RETENTION_DAYS sont supprimés.
+
+Le stockage reste borné tandis que les tendances batterie/disque restent interrogeables.
+"""
+import logging
+import os
+import time
+
+import history_store
+import snapshot_store
+
+# Nombre de snapshots bruts conservés (le tableau de bord fusionne ces fichiers)
+RAW_MAX_FILES = int(os.getenv("RAW_MAX_FILES", "5"))
+HOURLY_RETENTION_DAYS = int(os.getenv("HOURLY_RETENTION_DAYS", "14"))
+DAILY_RETENTION_DAYS = int(os.getenv("DAILY_RETENTION_DAYS", "730"))
+
+
+def cleanup_raw_snapshots(store, max_files=RAW_MAX_FILES):
+    """
+    Supprime les snapshots bruts les plus anciens au-delà de `max_files`, s'ils sont déjà agrégés.
+
+    Les keyframes dont dépendent des deltas conservés ne sont jamais supprimées
+    (voir snapshot_store.removable_snapshots).
+    """
+    removed = 0
+    for date, path in snapshot_store.removable_snapshots(max_files):
+        if store.high_water is None or date > store.high_water:
+            logging.warning(f"Snapshot non agrégé conservé : {path}")
+            # Les snapshots suivants dépendent peut-être de celui-ci
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            logging.info(f"Removed old json file: {path}")
+        except Exception:
+            logging.exception(f"Failed to remove {path}")
+            break
+    return removed
+
+
+def run_retention(now=None):
+    """Applique la politique de rétention complète (appelé avant chaque scan)"""
+    now = now or time.time()
+    # Un update_from_snapshots concurrent ne doit ni réintégrer des scans compactés, ni perdre les nôtres
+    with history_store.locked():
+        store = history_store.RollupStore.load()
+
+        added = history_store.ingest_snapshots(store)
+        if added:
+            # Les agrégats doivent être sur disque avant de supprimer les données brutes
+            store.save()
+            logging.info(f"Rétention : {added} snapshot(s) agrégé(s) dans les rollups horaires")
+
+        cleanup_raw_snapshots(store)
+
+        hourly_cutoff = history_store.bucket_start('day', now - HOURLY_RETENTION_DAYS * 86400)
+        compacted = store.compact(hourly_cutoff)
+        daily_cutoff = history_store.bucket_start('day', now - DAILY_RETENTION_DAYS * 86400)
+        pruned = store.prune('day', daily_cutoff)
+        if compacted or pruned:
+            store.save()
+            logging.info(f"Rétention : {compacted} bucket(s) horaire(s) compacté(s), {pruned} bucket(s) journalier(s) expiré(s)")
+        return {'ingested': added, 'compacted': compacted, 'pruned': pruned}
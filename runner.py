@@ -2,57 +2,168 @@
 """Runner simple pour Docker :
 - démarre l'API FastAPI (uvicorn) en sous-processus
 - exécute network_scanner.main() toutes les 10 minutes
-- nettoie les anciens fichiers JSON si leur nombre dépasse la limite
+- applique la rétention (agrégation des anciens scans en rollups, voir retention.py)
+
+Chaque cycle (rétention + scan) tourne dans un processus enfant (`runner.py --cycle`) :
+- limite de durée CYCLE_TIMEOUT_SECONDS, au-delà le groupe de processus est tué ;
+- comptabilité des ressources (temps CPU, RSS maximal, descripteurs ouverts) ;
+- cadence fixe : l'intervalle est mesuré depuis le début du cycle, un cycle en
+  retard fait sauter les créneaux manqués (jamais deux cycles en même temps).
+Threads paramiko bloqués et sockets oubliés disparaissent avec l'enfant : la
+mémoire et les descripteurs du runner restent stables.
+
+Avec `--continuous` (ou RUNNER_CONTINUOUS=1), le scan par cycles est remplacé par
+l'ordonnanceur continu machine par machine (host_scheduler.py), exécuté dans un
+processus enfant relancé s'il s'arrête.
+
+Avec `--integrated` (ou RUNNER_INTEGRATED=1), un seul processus : uvicorn exécute
+l'API et la boucle de scan tourne comme tâche asyncio de l'application
+(voir network_scanner.run_integrated) ; les scans sont publiés directement en mémoire.
 """
-import glob
 import os
+import resource
+import signal
 import subprocess
+import sys
 import time
 import logging
-from datetime import datetime
-
-import network_scanner
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+SCAN_INTERVAL_SECONDS = int(os.getenv("SCAN_INTERVAL_SECONDS", str(10 * 60)))
+CYCLE_TIMEOUT_SECONDS = int(os.getenv("CYCLE_TIMEOUT_SECONDS", str(9 * 60)))
+# Délai entre SIGTERM et SIGKILL à l'expiration d'un cycle
+CYCLE_KILL_GRACE_SECONDS = 10
+# Période d'échantillonnage des descripteurs ouverts de l'enfant
+CYCLE_POLL_SECONDS = 1
+# Délai minimal entre deux démarrages de l'ordonnanceur continu
+SCHEDULER_RESTART_SECONDS = 30
 
-def cleanup_json_limit(max_files=5, pattern="smartelia_machines_*.json"):
-    files = glob.glob(pattern)
-    if len(files) <= max_files:
-        return
-    # trier par date de modification (ancien -> récent)
-    files_sorted = sorted(files, key=lambda f: os.path.getmtime(f))
-    while len(files_sorted) > max_files:
-        to_remove = files_sorted.pop(0)
-        try:
-            os.remove(to_remove)
-            logging.info(f"Removed old json file: {to_remove}")
-        except Exception as e:
-            logging.exception(f"Failed to remove {to_remove}: {e}")
+# Nombre de workers uvicorn ; au-delà de 1, la fusion est partagée entre eux (voir shared_state.py)
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 
 
 def start_api():
     cmd = ["uvicorn", "network_api:app", "--host", "0.0.0.0", "--port", "8000"]
-    proc = subprocess.Popen(cmd)
+    env = None
+    if API_WORKERS > 1:
+        cmd += ["--workers", str(API_WORKERS)]
+        env = dict(os.environ, API_SHARED_STATE="1")
+    proc = subprocess.Popen(cmd, env=env)
     logging.info(f"Started uvicorn (pid={proc.pid})")
     return proc
 
 
+def run_cycle():
+    """Un cycle complet, exécuté dans le processus enfant (`runner.py --cycle`)"""
+    import network_scanner
+    import retention
+    status = 0
+    # Rétention avant scan : agrège puis supprime les anciens snapshots
+    try:
+        retention.run_retention()
+    except Exception:
+        logging.exception("Error while applying retention")
+        status = 1
+    try:
+        # Appeler la fonction main du scanner (cela peut prendre du temps)
+        network_scanner.main()
+    except Exception:
+        logging.exception("Error while running network_scanner.main()")
+        status = 1
+    return status
+
+
+def count_fds(pid):
+    """Nombre de descripteurs ouverts par `pid` (None si /proc n'est pas disponible)"""
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return None
+
+
+def _rss_mb(maxrss):
+    # ru_maxrss : Ko sous Linux, octets sous macOS
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_cycle_process(timeout=None):
+    """
+    Lance un cycle dans un processus enfant et attend sa fin (au plus `timeout` secondes).
+
+    Returns:
+        dict: durée, code de sortie, dépassement, CPU utilisateur/système, RSS max (Mo), descripteurs max
+    """
+    timeout = CYCLE_TIMEOUT_SECONDS if timeout is None else timeout
+    started = time.monotonic()
+    # Nouveau groupe de processus : les ping/ssh lancés par le scan sont tués avec lui
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--cycle"], start_new_session=True)
+    peak_fds = None
+    timed_out = False
+    deadline = started + timeout
+    while True:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            break
+        fds = count_fds(proc.pid)
+        if fds is not None:
+            peak_fds = max(peak_fds or 0, fds)
+        now = time.monotonic()
+        if now >= deadline:
+            if not timed_out:
+                timed_out = True
+                logging.error(f"Scan cycle exceeded {timeout}s, terminating (pid={proc.pid})")
+                _signal_group(proc.pid, signal.SIGTERM)
+                deadline = now + CYCLE_KILL_GRACE_SECONDS
+            else:
+                _signal_group(proc.pid, signal.SIGKILL)
+                pid, status, usage = os.wait4(proc.pid, 0)
+                break
+        time.sleep(CYCLE_POLL_SECONDS)
+    # Processus déjà récupéré par wait4 : Popen ne doit pas l'attendre à nouveau
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'duration': round(time.monotonic() - started, 1),
+        'exit_code': proc.returncode,
+        'timed_out': timed_out,
+        'cpu_user': round(usage.ru_utime, 1),
+        'cpu_system': round(usage.ru_stime, 1),
+        'max_rss_mb': round(_rss_mb(usage.ru_maxrss), 1),
+        'max_fds': peak_fds,
+    }
+
+
+def _signal_group(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        pass
+
+
 def main_loop():
     api_proc = start_api()
+    interval = SCAN_INTERVAL_SECONDS
+    next_start = time.monotonic()
     try:
         while True:
             logging.info("Starting scheduled network scan")
-            # Nettoyage avant scan pour s'assurer de garder la taille
-            cleanup_json_limit(5)
-            try:
-                # Appeler la fonction main du scanner (cela peut prendre du temps)
-                network_scanner.main()
-            except Exception:
-                logging.exception("Error while running network_scanner.main()")
-
-            logging.info("Scan finished. Sleeping 10 minutes")
-            time.sleep(10 * 60)
+            stats = run_cycle_process()
+            logging.info(
+                "Scan cycle finished: {duration}s, exit={exit_code}, timeout={timed_out}, "
+                "cpu={cpu_user}s user/{cpu_system}s sys, max_rss={max_rss_mb}MB, max_fds={max_fds}".format(**stats)
+            )
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            logging.info(f"Runner: max_rss={_rss_mb(own.ru_maxrss):.1f}MB, fds={count_fds(os.getpid())}")
+
+            # Cadence fixe mesurée depuis le début du cycle ; créneaux manqués sautés
+            next_start += interval
+            now = time.monotonic()
+            if now > next_start:
+                skipped = int((now - next_start) // interval) + 1
+                next_start += skipped * interval
+                logging.warning(f"Scan cycle overran its slot, skipping {skipped} slot(s)")
+            logging.info(f"Next scan in {next_start - now:.0f}s")
+            time.sleep(next_start - now)
     finally:
         try:
             api_proc.terminate()
@@ -61,5 +172,50 @@ def main_loop():
             pass
 
 
+def continuous_loop():
+    """API + ordonnanceur continu (host_scheduler.py) dans un enfant relancé en cas d'arrêt"""
+    api_proc = start_api()
+    proc = None
+    try:
+        while True:
+            started = time.monotonic()
+            proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--scheduler"], start_new_session=True)
+            logging.info(f"Started host scheduler (pid={proc.pid})")
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            logging.error(
+                f"Host scheduler exited: exit={proc.returncode}, cpu={usage.ru_utime:.1f}s user/{usage.ru_stime:.1f}s sys, "
+                f"max_rss={_rss_mb(usage.ru_maxrss):.1f}MB"
+            )
+            time.sleep(max(0, SCHEDULER_RESTART_SECONDS - (time.monotonic() - started)))
+    finally:
+        if proc is not None and proc.returncode is None:
+            _signal_group(proc.pid, signal.SIGTERM)
+        try:
+            api_proc.terminate()
+            logging.info("Terminated uvicorn process")
+        except Exception:
+            pass
+
+
+def run_integrated():
+    """API et scanner dans le même processus (voir network_api.lifespan)"""
+    import uvicorn
+    if API_WORKERS > 1:
+        logging.warning("API_WORKERS ignoré en mode intégré (un seul processus)")
+    os.environ["INTEGRATED_SCANNER"] = "1"
+    uvicorn.run("network_api:app", host="0.0.0.0", port=8000)
+
+
 if __name__ == "__main__":
-    main_loop()
+    if "--cycle" in sys.argv[1:]:
+        sys.exit(run_cycle())
+    elif "--scheduler" in sys.argv[1:]:
+        import host_scheduler
+        host_scheduler.main()
+    elif "--continuous" in sys.argv[1:] or os.getenv("RUNNER_CONTINUOUS") == "1":
+        continuous_loop()
+    elif "--integrated" in sys.argv[1:] or os.getenv("RUNNER_INTEGRATED") == "1":
+        run_integrated()
+    else:
+        main_loop()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Ordre de scan par priorité (`network_scanner.main`).
+
+Les 1 020 IP étaient scannées dans l'ordre des adresses : une machine au disque
+critique n'était pas rafraîchie plus tôt qu'une adresse vide. Les IP sont
+maintenant classées d'après le dernier état fusionné (journal d'observations) :
+- ancienneté de la dernière observation, en intervalles de scan (plafonnée à STALENESS_CAP) ;
+- alerte en cours : disque critique (CRITICAL_THRESHOLD), batterie faible
+  (LOW_BATTERY_THRESHOLD), disque en avertissement ;
+- volatilité récente : part des scans de l'historique en mémoire (MERGE_HISTORY_DAYS)
+  où batterie ou disque ont varié, ou où la machine était sur batterie.
+
+Les IP sans machine SMARTELIA connue passent en dernier, dans l'ordre des
+adresses. Un cycle interrompu par son délai (SCAN_DEADLINE_SECONDS) a ainsi
+déjà rafraîchi les machines qui comptent le plus.
+"""
+from datetime import datetime
+
+import observation_log
+from machine_index import FIELDS
+from merge_state import NICE_DATE_FORMAT
+
+# Ancienneté maximale prise en compte (en intervalles de scan)
+STALENESS_CAP = 6
+DISK_CRITICAL_WEIGHT = 8
+BATTERY_LOW_WEIGHT = 4
+DISK_WARNING_WEIGHT = 2
+VOLATILITY_WEIGHT = 3
+
+# Variations considérées comme un changement entre deux scans d'une machine
+BATTERY_CHANGE = 3
+DISK_CHANGE_GB = 1.0
+
+
+def volatility(points):
+    """Part (0 à 1) des points d'historique où la machine a bougé depuis le point précédent"""
+    if len(points) < 2:
+        return 0.0
+    changes = 0
+    for before, after in zip(points, points[1:]):
+        if after.get('on_ac') is False:
+            changes += 1
+            continue
+        for metric, threshold in (('battery_percent', BATTERY_CHANGE), ('disk_free_gb', DISK_CHANGE_GB)):
+            if before.get(metric) is not None and after.get(metric) is not None \
+                    and abs(after[metric] - before[metric]) >= threshold:
+                changes += 1
+                break
+    return changes / (len(points) - 1)
+
+
+def score(entry, points, interval, now):
+    """Priorité d'une machine connue (plus elle est élevée, plus tôt elle est scannée)"""
+    value = 1.0
+    try:
+        age = (now - datetime.strptime(entry.get('date_recuperation', ''), NICE_DATE_FORMAT)).total_seconds()
+        value += min(STALENESS_CAP, max(0.0, age / interval))
+    except ValueError:
+        value += STALENESS_CAP
+    if FIELDS['disk_critical'][1](entry):
+        value += DISK_CRITICAL_WEIGHT
+    elif FIELDS['disk_warning'][1](entry):
+        value += DISK_WARNING_WEIGHT
+    if FIELDS['battery_low'][1](entry):
+        value += BATTERY_LOW_WEIGHT
+    return value + VOLATILITY_WEIGHT * volatility(points)
+
+
+def load_fleet():
+    """Dernier état fusionné : (liste des machines, historique par hostname)"""
+    reducer, _ = observation_log.restore()
+    return reducer.result(), reducer.history
+
+
+def prioritize(ips, machines, history=None, interval=600, now=None):
+    """
+    Trie `ips` par priorité décroissante d'après `machines` (entrées de la fusion).
+
+    Returns:
+        tuple: (IP ordonnées, {ip: priorité} des IP hébergeant une machine connue)
+    """
+    now = now or datetime.now()
+    history = history or {}
+    # Plusieurs machines ont pu occuper la même IP : la plus récente l'emporte
+    by_ip = {}
+    for entry in machines:
+        ip = entry.get('ip')
+        if ip and entry.get('date_recuperation', '') >= by_ip.get(ip, {}).get('date_recuperation', ''):
+            by_ip[ip] = entry
+    scores = {}
+    for ip in ips:
+        entry = by_ip.get(ip)
+        if entry is not None:
+            scores[ip] = score(entry, history.get(entry.get('hostname'), []), interval, now)
+    # Tri stable : à priorité égale (et pour les IP inconnues), ordre des adresses
+    ordered = sorted(ips, key=lambda ip: -scores.get(ip, 0.0))
+    return ordered, scores
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+État fusionné partagé entre les workers uvicorn (`--workers N`).
+
+Sans partage, chaque worker reconstruit et garde en mémoire sa propre fusion.
+Avec API_SHARED_STATE=1, un seul worker (verrou fcntl) calcule la fusion à
+chaque nouvelle version des données et la publie dans un fichier
+(`shared_state/merged.bin`) que tous les workers projettent en mémoire (mmap) :
+les pages du système de fichiers sont partagées, aucun worker ne rejoue le journal.
+
+Format du fichier :
+- en-tête HEADER (magic, version, nombre de machines, tailles des blocs, signature) ;
+- table des positions (uint64) de chaque machine dans le bloc JSON ;
+- bloc JSON des machines (entrées séparées par des virgules) ;
+- historique récent (JSON).
+
+`/machines` (avec pagination) est servi directement depuis ce bloc, sans
+désérialisation. Le fichier `shared_state/version` contient le compteur de
+version (uint64), projeté lui aussi en mémoire : vérifier s'il y a une nouvelle
+publication ne coûte qu'une lecture mémoire.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+from dashboard_renderer import atomic_write
+
+SHARED_STATE = os.getenv("API_SHARED_STATE", "0") == "1"
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "shared_state")
+STATE_FILE = "merged.bin"
+COUNTER_FILE = "version"
+LOCK_FILE = "publish.lock"
+
+MAGIC = b"SMSTATE1"
+# magic, version, nombre de machines, taille du bloc machines, taille de l'historique, signature des données
+HEADER = struct.Struct("<8sQQQQ40s")
+COUNTER = struct.Struct("<Q")
+
+
+def signature_key(signature):
+    """Empreinte (40 caractères) d'une signature de données (voir network_api._data_signature)"""
+    return hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()
+
+
+def encode_json(value):
+    """Même sérialisation que JSONResponse (FastAPI)"""
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _path(name, directory=None):
+    return os.path.join(directory or SHARED_STATE_DIR, name)
+
+
+class SharedView:
+    """Publication projetée en mémoire (lecture seule)"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, machines_size, history_size, signature = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError(f"Fichier d'état partagé invalide : {path}")
+        self.signature = signature.decode("ascii")
+        self._offsets = memoryview(self._mm)[HEADER.size:HEADER.size + 8 * (self.count + 1)].cast("Q")
+        self._machines_start = HEADER.size + 8 * (self.count + 1)
+        self._history_start = self._machines_start + machines_size
+        self._history_end = self._history_start + history_size
+        self._machines = None
+        self._history = None
+        self._lock = threading.Lock()
+
+    def page(self, offset=0, limit=None):
+        """Tableau JSON (bytes) des machines [offset, offset + limit[, lu directement dans le fichier"""
+        start = min(max(offset, 0), self.count)
+        end = self.count if limit is None else min(start + max(limit, 0), self.count)
+        if start >= end:
+            return b"[]"
+        base = self._machines_start
+        # La position de fin pointe après le séparateur : -1
+        return b"[" + self._mm[base + self._offsets[start]:base + self._offsets[end] - 1] + b"]"
+
+    def machines(self):
+        """Liste des machines (dicts), désérialisée une fois par version et par worker"""
+        if self._machines is None:
+            with self._lock:
+                if self._machines is None:
+                    self._machines = json.loads(self.page())
+        return self._machines
+
+    def history(self):
+        if self._history is None:
+            with self._lock:
+                if self._history is None:
+                    self._history = json.loads(self._mm[self._history_start:self._history_end])
+        return self._history
+
+
+_reader = {'counter': None, 'view': None}
+_reader_lock = threading.Lock()
+
+
+def read_version(directory=None):
+    """Compteur de version publié (0 si rien n'a encore été publié)"""
+    counter = _reader['counter']
+    if counter is None:
+        try:
+            with open(_path(COUNTER_FILE, directory), "rb") as f:
+                counter = mmap.mmap(f.fileno(), COUNTER.size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return 0
+        _reader['counter'] = counter
+    return COUNTER.unpack_from(counter)[0]
+
+
+def current(directory=None):
+    """Dernière publication (SharedView) ou None ; re-projetée seulement si le compteur a changé"""
+    version = read_version(directory)
+    view = _reader['view']
+    if version == 0 or (view is not None and view.version >= version):
+        return view
+    with _reader_lock:
+        view = _reader['view']
+        if view is None or view.version < version:
+            try:
+                view = SharedView(_path(STATE_FILE, directory))
+            except (OSError, ValueError) as e:
+                print(f"État partagé illisible : {e}")
+                return _reader['view']
+            # L'ancienne projection est libérée quand plus aucune requête ne l'utilise
+            _reader['view'] = view
+    return view
+
+
+@contextlib.contextmanager
+def publisher_lock(directory=None):
+    """Verrou inter-processus : un seul worker calcule et publie une version"""
+    path = _path(LOCK_FILE, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def publish(signature, machines, history, directory=None):
+    """
+    Publie une nouvelle version (à appeler sous publisher_lock).
+
+    Returns:
+        SharedView: la publication, avec les données déjà désérialisées pour ce worker
+    """
+    directory = directory or SHARED_STATE_DIR
+    version = read_version(directory) + 1
+    entries = [encode_json(entry) for entry in machines]
+    offsets = array("Q", [0])
+    for entry in entries:
+        offsets.append(offsets[-1] + len(entry) + 1)
+    machines_blob = b",".join(entries)
+    history_blob = encode_json(history or {})
+    header = HEADER.pack(MAGIC, version, len(entries), len(machines_blob), len(history_blob), signature.encode("ascii"))
+    atomic_write(_path(STATE_FILE, directory), header + offsets.tobytes() + machines_blob + history_blob)
+
+    # Le compteur n'avance qu'une fois le fichier complet en place
+    counter_path = _path(COUNTER_FILE, directory)
+    fd = os.open(counter_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, COUNTER.pack(version), 0)
+    finally:
+        os.close(fd)
+
+    view = current(directory)
+    if view is not None and view.version == version:
+        view._machines = machines
+        view._history = history
+    return view
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Agent de site : envoi des scans d'un site distant vers l'API centrale.
+
+Un bureau dont le sous-réseau n'est pas joignable depuis le scanner central
+exécute son propre `network_scanner` avec SITE_NAME et CENTRAL_API_URL. Chaque
+scan reste local (snapshots, API du site si elle tourne) et est en plus :
+1. étiqueté avec le site (champ `site` de chaque machine) ;
+2. écrit dans la file `site_spool/batch-<seq>.json.gz` (JSON gzip, numéro de
+   séquence croissant propre au site) ;
+3. envoyé à `POST /ingest` de l'API centrale, lots en attente compris, dans l'ordre.
+
+Un lot n'est supprimé qu'après accusé de réception : en cas de coupure, les lots
+s'accumulent (SITE_SPOOL_MAX au plus, les plus anciens sont abandonnés) et
+partent au scan suivant. L'API centrale ignore un numéro de séquence déjà reçu :
+renvoyer un lot est sans effet.
+"""
+import glob
+import gzip
+import json
+import os
+import re
+import urllib.error
+import urllib.request
+
+from dashboard_renderer import atomic_write
+from machine_record import to_dicts
+
+SITE_NAME = os.getenv("SITE_NAME", "")
+CENTRAL_API_URL = os.getenv("CENTRAL_API_URL", "").rstrip("/")
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "")
+SPOOL_DIR = os.getenv("SITE_SPOOL_DIR", "site_spool")
+SPOOL_MAX = int(os.getenv("SITE_SPOOL_MAX", "500"))
+SEND_TIMEOUT = 30
+
+SEQ_FILE = "seq"
+BATCH_PATTERN = re.compile(r"batch-(\d+)\.json\.gz$")
+
+
+def enabled():
+    """Vrai si ce scanner est un agent de site (SITE_NAME et CENTRAL_API_URL définis)"""
+    return bool(SITE_NAME and CENTRAL_API_URL)
+
+
+def tag(results, site=None):
+    """Ajoute la provenance (`site`) aux machines d'un scan qui n'en ont pas encore"""
+    site = site or SITE_NAME
+    if site:
+        for machine in results:
+            if not machine.get('site'):
+                machine['site'] = site
+    return results
+
+
+def list_batches(directory=None):
+    """Lots en attente triés par séquence : liste de (seq, chemin)"""
+    batches = []
+    for path in glob.glob(os.path.join(directory or SPOOL_DIR, "batch-*.json.gz")):
+        m = BATCH_PATTERN.search(os.path.basename(path))
+        if m:
+            batches.append((int(m.group(1)), path))
+    return sorted(batches)
+
+
+def _next_seq(directory):
+    path = os.path.join(directory, SEQ_FILE)
+    try:
+        with open(path, "r") as f:
+            seq = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        # Compteur perdu : repartir après le plus grand lot encore présent
+        seq = max([s for s, _ in list_batches(directory)], default=0)
+    seq += 1
+    atomic_write(path, str(seq).encode("ascii"))
+    return seq
+
+
+def spool_batch(results, timestamp, directory=None):
+    """Écrit un scan dans la file d'envoi ; retourne son numéro de séquence"""
+    directory = directory or SPOOL_DIR
+    os.makedirs(directory, exist_ok=True)
+    seq = _next_seq(directory)
+    payload = {
+        'site': SITE_NAME,
+        'seq': seq,
+        'reports': [{'timestamp': timestamp, 'machine': machine} for machine in to_dicts(results)],
+    }
+    data = gzip.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode("utf-8"), mtime=0)
+    atomic_write(os.path.join(directory, f"batch-{seq:010d}.json.gz"), data)
+
+    batches = list_batches(directory)
+    for _, path in batches[:max(0, len(batches) - SPOOL_MAX)]:
+        print(f"File d'envoi pleine, lot abandonné : {path}")
+        os.remove(path)
+    return seq
+
+
+def _post(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    if INGEST_TOKEN:
+        headers["X-Ingest-Token"] = INGEST_TOKEN
+    request = urllib.request.Request(f"{CENTRAL_API_URL}/ingest", data=data, headers=headers, method="POST")
+    with urllib.request.urlopen(request, timeout=SEND_TIMEOUT) as response:
+        return json.loads(response.read() or b"{}")
+
+
+def send_pending(directory=None):
+    """
+    Envoie les lots en attente dans l'ordre des séquences ; s'arrête à la première erreur réseau.
+
+    Returns:
+        tuple: (lots envoyés, lots restant en attente)
+    """
+    batches = list_batches(directory)
+    sent = 0
+    for seq, path in batches:
+        try:
+            result = _post(path)
+        except urllib.error.HTTPError as e:
+            if e.code in (400, 413):
+                # Lot refusé définitivement : le renvoyer ne servirait à rien
+                print(f"Lot {seq} refusé par l'API centrale ({e.code}), abandonné")
+                os.remove(path)
+                continue
+            print(f"Envoi du lot {seq} impossible (HTTP {e.code}), nouvel essai au prochain scan")
+            break
+        except (OSError, ValueError) as e:
+            print(f"API centrale injoignable ({e}), {len(batches) - sent} lot(s) en attente")
+            break
+        os.remove(path)
+        sent += 1
+        print(f"Lot {seq} envoyé : {result}")
+    return sent, len(batches) - sent
+
+
+def ship(results, timestamp):
+    """Met un scan en file puis envoie tout ce qui est en attente"""
+    seq = spool_batch(results, timestamp)
+    sent, pending = send_pending()
+    print(f"Site {SITE_NAME} : lot {seq} en file, {sent} envoyé(s), {pending} en attente")
+    return seq
@@ -0,0 +1,130 @@
+#!/bin/bash
+
+# Agent de collecte SMARTELIA : envoie l'état du Mac à l'API (POST /ingest)
+# au lieu d'attendre une connexion SSH du scanner.
+# Exécuté périodiquement par launchd (packaging/launchd/com.smartelia.agent.plist).
+
+# Configuration
+SERVER_URL="http://172.17.18.194:8000"
+INGEST_TOKEN=""
+SPOOL_DIR="/var/tmp/smartelia_agent"
+LOG_FILE="/var/tmp/smartelia_agent.log"
+# Rapports conservés au maximum en cas d'indisponibilité du serveur
+MAX_SPOOL=144
+
+# Fonction de logging
+log() {
+    local level=$1
+    shift
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] [$level] $*" >> "$LOG_FILE"
+}
+
+# Échappement d'une chaîne pour JSON
+json_string() {
+    local s=$1
+    s=${s//\\/\\\\}
+    s=${s//\"/\\\"}
+    s=${s//$'\t'/ }
+    s=${s//$'\n'/ }
+    s=${s//$'\r'/}
+    printf '"%s"' "$s"
+}
+
+# Nombre JSON (ou null)
+json_number() {
+    if [[ "$1" =~ ^[0-9]+$ ]]; then
+        printf '%s' "$1"
+    else
+        printf 'null'
+    fi
+}
+
+# Chaîne JSON (ou null si vide)
+json_optional() {
+    if [ -n "$1" ]; then
+        json_string "$1"
+    else
+        printf 'null'
+    fi
+}
+
+# Mêmes commandes que la collecte SSH (network_scanner.try_ssh_connection)
+collect_report() {
+    local interface=$(route -n get default 2>/dev/null | awk '/interface:/ {print $2}')
+    local ip=$(ipconfig getifaddr "${interface:-en0}" 2>/dev/null)
+    local mac=$(ifconfig "${interface:-en0}" 2>/dev/null | awk '/ether/ {print $2}')
+    local hostname=$(hostname)
+    local model_info=$(system_profiler SPHardwareDataType | grep "Model Name\|Model Identifier" | tr '\n' ' ' | sed 's/ *$//')
+    local macos_version=$(sw_vers -productVersion)
+    local disk_free=$(df -h / | awk 'NR==2 {print $4}')
+    local ram_info=$(top -l 1 | grep PhysMem | awk '{print $2" used, "$6" free"}')
+
+    local batt=$(pmset -g batt)
+    local percent=$(echo "$batt" | grep -Eo '[0-9]+%' | head -1 | tr -d '%')
+    local power_plugged=false
+    if echo "$batt" | grep -q "AC Power\|chargé\|charging"; then
+        power_plugged=true
+    fi
+    local time_left=$(echo "$batt" | grep -Eo '[0-9]+:[0-9]+ remaining' | head -1 | awk '{print $1}')
+    local drawing_from=$(echo "$batt" | sed -n "s/.*Now drawing from '\([^']*\)'.*/\1/p" | head -1)
+
+    local power=$(system_profiler SPPowerDataType)
+    local cycle_count=$(echo "$power" | awk -F': ' '/Cycle Count/ {print $2; exit}' | tr -d ' ')
+    local condition=$(echo "$power" | awk -F': ' '/Condition/ {print $2; exit}')
+    local max_capacity=$(echo "$power" | awk -F': ' '/Maximum Capacity/ {gsub(/[^0-9]/, "", $2); print $2; exit}')
+    local current_user=$(stat -f%Su /dev/console)
+
+    printf '{"timestamp":"%s","machine":{' "$(date '+%Y%m%d_%H%M%S')"
+    printf '"ip":%s,"mac":%s,"hostname":%s,' "$(json_string "${ip:-Unknown}")" "$(json_string "${mac:-Unknown}")" "$(json_string "${hostname:-Unknown}")"
+    printf '"model_info":%s,"macos_version":%s,' "$(json_string "${model_info:-Unknown}")" "$(json_string "${macos_version:-Unknown}")"
+    printf '"disk_free":%s,"ram_info":%s,' "$(json_string "$disk_free")" "$(json_string "$ram_info")"
+    printf '"battery_status":{"percent":%s,"power_plugged":%s,"time_left":%s,"drawing_from":%s},' \
+        "$(json_number "$percent")" "$power_plugged" "$(json_optional "$time_left")" "$(json_optional "$drawing_from")"
+    printf '"battery_details":{"cycle_count":%s,"max_capacity":%s,"condition":%s},' \
+        "$(json_number "$cycle_count")" "$(json_number "$max_capacity")" "$(json_optional "$condition")"
+    printf '"current_user":%s}}\n' "$(json_string "${current_user:-Unknown}")"
+}
+
+# Envoi groupé (gzip) des rapports en attente ; supprimés seulement après accusé de réception
+send_spool() {
+    local files=("$SPOOL_DIR"/report-*.json)
+    [ -e "${files[0]}" ] || return 0
+    local body="$SPOOL_DIR/batch.json.gz"
+    {
+        printf '{"reports":['
+        local first=1
+        for f in "${files[@]}"; do
+            [ $first -eq 1 ] || printf ','
+            first=0
+            tr -d '\n' < "$f"
+        done
+        printf ']}'
+    } | gzip -c > "$body"
+
+    local headers=(-H "Content-Type: application/json" -H "Content-Encoding: gzip")
+    if [ -n "$INGEST_TOKEN" ]; then
+        headers+=(-H "X-Ingest-Token: $INGEST_TOKEN")
+    fi
+    local response
+    if response=$(curl -sS --fail --max-time 30 "${headers[@]}" --data-binary @"$body" "$SERVER_URL/ingest" 2>&1); then
+        rm -f "${files[@]}" "$body"
+        log "INFO" "${#files[@]} rapport(s) envoyé(s) : $response"
+    else
+        rm -f "$body"
+        log "ERROR" "Envoi impossible (${#files[@]} rapport(s) en attente) : $response"
+        return 1
+    fi
+}
+
+main() {
+    mkdir -p "$SPOOL_DIR"
+    collect_report > "$SPOOL_DIR/report-$(date '+%Y%m%d_%H%M%S').json"
+    # File d'attente bornée : les rapports les plus anciens sont abandonnés
+    local count=$(ls -1 "$SPOOL_DIR"/report-*.json 2>/dev/null | wc -l | tr -d ' ')
+    if [ "$count" -gt "$MAX_SPOOL" ]; then
+        ls -1 "$SPOOL_DIR"/report-*.json | sort | head -n $((count - MAX_SPOOL)) | xargs rm -f
+    fi
+    send_spool
+}
+
+main "$@"
@@ -0,0 +1,91 @@
+#!/bin/bash
+
+# Sonde de collecte SMARTELIA exécutée par le scanner via SSH.
+# Déposée une fois par SFTP dans ~/.smartelia/ (remote_probe.py), son empreinte
+# SHA-256 est vérifiée avant chaque exécution. Affiche un objet JSON compact.
+# La table des collecteurs (fin du fichier) est générée par remote_probe.build_script
+# à partir du registre collectors.py : nom, délai maximal, clé de cache (- si aucune), commande.
+# Les collecteurs avec une clé de cache (informations statiques : modèle, santé
+# de la batterie) sont mis en cache et rafraîchis une fois par jour.
+
+PROBE_VERSION=2
+CACHE_DIR="$HOME/.smartelia"
+STATIC_MAX_AGE=86400
+WORK_DIR=$(mktemp -d "${TMPDIR:-/tmp}/smartelia.XXXXXX")
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+# Échappement d'une chaîne pour JSON (retours à la ligne conservés).
+# Les autres caractères de contrôle sont retirés par clean_output ; les octets
+# UTF-8 invalides sont remplacés au décodage côté scanner.
+json_string() {
+    local s=$1
+    s=${s//\\/\\\\}
+    s=${s//\"/\\\"}
+    s=${s//$'\t'/\\t}
+    s=${s//$'\n'/\\n}
+    s=${s//$'\r'/}
+    printf '"%s"' "$s"
+}
+
+# Sortie d'un collecteur sans caractères de contrôle (0x00-0x1F) hors tabulation et retour à la ligne
+clean_output() {
+    LC_ALL=C tr -d '\000-\010\013-\037' < "$1" 2> /dev/null
+}
+
+# Commande avec délai maximal (pas de `timeout` sur macOS)
+run_with_timeout() {
+    local limit=$1 command=$2 out=$3
+    eval "$command" > "$out" 2> /dev/null < /dev/null &
+    local pid=$!
+    ( sleep "$limit" && touch "$out.timeout" && pkill -TERM -P "$pid"; kill -TERM "$pid" ) > /dev/null 2>&1 &
+    local watchdog=$!
+    wait "$pid"
+    local rc=$?
+    pkill -P "$watchdog" > /dev/null 2>&1
+    kill "$watchdog" > /dev/null 2>&1
+    return $rc
+}
+
+run_collector() {
+    local name=$1 limit=$2 cache_key=$3 command=$4
+    [ "$cache_key" = "-" ] && cache_key=""
+    local out="$WORK_DIR/$name" rc=0 ms=0 cached=0 timed_out=0
+    local cache="$CACHE_DIR/static-$cache_key.out"
+    if [ -n "$cache_key" ] && [ -f "$cache" ] &&
+        [ $(( $(date +%s) - $(stat -f %m "$cache" 2>/dev/null || echo 0) )) -lt "$STATIC_MAX_AGE" ]; then
+        cp "$cache" "$out"
+        cached=1
+    else
+        # Durée mesurée par le mot-clé time de bash (millisecondes)
+        local TIMEFORMAT=%3R
+        { time run_with_timeout "$limit" "$command" "$out" ; } 2> "$out.time"
+        rc=$?
+        local elapsed=$(tail -n 1 "$out.time")
+        elapsed=${elapsed/./}
+        [[ "$elapsed" =~ ^[0-9]+$ ]] && ms=$((10#$elapsed))
+        [ -f "$out.timeout" ] && timed_out=1
+        if [ -n "$cache_key" ] && [ $rc -eq 0 ] && [ $timed_out -eq 0 ]; then
+            mkdir -p "$CACHE_DIR"
+            cp "$out" "$cache.tmp" && mv "$cache.tmp" "$cache"
+        fi
+    fi
+    printf '%s:{"rc":%s,"ms":%s,"timeout":%s,"cached":%s,"out":%s}' \
+        "$(json_string "$name")" "$rc" "$ms" "$timed_out" "$cached" "$(json_string "$(clean_output "$out")")"
+}
+
+# Table lue sur le descripteur 3 : les commandes gardent /dev/null comme entrée
+run_all() {
+    local first=1
+    printf '{"v":%s,"c":{' "$PROBE_VERSION"
+    while IFS=$'\t' read -r name limit cache_key command <&3; do
+        [ -n "$name" ] || continue
+        [ $first -eq 1 ] || printf ','
+        first=0
+        run_collector "$name" "$limit" "$cache_key" "$command"
+    done
+    printf '}}\n'
+}
+
+run_all 3<<'SMARTELIA_COLLECTORS'
+@COLLECTORS@
+SMARTELIA_COLLECTORS
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Stockage des snapshots de scan (lecture/écriture centralisées).
+
+Pour limiter les écritures, un scan n'est plus systématiquement écrit en entier :
+- keyframe : `smartelia_machines_<date>.json`, liste complète des machines
+  (format historique, lisible par les anciens outils) ;
+- delta : `smartelia_machines_<date>.delta.json`, uniquement les champs modifiés
+  de chaque machine par rapport à sa dernière observation depuis la keyframe
+  (une machine inchangée n'est représentée que par son hostname).
+
+Une keyframe est écrite tous les SNAPSHOT_KEYFRAME_INTERVAL scans (ou si le scan
+précédent est introuvable). Le lecteur reconstruit l'état complet de chaque scan
+en rejouant les deltas depuis la keyframe qui les précède.
+
+Plusieurs processus écrivent des snapshots (scanner, API pour les agents) : les
+écritures sont sérialisées par un verrou fcntl et la date d'un snapshot est
+toujours postérieure à celle du précédent (décalée d'une seconde si besoin).
+Les noms restent uniques et l'ordre des fichiers est celui des écritures : un
+delta ne s'intercale jamais entre un autre delta et sa base.
+
+Les publications partielles (lots de l'ordonnanceur continu, rapports des agents,
+scan interrompu) sont marquées `.partial` dans le nom du fichier
+(`smartelia_machines_<date>.partial[.delta].json`) : l'historique agrégé ne les
+compte pas comme des scans complets du parc (voir history_store.py).
+
+Format compact (optionnel, SNAPSHOT_FORMAT=jsonl.gz) : `.jsonl.gz` au lieu de
+`.json`, JSON Lines compressé en gzip. La première ligne est un en-tête
+{"format": "smartelia-snapshot", "version": 2, "kind": "keyframe"|"delta", "base": ...},
+puis une ligne par machine (ou par entrée de delta). Les fichiers sont lus en
+flux, ligne à ligne ; les anciens fichiers `.json` restent lisibles, on peut donc
+mélanger les deux formats dans le même répertoire.
+"""
+import contextlib
+import fcntl
+import glob
+import gzip
+import itertools
+import json
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from dashboard_renderer import atomic_write
+
+SNAPSHOT_PREFIX = "smartelia_machines_"
+SNAPSHOT_GLOB = "smartelia_machines_*.json*"
+SNAPSHOT_FILE_PATTERN = re.compile(r"smartelia_machines_(\d{8}_\d{6})(\.partial)?(\.delta)?\.(json|jsonl\.gz)$")
+PARTIAL_MARKER = ".partial"
+DATE_FORMAT = "%Y%m%d_%H%M%S"
+
+# Format d'écriture des nouveaux snapshots : 'json' (historique) ou 'jsonl.gz' (compact)
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json")
+FORMAT_NAME = "smartelia-snapshot"
+FORMAT_VERSION = 2
+
+# Une keyframe complète tous les N scans (1 = désactive les deltas)
+KEYFRAME_INTERVAL = int(os.getenv("SNAPSHOT_KEYFRAME_INTERVAL", "12"))
+
+# Reconstruction parallèle : nombre de processus, et nombre minimal de fichiers pour l'activer
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_MIN_FILES = int(os.getenv("INGEST_PARALLEL_MIN_FILES", "24"))
+
+# Clé listant les champs supprimés dans un delta
+REMOVED_KEY = "__removed__"
+
+# Verrou d'écriture (scanner et API écrivent dans le même répertoire)
+LOCK_FILE = ".smartelia_snapshots.lock"
+
+
+def list_snapshots(directory="."):
+    """Liste triée des (date, chemin, est_keyframe) des snapshots présents"""
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, SNAPSHOT_GLOB)):
+        m = SNAPSHOT_FILE_PATTERN.search(os.path.basename(path))
+        if m:
+            snapshots.append((m.group(1), path, m.group(3) is None))
+    return sorted(snapshots)
+
+
+def is_partial(path):
+    """Vrai si le snapshot ne contient qu'une partie du parc (lot, rapports d'agents, scan interrompu)"""
+    m = SNAPSHOT_FILE_PATTERN.search(os.path.basename(path))
+    return bool(m and m.group(2))
+
+
+def partial_dates(directory="."):
+    """Dates des snapshots partiels"""
+    return {date for date, path, _ in list_snapshots(directory) if is_partial(path)}
+
+
+def snapshot_signature(directory="."):
+    """Signature (nom, mtime, taille) des snapshots : change dès qu'un scan est écrit ou supprimé"""
+    signature = []
+    for _, path, _ in list_snapshots(directory):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        signature.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+def _copy_record(record):
+    """Copie d'un enregistrement (dicts imbriqués inclus) pour isoler l'état interne du lecteur"""
+    return {k: dict(v) if isinstance(v, dict) else v for k, v in record.items()}
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _iter_jsonl(path, chunk_size=1 << 18):
+    """
+    Lit un fichier JSON Lines gzip en flux.
+
+    Les lignes complètes de chaque bloc décompressé sont décodées en un seul appel
+    (json.dumps n'émet jamais de retour à la ligne brut dans une valeur), ce qui
+    évite le coût d'un json.loads par ligne tout en bornant la mémoire utilisée.
+    """
+    decompressor = zlib.decompressobj(wbits=31)
+    pending = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            pending += decompressor.decompress(chunk)
+            complete, _, pending = pending.rpartition(b'\n')
+            if complete:
+                yield from json.loads(b'[' + complete.replace(b'\n', b',') + b']')
+    pending += decompressor.flush()
+    if pending.strip():
+        yield json.loads(pending)
+
+
+def open_snapshot(path):
+    """
+    Ouvre un snapshot, quel que soit son format.
+
+    Returns:
+        tuple: (en-tête, itérateur) ; l'itérateur renvoie les machines d'une keyframe
+        ou les entrées d'un delta, lues en flux pour le format `.jsonl.gz`
+    """
+    if path.endswith('.gz'):
+        lines = _iter_jsonl(path)
+        header = next(lines, None)
+        if not isinstance(header, dict) or header.get('format') != FORMAT_NAME:
+            raise ValueError("en-tête de snapshot absent")
+        if header.get('version', 0) > FORMAT_VERSION:
+            raise ValueError(f"version de format {header.get('version')} non supportée")
+        return header, lines
+    payload = _read_json(path)
+    if isinstance(payload, list):
+        return {'format': FORMAT_NAME, 'version': 1, 'kind': 'keyframe'}, iter(payload)
+    return {'format': FORMAT_NAME, 'version': 1, 'kind': 'delta', 'base': payload.get('base')}, \
+        iter(payload.get('hosts', []))
+
+
+def _apply_delta(known, items):
+    """Reconstruit la liste des machines d'un scan à partir de l'état connu et des entrées d'un delta"""
+    machines = []
+    for item in items:
+        if isinstance(item, str):
+            # Machine inchangée depuis sa dernière observation
+            machines.append(known[item])
+            continue
+        hostname, diff = item
+        record = dict(known.get(hostname, {}))
+        for key in diff.get(REMOVED_KEY, ()):
+            record.pop(key, None)
+        record.update({k: v for k, v in diff.items() if k != REMOVED_KEY})
+        machines.append(record)
+    return machines
+
+
+def _by_hostname(machines):
+    return {m.get('hostname'): m for m in machines if m.get('hostname')}
+
+
+def _replay(snapshots):
+    """
+    Rejoue une suite de snapshots triés.
+
+    Yields:
+        tuple: (date, machines du scan, état connu) ; l'état connu associe à chaque
+        hostname sa dernière observation depuis la keyframe (base des deltas)
+    """
+    previous_date = None
+    known = None
+    for date, path, is_keyframe in snapshots:
+        try:
+            header, items = open_snapshot(path)
+            if header.get('kind') == 'keyframe':
+                machines = list(items)
+                known = {}
+            elif known is None or header.get('base') != previous_date:
+                print(f"Delta {path} ignoré : scan de base {header.get('base')} indisponible")
+                known = None
+                continue
+            else:
+                machines = _apply_delta(known, items)
+        except Exception as e:
+            print(f"Erreur lors de la lecture de {path}: {e}")
+            known = None
+            continue
+        known.update(_by_hostname(machines))
+        previous_date = date
+        yield date, machines, known
+
+
+def _chain_start(snapshots, index):
+    """Indice de la keyframe dont dépend le snapshot `index`"""
+    while index > 0 and not snapshots[index][2]:
+        index -= 1
+    return index
+
+
+def iter_snapshots(since=None, directory="."):
+    """
+    Itère sur les scans dans l'ordre chronologique.
+
+    Args:
+        since: si fourni (date 'YYYYmmdd_HHMMSS'), seuls les scans postérieurs sont
+            renvoyés (les fichiers antérieurs ne sont lus que si un delta en dépend)
+
+    Yields:
+        tuple: (date, liste des machines reconstruites)
+    """
+    snapshots = list_snapshots(directory)
+    start = 0
+    if since:
+        first = next((i for i, (date, _, _) in enumerate(snapshots) if date > since), len(snapshots))
+        start = _chain_start(snapshots, first) if first < len(snapshots) else first
+    for date, machines, _ in _replay(snapshots[start:]):
+        if since is None or date > since:
+            yield date, [_copy_record(m) for m in machines]
+
+
+def list_chains(directory="."):
+    """Snapshots regroupés par chaîne (une keyframe et les deltas qui en dépendent)"""
+    chains = []
+    for snapshot in list_snapshots(directory):
+        if snapshot[2] or not chains:
+            chains.append([])
+        chains[-1].append(snapshot)
+    return chains
+
+
+def _map_chain(func, chain, since, finalize=None):
+    """Exécuté dans un processus de travail : rejoue une chaîne et applique `func` à chaque scan"""
+    results = [
+        (date, func(date, [_copy_record(m) for m in machines]))
+        for date, machines, _ in _replay(chain)
+        if since is None or date > since
+    ]
+    return finalize(results) if finalize else results
+
+
+def map_snapshots(func, since=None, workers=None, directory=".", finalize=None):
+    """
+    Applique `func(date, machines)` à chaque scan postérieur à `since`.
+
+    Les chaînes keyframe -> deltas étant indépendantes, elles sont lues et traitées
+    dans des processus séparés (ProcessPoolExecutor) quand il y a au moins
+    PARALLEL_MIN_FILES fichiers ; `func` (et `finalize`, appliquée aux résultats
+    d'une chaîne avant leur renvoi) doivent donc être des fonctions de module
+    (sérialisables). Les résultats sont renvoyés dans l'ordre chronologique.
+
+    Yields:
+        tuple: (date, func(date, machines))
+    """
+    workers = INGEST_WORKERS if workers is None else workers
+    chains = [c for c in list_chains(directory) if since is None or c[-1][0] > since]
+    if workers <= 1 or len(chains) < 2 or sum(len(c) for c in chains) < PARALLEL_MIN_FILES:
+        for chain in chains:
+            yield from _map_chain(func, chain, since, finalize)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(chains))) as executor:
+        chunksize = max(1, len(chains) // (workers * 4))
+        for results in executor.map(_map_chain, itertools.repeat(func), chains, itertools.repeat(since),
+                                    itertools.repeat(finalize), chunksize=chunksize):
+            yield from results
+
+
+def _replay_last(snapshots):
+    """(date, machines, état connu) du dernier snapshot de la liste, en ne relisant que sa chaîne"""
+    result = (None, [], {})
+    if snapshots:
+        for result in _replay(snapshots[_chain_start(snapshots, len(snapshots) - 1):]):
+            pass
+    return result
+
+
+def latest_snapshot(directory="."):
+    """Retourne (date, machines) du scan le plus récent, ou (None, []) s'il n'y en a pas"""
+    date, machines, _ = _replay_last(list_snapshots(directory))
+    return date, [_copy_record(m) for m in machines]
+
+
+def state_at(when, directory="."):
+    """Reconstruit l'état du parc (date, machines) au dernier scan antérieur ou égal à `when`"""
+    target = when.strftime(DATE_FORMAT) if isinstance(when, datetime) else when
+    date, machines, _ = _replay_last([s for s in list_snapshots(directory) if s[0] <= target])
+    return date, [_copy_record(m) for m in machines]
+
+
+def _chain_length(snapshots):
+    """Nombre de scans depuis la dernière keyframe (keyframe incluse)"""
+    length = 0
+    for _, _, is_keyframe in reversed(snapshots):
+        length += 1
+        if is_keyframe:
+            return length
+    return None
+
+
+def _diff(previous, current):
+    diff = {k: v for k, v in current.items() if previous.get(k, REMOVED_KEY) != v}
+    removed = [k for k in previous if k not in current]
+    if removed:
+        diff[REMOVED_KEY] = removed
+    return diff
+
+
+@contextlib.contextmanager
+def _locked(directory="."):
+    with open(os.path.join(directory, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def write_snapshot(results, date=None, directory=".", partial=False):
+    """
+    Écrit un scan sous forme de keyframe ou de delta.
+
+    Si un snapshot de même date ou plus récent existe déjà, le scan est daté
+    une seconde après lui.
+
+    Args:
+        results: liste des machines du scan
+        date: horodatage 'YYYYmmdd_HHMMSS' (maintenant par défaut)
+        partial: le scan ne couvre qu'une partie du parc (nom marqué `.partial`)
+
+    Returns:
+        str: chemin du fichier écrit
+    """
+    with _locked(directory):
+        return _write_snapshot(results, date or datetime.now().strftime(DATE_FORMAT), directory, partial)
+
+
+def _write_snapshot(results, date, directory, partial):
+    results = [r for r in results if r]
+    snapshots = list_snapshots(directory)
+    if snapshots and snapshots[-1][0] >= date:
+        date = (datetime.strptime(snapshots[-1][0], DATE_FORMAT) + timedelta(seconds=1)).strftime(DATE_FORMAT)
+    chain = _chain_length(snapshots)
+    hostnames = [r.get('hostname') for r in results]
+
+    previous = None
+    if KEYFRAME_INTERVAL > 1 and chain is not None and chain < KEYFRAME_INTERVAL \
+            and all(hostnames) and len(set(hostnames)) == len(hostnames):
+        previous = _replay_last(snapshots)
+        if previous[0] != snapshots[-1][0]:
+            # Chaîne illisible : repartir d'une keyframe
+            previous = None
+
+    compact = SNAPSHOT_FORMAT == "jsonl.gz"
+    extension = "jsonl.gz" if compact else "json"
+    marker = PARTIAL_MARKER if partial else ""
+    if previous is None:
+        path = os.path.join(directory, f"{SNAPSHOT_PREFIX}{date}{marker}.{extension}")
+        header = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'kind': 'keyframe'}
+        items = results
+    else:
+        known = previous[2]
+        items = []
+        for r in results:
+            diff = _diff(known.get(r['hostname'], {}), r)
+            items.append([r['hostname'], diff] if diff or r['hostname'] not in known else r['hostname'])
+        path = os.path.join(directory, f"{SNAPSHOT_PREFIX}{date}{marker}.delta.{extension}")
+        header = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'kind': 'delta', 'base': previous[0]}
+
+    if compact:
+        lines = [json.dumps(header, ensure_ascii=False, separators=(',', ':'))]
+        lines.extend(json.dumps(item, ensure_ascii=False, separators=(',', ':')) for item in items)
+        data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=6, mtime=0)
+    elif previous is None:
+        # Keyframe .json : liste brute, comme les snapshots historiques
+        data = json.dumps(items, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    else:
+        payload = {'format': 'smartelia-delta', 'version': 1, 'base': previous[0], 'hosts': items}
+        data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    atomic_write(path, data)
+    return path
+
+
+def removable_snapshots(max_files, directory="."):
+    """
+    Snapshots supprimables en ne gardant que les `max_files` plus récents.
+
+    Une chaîne keyframe -> deltas n'est jamais coupée : on conserve aussi la
+    keyframe (et les deltas intermédiaires) dont dépend le plus ancien scan gardé.
+    """
+    snapshots = list_snapshots(directory)
+    if len(snapshots) <= max_files:
+        return []
+    first_kept = _chain_start(snapshots, len(snapshots) - max_files)
+    return [(date, path) for date, path, _ in snapshots[:first_kept]]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Cache des échecs SSH (résultats négatifs) avec attente croissante par type d'échec.
+
+Sans ce cache, une machine qui refuse nos identifiants ou qui n'est pas un Mac
+subit à chaque scan une connexion (jusqu'à 5 s) et une authentification par mot
+de passe : temps perdu, et risque de blocage du compte par sshd.
+
+Chaque échec est classé (refused, timeout, auth, not_macos, error) et la
+machine n'est plus contactée en SSH pendant une attente propre à sa classe,
+doublée à chaque nouvel échec consécutif jusqu'à un plafond (BACKOFF). Une
+connexion réussie efface l'entrée.
+
+Les entrées sont indexées par (IP, MAC) : une IP réattribuée par DHCP à une
+autre machine n'hérite pas de l'attente de la précédente. Le cache est
+enregistré dans `ssh_failures.json` en fin de scan ; chaque processus de scan
+fusionne ses changements avec le fichier sous verrou fcntl.
+"""
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+
+import paramiko
+
+from dashboard_renderer import atomic_write
+
+FAILURE_CACHE = os.getenv("SSH_FAILURE_CACHE", "1") == "1"
+FAILURE_CACHE_FILE = os.getenv("SSH_FAILURE_CACHE_FILE", "ssh_failures.json")
+
+# Classe d'échec : (attente initiale, attente maximale) en secondes
+BACKOFF = {
+    'refused': (30 * 60, 6 * 3600),          # port 22 fermé
+    'timeout': (10 * 60, 3600),              # répond au ping mais pas en SSH (pare-feu, veille)
+    'auth': (3600, 24 * 3600),               # identifiants refusés : risque de blocage du compte
+    'not_macos': (24 * 3600, 7 * 24 * 3600),  # SSH accessible mais pas un Mac (sw_vers absent)
+    'error': (10 * 60, 3600),                # autre erreur SSH
+}
+
+
+def classify(exc):
+    """Classe d'échec d'une exception levée pendant la connexion SSH"""
+    if isinstance(exc, paramiko.AuthenticationException):
+        return 'auth'
+    if isinstance(exc, (paramiko.ssh_exception.NoValidConnectionsError, ConnectionRefusedError)):
+        return 'refused'
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return 'timeout'
+    return 'error'
+
+
+def _key(ip, mac):
+    return f"{ip}|{mac or 'Unknown'}"
+
+
+class FailureCache:
+    """Échecs en mémoire (clé "ip|mac") et changements à fusionner dans le fichier"""
+
+    def __init__(self, path=None):
+        self.path = path or FAILURE_CACHE_FILE
+        self.entries = None
+        self._changed = {}
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _loaded(self):
+        if self.entries is None:
+            self.entries = self._read()
+        return self.entries
+
+    def should_skip(self, ip, mac, now=None):
+        """Vrai si la machine est en attente après un échec récent"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._loaded().get(_key(ip, mac))
+        return entry is not None and now < entry['until']
+
+    def record_failure(self, ip, mac, kind, now=None):
+        """Enregistre un échec : attente initiale de sa classe, doublée à chaque échec consécutif"""
+        now = time.time() if now is None else now
+        initial, maximum = BACKOFF.get(kind, BACKOFF['error'])
+        key = _key(ip, mac)
+        with self._lock:
+            previous = self._loaded().get(key)
+            count = previous['count'] + 1 if previous and previous.get('kind') == kind else 1
+            wait = min(maximum, initial * 2 ** (count - 1))
+            entry = {'kind': kind, 'count': count, 'last': now, 'until': now + wait}
+            self.entries[key] = entry
+            self._changed[key] = entry
+        return wait
+
+    def record_success(self, ip, mac):
+        key = _key(ip, mac)
+        with self._lock:
+            if self._loaded().pop(key, None) is not None:
+                self._changed[key] = None
+
+    def save(self):
+        """Fusionne les changements de ce processus avec le fichier (verrou fcntl) puis l'écrit"""
+        with self._lock:
+            changed, self._changed = self._changed, {}
+        if not changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with open(os.path.join(directory, ".ssh_failures.lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                entries = self._read()
+                for key, entry in changed.items():
+                    if entry is None:
+                        entries.pop(key, None)
+                    else:
+                        entries[key] = entry
+                # Entrées expirées depuis plus d'une attente maximale : l'escalade repart de zéro
+                now = time.time()
+                entries = {k: e for k, e in entries.items()
+                           if now < e['until'] + BACKOFF.get(e.get('kind'), BACKOFF['error'])[1]}
+                atomic_write(self.path, json.dumps(entries, separators=(',', ':')).encode("utf-8"))
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        with self._lock:
+            # Les échecs enregistrés par les autres processus deviennent visibles ici aussi
+            entries.update({k: e for k, e in self._changed.items() if e is not None})
+            for key, entry in self._changed.items():
+                if entry is None:
+                    entries.pop(key, None)
+            self.entries = entries
+
+    def summary(self, now=None):
+        """Nombre de machines en attente par classe d'échec"""
+        now = time.time() if now is None else now
+        counts = {}
+        with self._lock:
+            for entry in self._loaded().values():
+                if now < entry['until']:
+                    counts[entry['kind']] = counts.get(entry['kind'], 0) + 1
+        return counts
+
+
+_cache = FailureCache()
+
+
+def should_skip(ip, mac):
+    return FAILURE_CACHE and _cache.should_skip(ip, mac)
+
+
+def record_failure(ip, mac, kind):
+    if FAILURE_CACHE:
+        _cache.record_failure(ip, mac, kind)
+
+
+def record_success(ip, mac):
+    if FAILURE_CACHE:
+        _cache.record_success(ip, mac)
+
+
+def save():
+    if not FAILURE_CACHE:
+        return
+    try:
+        _cache.save()
+        skipped = _cache.summary()
+        if skipped:
+            print(f"Machines en attente après un échec SSH : {skipped}")
+    except Exception as e:
+        print(f"Erreur lors de l'enregistrement du cache des échecs SSH: {e}")